@@ -0,0 +1,174 @@
+__author__ = 'Shannon Jaeger'
+
+from utilities import atomic_write
+import csv
+import os
+import tempfile
+
+
+def _write_changes(file_path, rows):
+    """
+    Write change rows, as JSON lines if the file name ends in .jsonl or
+    .json, otherwise as CSV.
+    :param file_path: The file to write
+    :param rows: iterable of (change, imis, last_name, first_name, old_last_name, old_first_name)
+    :return: None
+    """
+    if os.path.splitext(file_path)[1].lower() in ('.jsonl', '.json'):
+        import json
+        keys = ('change', 'imis', 'last_name', 'first_name', 'old_last_name', 'old_first_name')
+        with atomic_write(file_path) as fp:
+            for row in rows:
+                change = dict(zip(keys, row))
+                if change['change'] != 'renamed':
+                    del change['old_last_name'], change['old_first_name']
+                fp.write(json.dumps(change) + '\n')
+    else:
+        with atomic_write(file_path) as fp:
+            csv_writer = csv.writer(fp, delimiter=",")
+            csv_writer.writerow(Changeset.header)
+            csv_writer.writerows(rows)
+
+
+class Changeset(object):
+    """
+    What merging a new member list into the iMIS data changed: the members
+    who joined, those whose membership lapsed, those who came back and those
+    whose name changed.  ImisFile.merge and ImisStore.merge leave the
+    changeset they made in their changeset attribute when asked to track the
+    changes, ExternalMerge.merge streams them to a file, see ChangesetWriter.
+
+    Attributes:
+        joined: list of (imis, last_name, first_name) of members not in the data before
+        lapsed: list of (imis, last_name, first_name) of members active before and inactive now
+        reactivated: list of (imis, last_name, first_name) of members inactive before and active now
+        renamed: list of (imis, last_name, first_name, old_last_name, old_first_name)
+    """
+
+    kinds = ('joined', 'lapsed', 'reactivated', 'renamed')
+    header = ['Change', 'iMIS', 'Last Name', 'First Name', 'Old Last Name', 'Old First Name']
+
+    def __init__(self):
+        self.joined = []
+        self.lapsed = []
+        self.reactivated = []
+        self.renamed = []
+
+    @classmethod
+    def from_sets(cls, members, joined, lapsed, reactivated, renamed):
+        """
+        Build a changeset from the iMIS numbers of the members in each group.
+        :param members: dict of the merged Members by iMIS number
+        :param joined: set of the iMIS numbers of the members who joined
+        :param lapsed: set of the iMIS numbers of the members whose membership lapsed
+        :param reactivated: set of the iMIS numbers of the members who came back
+        :param renamed: list of (imis, old_last_name, old_first_name) of the members renamed
+        :return: Changeset
+        """
+        changeset = cls()
+        for name, imis_numbers in (('joined', joined), ('lapsed', lapsed), ('reactivated', reactivated)):
+            getattr(changeset, name).extend((imis, members[imis].last_name, members[imis].first_name)
+                                            for imis in sorted(imis_numbers))
+        changeset.renamed.extend((imis, members[imis].last_name, members[imis].first_name, old_last_name,
+                                  old_first_name) for imis, old_last_name, old_first_name in sorted(renamed))
+        return changeset
+
+    def __len__(self):
+        return sum(len(getattr(self, kind)) for kind in self.kinds)
+
+    def counts(self):
+        """
+        :return dict: The number of members in each kind of change
+        """
+        return dict((kind, len(getattr(self, kind))) for kind in self.kinds)
+
+    def rows(self):
+        """
+        :return: generator of (change, imis, last_name, first_name, old_last_name, old_first_name)
+                 rows, each kind of change in iMIS number order, the old names are only
+                 given for renamed members
+        """
+        for kind in self.kinds:
+            for change in sorted(getattr(self, kind)):
+                if len(change) == 3:
+                    change = change + ('', '')
+                yield (kind,) + change
+
+    def write(self, file_path):
+        """
+        Write the changeset, as JSON lines if the file name ends in .jsonl or
+        .json, otherwise as CSV.
+        :param file_path: The file to write
+        :return: None
+        """
+        _write_changes(file_path, self.rows())
+
+
+class ChangesetWriter(object):
+    """
+    Writes what a merge changed as the changes are noted, for merges that
+    don't hold the members in memory, see ExternalMerge.  Each kind of change
+    is spooled to its own temporary file, and only counted in memory, so the
+    changes must be noted in iMIS number order.  The file is written, the same
+    way Changeset.write writes it, when write is called once the merge is done.
+
+    Attributes:
+        file_path: The file the changes are written to
+    """
+
+    def __init__(self, file_path, tmp_dir=None):
+        """
+        :param file_path: The file to write the changes to, see Changeset.write
+        :param tmp_dir: The directory to spool the changes in, the system's temporary directory if not given
+        """
+        self.file_path = file_path
+        self._counts = dict((kind, 0) for kind in Changeset.kinds)
+        self._spools = dict((kind, tempfile.TemporaryFile('w+', newline='', dir=tmp_dir))
+                            for kind in Changeset.kinds)
+        self._writers = dict((kind, csv.writer(spool, delimiter=",")) for kind, spool in self._spools.items())
+
+    def __len__(self):
+        return sum(self._counts.values())
+
+    def counts(self):
+        """
+        :return dict: The number of members in each kind of change
+        """
+        return dict(self._counts)
+
+    def add(self, kind, change):
+        """
+        Note a change.
+        :param kind: One of Changeset.kinds
+        :param change: (imis, last_name, first_name), and for renamed members old_last_name, old_first_name
+        :return: None
+        """
+        self._writers[kind].writerow(change)
+        self._counts[kind] += 1
+
+    def rows(self):
+        """
+        :return: generator of the rows noted, as Changeset.rows gives them
+        """
+        for kind in Changeset.kinds:
+            spool = self._spools[kind]
+            spool.seek(0)
+            for change in csv.reader(spool, delimiter=","):
+                if len(change) == 3:
+                    change = change + ['', '']
+                yield (kind, int(change[0])) + tuple(change[1:])
+
+    def write(self):
+        """
+        Write the changes noted to file_path.
+        :return: None
+        """
+        _write_changes(self.file_path, self.rows())
+
+    def close(self):
+        """
+        Remove the spooled changes.
+        :return: None
+        """
+        for spool in self._spools.values():
+            spool.close()
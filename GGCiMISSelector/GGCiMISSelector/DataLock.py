@@ -0,0 +1,192 @@
+__author__ = 'Shannon Jaeger'
+
+import contextlib
+import errno
+import os
+import struct
+import threading
+import time
+
+# fcntl is only available on Unix, elsewhere no locks are taken and only the
+# version stamp is kept
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+_VERSION = struct.Struct('<Q')
+
+# The locks each thread holds, {lock file path: [exclusive, depth, fd]}, so code
+# holding a data file's lock can call code that takes it again
+_held = threading.local()
+
+
+class DataLock(object):
+    """
+    Advisory locks on an iMIS data file, so processes selecting, merging and
+    compacting it at the same time don't overwrite each other's changes.  A
+    change, which reads the data file and journal and writes them again, is
+    made holding the exclusive lock.  The data file itself is always
+    replaced in one step, see utilities.atomic_write, so it is never seen
+    partly written.
+
+    The locks are fcntl.flock locks on <data file>.lock, not the data file,
+    as writing the data file replaces it.  The lock file also holds a version
+    stamp, a count of the changes made that is odd while the files are being
+    changed.  Reads check the stamp before and after reading rather than wait
+    for the shared lock, so they run alongside each other and alongside a
+    change being worked out, and are only read again if the files changed
+    while they read.  Should a read keep overlapping changes, it waits for
+    the shared lock instead.
+
+    A thread holding a lock may take it again, the lock is released when the
+    outermost hold ends.  Unless the lock is for a data file being created,
+    taking it on a data file that doesn't exist raises FileNotFoundError
+    rather than leave a lock file behind.
+
+    Attributes:
+        data_file_path: The iMIS data file
+        file_path: The path to the lock file
+        create: If True the data file may not exist yet
+    """
+
+    # Times a read is tried against the version stamp before it waits for the shared lock
+    read_attempts = 3
+    # Seconds a read waits for files being changed before trying again
+    retry_wait = 0.05
+
+    def __init__(self, data_file_path, create=False):
+        """
+        :param data_file_path: The iMIS data file the lock is for
+        :param create: If True the data file is being created holding the lock, so it may not exist yet
+        """
+        assert(data_file_path is not None)
+        self.data_file_path = str(data_file_path)
+        self.file_path = self.data_file_path + '.lock'
+        self.create = create
+
+    def _holds(self):
+        held = getattr(_held, 'locks', None)
+        if held is None:
+            held = _held.locks = {}
+        return held
+
+    @contextlib.contextmanager
+    def _locked(self, exclusive):
+        held = self._holds()
+        key = os.path.abspath(self.file_path)
+        if key in held:
+            if exclusive and not held[key][0]:
+                raise RuntimeError('The shared lock on "{0}" can not be made exclusive.'.format(self.data_file_path))
+            held[key][1] += 1
+            try:
+                yield held[key][2]
+            finally:
+                held[key][1] -= 1
+            return
+
+        if not self.create and not os.path.exists(self.data_file_path):
+            raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), self.data_file_path)
+        fd = os.open(self.file_path, os.O_RDWR | os.O_CREAT, 0o666)
+        try:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            held[key] = [exclusive, 1, fd]
+            try:
+                yield fd
+            finally:
+                del held[key]
+        finally:
+            # Closing the file releases the lock
+            os.close(fd)
+
+    @contextlib.contextmanager
+    def exclusive(self):
+        """
+        Hold the exclusive lock while the data file is read and changed, no
+        other process holds either lock meanwhile.
+        :return: None
+        """
+        with self._locked(True) as fd:
+            if self._holds()[os.path.abspath(self.file_path)][1] == 1:
+                version = _read_version(fd)
+                if version % 2 == 1:
+                    # A change that never finished left the stamp odd
+                    _write_version(fd, version + 1)
+            yield
+
+    @contextlib.contextmanager
+    def changing(self):
+        """
+        Mark the files being changed, holding the exclusive lock, so reads made
+        meanwhile are made again.  The version stamp is odd while the files
+        change and moves on again once they have.
+        :return: None
+        """
+        with self._locked(True) as fd:
+            _write_version(fd, _read_version(fd) + 1)
+            try:
+                yield
+            finally:
+                _write_version(fd, _read_version(fd) + 1)
+
+    @contextlib.contextmanager
+    def shared(self):
+        """
+        Hold the shared lock while the data file is read, any number of
+        processes may hold it at once but none holds the exclusive lock.
+        :return: None
+        """
+        with self._locked(False):
+            yield
+
+    def version(self):
+        """
+        :return: The version stamp, 0 if the data file was never changed holding the lock
+        """
+        try:
+            fd = os.open(self.file_path, os.O_RDONLY)
+        except OSError:
+            return 0
+        try:
+            return _read_version(fd)
+        finally:
+            os.close(fd)
+
+    def read(self, function, *args):
+        """
+        Read the data file without waiting for the exclusive lock.  The
+        function is called again if the version stamp shows the files changed
+        while it ran, after read_attempts it's called holding the shared lock.
+        :param function: The function reading the data file
+        :param args: The function's arguments
+        :return: What the function returned
+        """
+        for _ in range(self.read_attempts):
+            version = self.version()
+            if version % 2 == 1:
+                # The files are being changed
+                time.sleep(self.retry_wait)
+                continue
+            try:
+                result = function(*args)
+            except OSError:
+                # A file may have been replaced or removed while it was read
+                if self.version() == version:
+                    raise
+                continue
+            if self.version() == version:
+                return result
+        with self.shared():
+            return function(*args)
+
+
+def _read_version(fd):
+    os.lseek(fd, 0, os.SEEK_SET)
+    data = os.read(fd, _VERSION.size)
+    return _VERSION.unpack(data)[0] if len(data) == _VERSION.size else 0
+
+
+def _write_version(fd, version):
+    os.lseek(fd, 0, os.SEEK_SET)
+    os.write(fd, _VERSION.pack(version))
@@ -13,4 +13,15 @@ class NoImisFile(Exception):
     """
     pass
 
+class NotEnoughMembers(Exception):
+    """
+    Raise when there are fewer eligible members than the number of members
+    that are to be selected.
+    """
+    pass
 
+class ServiceError(Exception):
+    """
+    Raise when a request sent to the selector service can not be met.
+    """
+    pass
@@ -0,0 +1,348 @@
+__author__ = 'Shannon Jaeger'
+
+from Changeset import ChangesetWriter
+from Exceptions import *
+from ImisFile import ImisFile, Member, _merge_member
+from MemberStats import MemberStats, _times_selected
+from Metrics import phase
+from SelectionJournal import SelectionJournal
+from utilities import atomic_write
+from itertools import chain, groupby, islice
+from operator import itemgetter
+import csv
+import heapq
+import marshal
+import os
+import struct
+import tempfile
+
+# Runs are written in batches of rows, each batch marshalled and stored after
+# its length
+_BATCH_LENGTH = struct.Struct('<I')
+
+_by_imis = itemgetter(0)
+
+
+def _output_key(row):
+    """
+    The order rows are written in by ImisFile.write after a merge: active
+    members first, each list sorted like Member.sort_key.
+    """
+    imis, last_name, first_name, active, dates_selected = row
+    return not active, last_name.casefold(), first_name.casefold(), imis
+
+
+def _member_row(member):
+    return member.imis, member.last_name, member.first_name, member.active, member.dates_selected
+
+
+class ExternalMerge(object):
+    """
+    Merge a new member list into an iMIS data file without holding either in
+    memory, for files too large to merge with ImisFile.merge.  The result is
+    the same, row for row, as reading the data file, merging and writing it.
+
+    Both files are sorted on iMIS number by spilling sorted runs to temporary
+    files and merging the runs, a file that is already in iMIS number order
+    is streamed as it is.  The two sorted streams are joined on iMIS number
+    and the merged rows sorted again, the same way, into the order
+    ImisFile.write uses.
+
+    Runs are merged at most fan_in at a time, runs left over from a pass are
+    merged again until no more than fan_in remain, so only so many run files
+    are open at once.  Each run is read and written through a buffer of
+    max_rows // (fan_in + 2) rows, the runs spilled are max_rows less two
+    buffers long and each member list is merged down to a single run before
+    it's joined.  However the three sorts overlap, no more than max_rows rows
+    are held in memory, beyond that only the selection journals are kept.
+    Very small max_rows still hold a row from each of two runs being merged
+    and the one being written.
+
+    Given a changes file, what the merge changed is noted as the streams are
+    joined and spooled to temporary files, see ChangesetWriter, only the
+    counts are held in memory.
+
+    Attributes:
+        max_rows: The most rows the merge holds in memory
+        fan_in: The most runs merged at once
+        tmp_dir: The directory the runs are written to, the system's if None
+        changeset: What the last merge written with a changes file changed, see ChangesetWriter
+    """
+
+    # Default number of rows held in memory
+    max_rows = 100000
+    # Default number of runs merged at once
+    fan_in = 16
+
+    def __init__(self, max_rows=None, tmp_dir=None, fan_in=None):
+        """
+        :param max_rows: The most rows the merge holds in memory, max_rows if not given
+        :param tmp_dir: The directory to write the runs to, the system's temporary directory if not given
+        :param fan_in: The most runs merged at once, fan_in if not given
+        """
+        if max_rows is not None:
+            if max_rows < 1:
+                raise ValueError('At least one row must be held in memory, not {0}.'.format(max_rows))
+            self.max_rows = max_rows
+        if fan_in is not None:
+            if fan_in < 2:
+                raise ValueError('At least two runs must be merged at once, not {0}.'.format(fan_in))
+            self.fan_in = fan_in
+        self.tmp_dir = tmp_dir
+        self._run_dir = None
+        # Runs spilled from rows, and run files written including merge passes
+        self._num_runs = 0
+        self._num_files = 0
+        self.changeset = None
+
+    def _fan_in(self):
+        # Fewer runs are merged at once than there are rows to buffer them in
+        return max(2, min(self.fan_in, self.max_rows - 2))
+
+    def _buffer_rows(self):
+        return max(1, self.max_rows // (self._fan_in() + 2))
+
+    def _run_rows(self):
+        # Room is left for the buffers of the two sorted member lists being joined
+        return max(1, self.max_rows - 2 * self._buffer_rows())
+
+    def merge(self, current_file_path, new_file_paths, output_path=None, changes_path=None):
+        """
+        Merge new member lists into an iMIS data file, see ImisFile.merge and
+        ImisFile.from_files.  When the data file is re-written its selection
+        journal is compacted into it and removed.
+
+        :param current_file_path: The iMIS data file
+        :param new_file_paths: The new member list, or a list of them
+        :param output_path: The file to write the merged data to, the data file if not given
+        :param changes_path: If given write who joined, lapsed, came back or was renamed to this
+                             file once the merge is written, see Changeset.write
+        :return: True if the merge was successful
+        """
+        if current_file_path is None:
+            raise NoImisFile('Must set the iMIS data file path before merging.')
+        if isinstance(new_file_paths, str):
+            new_file_paths = [new_file_paths]
+        if output_path is None:
+            output_path = current_file_path
+        compacting = os.path.abspath(output_path) == os.path.abspath(current_file_path)
+        journal = SelectionJournal(current_file_path)
+
+        # As when the files are read with ImisFile, the data file's journal is
+        # applied and so is a single member list's
+        current_selections = journal.selections()
+        new_selections = SelectionJournal(new_file_paths[0]).selections() if len(new_file_paths) == 1 else {}
+
+        with phase('merge') as merging:
+            with tempfile.TemporaryDirectory(prefix='imis-merge-', dir=self.tmp_dir) as run_dir:
+                self._run_dir = run_dir
+                self.changeset = None if changes_path is None else ChangesetWriter(changes_path, run_dir)
+                try:
+                    old_members = self._members([current_file_path], current_selections)
+                    new_members = self._members(new_file_paths, new_selections)
+                    merged = (_member_row(member) for member in self._join(old_members, new_members,
+                                                                           self.changeset))
+
+                    reader = ImisFile()
+                    stats = MemberStats(output_path)
+                    with atomic_write(output_path, before_replace=journal.stamp if compacting else None) as fp:
+                        csv_writer = csv.writer(fp, delimiter=",", quoting=csv.QUOTE_NONE)
+                        csv_writer.writerow(reader._get_default_header_())
+                        for imis, last_name, first_name, active, dates_selected in self._sorted(merged, _output_key):
+                            csv_writer.writerow([str(imis), last_name, first_name, '1' if active else '0',
+                                                 dates_selected])
+                            stats.add(active, _times_selected(dates_selected))
+                    merging.rows = stats.total
+                    if self.changeset is not None:
+                        self.changeset.write()
+                finally:
+                    self._run_dir = None
+                    if self.changeset is not None:
+                        self.changeset.close()
+
+        if compacting:
+            journal.remove()
+        if stats.exists():
+            stats.save()
+        return True
+
+    def _members(self, file_paths, selections):
+        """
+        The members in files in iMIS number order, the rows of each member
+        folded together as ImisFile.read does and the journal's selections
+        added.
+        :param file_paths: The files to read, their rows are folded in this order
+        :param selections: dict of journal selections, {imis: [date, ...]}
+        :return: generator of Member
+        """
+        reader = ImisFile()
+        if len(file_paths) == 1 and _is_sorted(reader.iter_rows(file_paths[0])):
+            rows = reader.iter_rows(file_paths[0])
+        else:
+            rows = self._sorted(chain.from_iterable(reader.iter_rows(file_path) for file_path in file_paths),
+                                _by_imis, single_run=True)
+
+        for imis, group in groupby(rows, _by_imis):
+            member = None
+            for _, last_name, first_name, active, dates_selected in group:
+                new_member = Member(imis, first_name, last_name, active, dates_selected)
+                if member is None:
+                    member = new_member
+                else:
+                    member.fold(new_member)
+            for date in selections.get(imis, ()):
+                member.add_selection(date)
+            yield member
+
+    @staticmethod
+    def _join(old_members, new_members, changes):
+        """
+        Join the current and new members, both in iMIS number order.
+        :param changes: ChangesetWriter the members who joined, lapsed, came back or were renamed
+                        are noted in, or None
+        :return: generator of the merged Members in iMIS number order
+        """
+        old_member = next(old_members, None)
+        new_member = next(new_members, None)
+        while old_member is not None or new_member is not None:
+            if new_member is None or (old_member is not None and old_member.imis < new_member.imis):
+                if changes is not None and old_member.active:
+                    changes.add('lapsed', (old_member.imis, old_member.last_name, old_member.first_name))
+                old_member.active = False
+                yield old_member
+                old_member = next(old_members, None)
+            elif old_member is None or new_member.imis < old_member.imis:
+                if changes is not None:
+                    changes.add('joined', (new_member.imis, new_member.last_name, new_member.first_name))
+                yield _merge_member(None, new_member)
+                new_member = next(new_members, None)
+            elif changes is None:
+                old_member.active = False
+                yield _merge_member(old_member, new_member)
+                old_member = next(old_members, None)
+                new_member = next(new_members, None)
+            else:
+                was_active = old_member.active
+                old_name = (old_member.last_name, old_member.first_name)
+                old_member.active = False
+                member = _merge_member(old_member, new_member)
+                name = (member.last_name, member.first_name)
+                if was_active != member.active:
+                    changes.add('reactivated' if member.active else 'lapsed', (member.imis,) + name)
+                if name != old_name:
+                    changes.add('renamed', (member.imis,) + name + old_name)
+                yield member
+                old_member = next(old_members, None)
+                new_member = next(new_members, None)
+
+    def _sorted(self, rows, key, single_run=False):
+        """
+        Sort rows holding at most max_rows of them in memory.  The sort is
+        stable, rows with the same key stay in the order they were given in.
+        :param rows: iterable of rows
+        :param key: function giving the key to sort a row on
+        :param single_run: If True the rows are spilled and merged down to one
+                           run however few there are, so reading them only
+                           holds a buffer while other sorts are made
+        :return: iterator of the rows in order
+        """
+        runs = []
+        batch = []
+        run_rows = self._run_rows()
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= run_rows:
+                batch.sort(key=key)
+                runs.append(self._spill(batch))
+                batch = []
+        batch.sort(key=key)
+        if len(runs) == 0 and not single_run:
+            return iter(batch)
+        if len(batch) > 0 or len(runs) == 0:
+            runs.append(self._spill(batch))
+        del batch
+
+        fan_in = 1 if single_run else self._fan_in()
+        while len(runs) > fan_in:
+            runs = self._merge_pass(runs, key)
+        # heapq.merge keeps rows with equal keys in run order
+        return heapq.merge(*[self._read_run(run_path) for run_path in runs], key=key)
+
+    def _merge_pass(self, runs, key):
+        """
+        Merge runs fan_in at a time into new runs, the runs merged are removed.
+        :param runs: list of run paths, in order
+        :param key: function giving the key the runs are sorted on
+        :return: list of the new run paths, in the same order
+        """
+        merged = []
+        fan_in = self._fan_in()
+        for start in range(0, len(runs), fan_in):
+            group = runs[start:start + fan_in]
+            if len(group) == 1:
+                merged.append(group[0])
+                continue
+            merged.append(self._write_run(heapq.merge(*[self._read_run(run_path) for run_path in group], key=key)))
+            for run_path in group:
+                os.remove(run_path)
+        return merged
+
+    def _spill(self, rows):
+        """
+        Spill a sorted run of rows to a temporary file.
+        :return: The path to the run file
+        """
+        self._num_runs += 1
+        return self._write_run(rows)
+
+    def _write_run(self, rows):
+        """
+        Write sorted rows to a run file, a buffer of rows at a time.
+        :param rows: iterable of rows
+        :return: The path to the run file
+        """
+        run_path = os.path.join(self._run_dir, 'run{0}'.format(self._num_files))
+        self._num_files += 1
+        rows = iter(rows)
+        buffer_rows = self._buffer_rows()
+        with open(run_path, 'wb') as fp:
+            while True:
+                batch = list(islice(rows, buffer_rows))
+                if len(batch) == 0:
+                    break
+                batch = marshal.dumps(batch)
+                fp.write(_BATCH_LENGTH.pack(len(batch)))
+                fp.write(batch)
+        return run_path
+
+    def _read_run(self, run_path):
+        """
+        Stream the rows of a run written by _write_run.
+        :return: generator of rows
+        """
+        for batch in self._read_batches(run_path):
+            yield from batch
+
+    def _read_batches(self, run_path):
+        """
+        :return: generator of the batches of rows in a run, each a buffer long
+        """
+        with open(run_path, 'rb') as fp:
+            while True:
+                length = fp.read(_BATCH_LENGTH.size)
+                if len(length) < _BATCH_LENGTH.size:
+                    return
+                yield marshal.loads(fp.read(_BATCH_LENGTH.unpack(length)[0]))
+
+
+def _is_sorted(rows):
+    """
+    :param rows: iterable of rows
+    :return: True if the rows are in iMIS number order, stops at the first one out of order
+    """
+    last_imis = -1
+    for row in rows:
+        if row[0] < last_imis:
+            return False
+        last_imis = row[0]
+    return True
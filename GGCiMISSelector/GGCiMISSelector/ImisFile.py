@@ -1,90 +1,194 @@
 __author__ = 'shannonjaeger'
 
+from Changeset import Changeset
 from Exceptions import *
+from ImisSchema import ImisSchema
+from MemberStats import MemberStats
+from Metrics import phase
+from SelectionJournal import SelectionJournal
+from SnapshotCache import SnapshotCache
+from utilities import atomic_write
+from collections import Counter
+from operator import attrgetter
 import csv
+import marshal
+import os
 
 
 
+def _read_file_rows(file_path):
+    """
+    Parse an iMIS file in a worker process, see ImisFile.from_files.  The
+    rows are sent back marshalled, which is several times quicker than
+    letting them be pickled.
+    :param file_path: The file to read
+    :return bytes: The rows of the file, see ImisFile.iter_rows, marshalled
+    """
+    return marshal.dumps(list(ImisFile().iter_rows(file_path)))
+
+
+def _merge_member(old_member, new_member):
+    """
+    Join a member of a new member list with the member with the same iMIS
+    number in the current data, see ImisFile.merge.  Members we already know
+    about keep the dates they were selected, members we have never seen before
+    are added as they are.
+    :param old_member: The current Member, already marked inactive, or None
+    :param new_member: The Member from the new member list
+    :return: The merged Member
+    """
+    if old_member is None:
+        return new_member
+    if new_member.active:
+        # Update the old member to active and verify the name
+        old_member.active = True
+        if len(new_member.last_name) > 0:
+            old_member.last_name = new_member.last_name
+        if len(new_member.first_name) > 0:
+            old_member.first_name = new_member.first_name
+    else:
+        old_member.fold(new_member)
+    return old_member
+
+
+_by_sort_key = attrgetter('sort_key')
+_by_imis = attrgetter('imis')
+
+
+def _fold_dates(dates_selected, other_dates_selected):
+    """
+    Combine the selection dates of two entries of a member.  A date is kept
+    as many times as the entry listing it most lists it, so an entry that
+    repeats the other isn't counted twice but a member selected more than
+    once on a day keeps each selection.
+    :return: The combined dates, sorted and colon separated
+    """
+    dates = Counter(date for date in dates_selected.split(':') if len(date) > 0)
+    dates |= Counter(date for date in other_dates_selected.split(':') if len(date) > 0)
+    return ':'.join(sorted(dates.elements()))
+
+
 class Member(object):
-    def __init__(self, imis, first_name=None, last_name=None, active=False, dates_selected=[]):
-        try:
-            assert(isinstance(imis, int))
-            self.imis = imis
-        except:
-            self.imis = int(imis)
-
-        try:
-            assert(isinstance(active, bool))
-            self.active = active
-        except:
-            self.active = bool(active)
+    """
+    A member, identified by their iMIS number.  Members are equal when their
+    iMIS numbers are, and sort on sort_key.
+
+    Attributes:
+        imis: The iMIS number
+        first_name, last_name: The member's name
+        active: True if the member is currently a member
+        dates_selected: The dates, YYYYMMDD, the member was selected separated by ':'
+    """
+
+    __slots__ = ('imis', '_first_name', '_last_name', '_active', 'dates_selected', '_sort_key')
+
+    def __init__(self, imis, first_name=None, last_name=None, active=False, dates_selected=''):
+        self.imis = imis if isinstance(imis, int) else int(imis)
+        self._active = active if isinstance(active, bool) else bool(active)
 
         if isinstance(dates_selected, list):
-            self.dates_selected = dates_selected
-        elif isinstance(dates_selected, str):
-            self.dates_selected = dates_selected.split(':')
+            self.dates_selected = ':'.join(dates_selected)
+        elif dates_selected is None:
+            self.dates_selected = ''
+        else:
+            self.dates_selected = str(dates_selected)
+
+        self._first_name = str(first_name) if first_name is not None else ''
+        self._last_name = str(last_name) if last_name is not None else ''
+        self._sort_key = None
+
+    # The sort key is built the first time it is needed and thrown away
+    # whenever one of the values it is built from changes.
+    @property
+    def first_name(self):
+        return self._first_name
+
+    @first_name.setter
+    def first_name(self, value):
+        self._first_name = value
+        self._sort_key = None
+
+    @property
+    def last_name(self):
+        return self._last_name
+
+    @last_name.setter
+    def last_name(self, value):
+        self._last_name = value
+        self._sort_key = None
+
+    @property
+    def active(self):
+        return self._active
+
+    @active.setter
+    def active(self, value):
+        self._active = value
+        self._sort_key = None
+
+    @property
+    def sort_key(self):
+        """
+        The key members are sorted by: inactive before active members, then
+        last name and first name ignoring case.  The iMIS number breaks any ties
+        so the order is always the same.
+        :return: tuple to sort on
+        """
+        if self._sort_key is None:
+            self._sort_key = (self._active, self._last_name.casefold(),
+                              self._first_name.casefold(), self.imis)
+        return self._sort_key
 
-        self.first_name = str(first_name)
-        self.last_name = str(last_name)
-        self.dates_selected = dates_selected
+    @property
+    def times_selected(self):
+        """
+        :return: The number of times the member has been selected
+        """
+        return self.dates_selected.count(':') + 1 if len(self.dates_selected) > 0 else 0
 
     def as_list(self):
-        active = '1' if self.active else '0'
-        return [ str(self.imis), self.last_name, self.first_name, active, self.dates_selected]
+        active = '1' if self._active else '0'
+        return [ str(self.imis), self._last_name, self._first_name, active, self.dates_selected]
 
-    def getKey(self):
-        return  str(self.active)+':'+self.last_name+':'+self.first_name
+    def add_selection(self, date):
+        """
+        Record that the member was selected.
+        :param date: The date selected as YYYYMMDD
+        :return: None
+        """
+        if len(self.dates_selected) < 1:
+            self.dates_selected = date
+        else:
+            self.dates_selected += ':' + date
+
+    def fold(self, other):
+        """
+        Fold the data of a duplicate entry, a member with the same iMIS number,
+        into this member so that nothing read from the file is lost.  Names
+        are only filled in where this member does not have one, selection
+        dates are combined and the member is active if either entry is.
+        :param other: A Member with the same iMIS number
+        :return: None
+        """
+        assert(self.imis == other.imis)
 
-    def __cmp__(self, other):
-        if hasattr(other, 'getKey'):
-            return self.getKey().__cmp__(other.getKey())
+        if len(self.last_name) < 1:
+            self.last_name = other.last_name
+        if len(self.first_name) < 1:
+            self.first_name = other.first_name
+        self.active = self.active or other.active
+        self.dates_selected = _fold_dates(self.dates_selected, other.dates_selected)
 
     def __eq__(self, other):
+        if not hasattr(other, 'imis'):
+            return NotImplemented
         return self.imis == other.imis
 
-    def __ne__(self, other):
-            return self.last_name.lower() != other.last_name.lower() \
-                 or self.first_name.lower() != other.first_name.lower()
+    def __hash__(self):
+        return hash(self.imis)
 
     def __lt__(self, other):
-        if self.active != other.active and self.active:
-            return False
-        elif self.active != other.active:
-            return True
-        elif self.last_name.lower() != other.last_name.lower():
-            return self.last_name.lower() < other.last_name.lower()
-        else:
-            return self.first_name.lower() < other.first_name.lower()
-
-    def __gt__(self, other):
-        if self.active != other.active and not self.active:
-            return False
-        elif self.active != other.active:
-            return True
-        elif self.last_name.lower() != other.last_name.lower():
-            return self.last_name.lower() > other.last_name.lower()
-        else:
-            return self.first_name.lower() > other.first_name.lower()
-
-    def __le__(self, other):
-        if self.active != other.active and self.active:
-            return False
-        elif self.active != other.active:
-            return True
-        elif self.last_name.lower() != other.last_name.lower():
-            return self.last_name.lower() <= other.last_name.lower()
-        else:
-            return self.first_name.lower() <= other.first_name.lower()
-
-    def __ge__(self, other):
-        if self.active != other.active and not self.active:
-            return False
-        elif self.active != other.active:
-            return True
-        elif self.last_name.lower() != other.last_name.lower():
-            return self.last_name.lower() >= other.last_name.lower()
-        else:
-            return self.first_name.lower() >= other.first_name.lower()
+        return self.sort_key < other.sort_key
 
     def __str__(self):
         return '{0} {1: >8}: {2: >20} {3: >15} - {4}'.format(str(self.active),
@@ -105,18 +209,28 @@ class ImisFile():
     """
 
 
-    def __init__(self, file_path=None):
+    def __init__(self, file_path=None, use_cache=False):
+        """
+        :param file_path: The iMIS data file, it is read if given
+        :param use_cache: If True keep a snapshot of the parsed file next to it
+                          and use it instead of parsing the file when it hasn't changed
+        """
         self.imis_header = 'iMIS'
         self.last_name_header = 'Last Name'
         self.first_name_header = 'First Name'
         self.active_header = 'Active'
         self.dates_selected_header = 'Dates Selected'
 
+        self.members = {}
         self.active_member_list = []
         self.inactive_member_list = []
         self.num_active_selected = 0
         self.num_inactive_selected = 0
 
+        # What the last merge changed, see Changeset
+        self.changeset = None
+
+        self.use_cache = use_cache
         self.file_path = None
         if file_path is not None:
             self.set_file_path(file_path)
@@ -141,38 +255,57 @@ class ImisFile():
         return self.file_path
 
 
-    def _parse_headings(self, headings):
+    def _parse_headings(self, headings, file_path=None):
         """
         Find which column the various potential headers are in the given set of
         headings.  Note that only the iMIS number is the only column that must be
         there.
         :param headings: the headings as a list
-        :return heading_columns:
+        :param file_path: the file the headings are from, used in error messages
+        :return ImisSchema: the layout of the file, used to decode its rows
         """
-        import re
+        return ImisSchema(headings, file_path if file_path is not None else self.file_path)
 
-        heading_columns = {'imis': -1,
-                       'last_name': -1,
-                       'first_name': -1,
-                       'active': -1,
-                       'dates_selected': -1
-        }
 
-        for i in range(0,len(headings)):
-            headings[i] = headings[i].lower();
-            headings[i] = re.sub('\s+', ' ', headings[i] ).strip()
-            headings[i] = headings[i].replace('\r\n', '')
-            headings[i] = headings[i].replace('\n', '')
+    def iter_rows(self, file_path=None):
+        """
+        Stream the rows of a CSV file containing iMIS numbers one at a time, only
+        the current row is held in memory.  The columns are found from the
+        headings in the first line of the file, see _parse_headings.  Rows without
+        an iMIS number are skipped and no duplicate checking is done.
+
+        :param file_path: The file to read, the file path of this object if not given
+        :return: generator of (imis, last_name, first_name, active, dates_selected) tuples
+        """
+        if file_path is None:
+            file_path = self.file_path
+        if file_path is None:
+            raise NoImisFile("An iMIS file path has not been provided.")
 
-        for key in heading_columns.keys():
-            search_item = key.lower().replace('_', ' ')
-            heading_columns[key] = headings.index(search_item) if search_item in headings else -1
+        with open(file_path, 'r', newline='') as fp:
+            reader = csv.reader(fp, delimiter=",", quoting=csv.QUOTE_NONE)
+            for line in reader:
+                with phase('parse headings'):
+                    decode = self._parse_headings(line, file_path).decode
+                break
+            else:
+                raise InvalidImisFile('File "{0}" is empty.'.format(str(file_path)))
 
-        if heading_columns['imis'] == -1:
-            raise InvalidImisFile('File "{0}" does not have an iMIS number column.'.format(str(self.file_path)))
+            for line in reader:
+                row = decode(line)
+                if row is not None:
+                    yield row
 
-        return heading_columns
+    def iter_members(self, file_path=None):
+        """
+        Stream the members in a CSV file containing iMIS numbers one at a time,
+        see iter_rows.
 
+        :param file_path: The file to read, the file path of this object if not given
+        :return: generator of Member
+        """
+        for imis, last_name, first_name, active, dates_selected in self.iter_rows(file_path):
+            yield Member(imis, first_name, last_name, active, dates_selected)
 
     def read(self):
         """
@@ -185,48 +318,121 @@ class ImisFile():
             Selection Dates
 
         If the file is successfully read a list of active and inactive members is
-        created.
+        created.  Members are indexed by iMIS number, if an iMIS number appears
+        more than once the rows are folded into a single member.  Selections
+        recorded in the file's journal since it was last written are applied.
+
+        If use_cache is set the rows are taken from the file's snapshot when it
+        is up to date, otherwise a snapshot is saved once the file is parsed.
 
         :return None:
         """
-
+        with phase('read') as reading:
+            with phase('build members') as building:
+                self._add_rows(self._read_rows())
+                building.rows = len(self.members)
+            self._apply_journal()
+            self._split_members()
+            reading.rows = len(self.members)
+
+    def _add_rows(self, rows):
+        """
+        Add the members in rows to the member index, a member already in the
+        index has the row folded into it so no data is lost.
+        :param rows: iterable of rows, see iter_rows
+        :return: None
+        """
+        members = self.members
+        for imis, last_name, first_name, active, dates_selected in rows:
+            new_member = Member(imis, first_name, last_name, active, dates_selected)
+            old_member = members.get(imis)
+            if old_member is None:
+                members[imis] = new_member
+            else:
+                old_member.fold(new_member)
+
+    @classmethod
+    def from_files(cls, file_paths, max_workers=None):
+        """
+        Read several iMIS files, such as the member lists exported for each
+        council, into one ImisFile with no file path.  The files are parsed in
+        parallel in worker processes and their rows folded together on iMIS
+        number in one pass, in the order the files are given.
+
+        :param file_paths: The files to read
+        :param max_workers: The most worker processes to use, one per CPU if not
+                            given, with 1 the files are parsed in this process
+        :return: ImisFile
+        """
+        file_paths = [str(file_path) for file_path in file_paths]
+        combined = cls()
+        with phase('read exports') as reading:
+            if len(file_paths) > 1 and max_workers != 1:
+                from concurrent.futures import ProcessPoolExecutor
+                if max_workers is None:
+                    max_workers = min(len(file_paths), os.cpu_count() or 1)
+                with ProcessPoolExecutor(max_workers=max_workers) as executor:
+                    for rows in executor.map(_read_file_rows, file_paths):
+                        combined._add_rows(marshal.loads(rows))
+            else:
+                for file_path in file_paths:
+                    combined._add_rows(combined.iter_rows(file_path))
+
+            combined._split_members()
+            reading.rows = len(combined.members)
+        return combined
+
+    def _read_rows(self):
+        """
+        The rows of this object's file, from the snapshot cache if it is in use.
+        :return: iterable of rows, see iter_rows
+        """
+        if not self.use_cache:
+            return self.iter_rows()
         if self.file_path is None:
             raise NoImisFile("An iMIS file path has not been provided.")
 
-        column_locations = {}
-        with open(self.file_path, 'rU') as fp:
-            reader = csv.reader(fp, delimiter=",", quoting=csv.QUOTE_NONE)
-            for line in reader:
-                if len(column_locations) < 1:
-                    column_locations = self._parse_headings(line)
-                    continue
-
-                if len(line) < 1: continue # Empty line
-
-                if not line[column_locations['imis']].isdigit():
-                    # No iMIS number on line so skip it
-                    # TODO verify this is not an error
-                    continue
-
-                # If we've made it here we have a new member!
-                new_member = Member(imis=line[column_locations['imis']])
+        cache = SnapshotCache(self.file_path)
+        rows = cache.load()
+        if rows is None:
+            rows = list(self.iter_rows())
+            cache.save(rows)
+        return rows
 
-                new_member.first_name = line[column_locations['first_name']] \
-                        if column_locations['first_name'] != -1 else ''
-                new_member.last_name = line[column_locations['last_name']] \
-                        if column_locations['last_name'] != -1 else ''
-                new_member.active = bool(line[column_locations['active']]) \
-                        if column_locations['active'] != -1 else True
-                new_member.dates_selected = line[column_locations['dates_selected']] \
-                        if column_locations['dates_selected'] != -1 else ''
+    def _apply_journal(self):
+        """
+        Add the selections in the journal of this file to the members, those
+        that are not in the file yet, see SelectionJournal.entries.
+        :return: None
+        """
+        for imis, dates in SelectionJournal(self.file_path).selections().items():
+            member = self.members.get(imis)
+            if member is None:
+                continue
+            for date in dates:
+                member.add_selection(date)
+
+    def _split_members(self):
+        """
+        Rebuild the active and inactive member lists from the member index.
+        :return: None
+        """
+        self.active_member_list = []
+        self.inactive_member_list = []
+        for member in self.members.values():
+            if member.active:
+                self.active_member_list.append(member)
+            else:
+                self.inactive_member_list.append(member)
 
-                # Now lets add this member to the active or inactive member list
-                # TODO if a duplicate is found make sure to not lose any data
-                if new_member.active and new_member not in self.active_member_list:
-                    self.active_member_list.append(new_member)
-                elif not new_member.active and new_member not in self.inactive_member_list:
-                    self.inactive_member_list.append(new_member)
 
+    def as_table(self):
+        """
+        The members of this file stored as columns, see MemberTable.
+        :return: MemberTable
+        """
+        from MemberTable import MemberTable
+        return MemberTable.from_imis_file(self)
 
     def _get_default_header_(self, ):
         """
@@ -238,10 +444,28 @@ class ImisFile():
                     self.active_header, self.dates_selected_header]
 
 
-    def write(self, file_path=None):
+    def _get_legacy_header_(self, num_dates=4):
+        """
+        The headers of the layout the legacy number_selector wrote ...
+           IMIS, Last Name, First Name, Active, Selected 1, ... Selected 4
+        with more Selected columns for members selected more than four times.
+        :param num_dates: The number of Selected columns
+        :return: the header strings in a list
+        """
+        return (['IMIS', self.last_name_header, self.first_name_header, self.active_header] +
+                ['Selected {0}'.format(i) for i in range(1, max(num_dates, 4) + 1)])
+
+    def write(self, file_path=None, legacy=False, imis_order=False):
         """
-        Write the inactive and active member lists to a file.
+        Write the inactive and active member lists to a file.  The file is
+        replaced in one step so a crash never leaves it partly written.  When
+        the data is written back to this object's own file the selection journal
+        is compacted into it and removed.
         :param file_path: The path to the file where the data is to be written.
+        :param legacy: If True write the layout of the legacy number_selector, a
+                       Selected column for each date, see _get_legacy_header_
+        :param imis_order: If True write the members in iMIS number order, as
+                           number_selector did, rather than the active members first
         :return: None
         """
 
@@ -251,16 +475,54 @@ class ImisFile():
             file_path = self.file_path
 
         full_list = self.active_member_list + self.inactive_member_list
-        #sorted_list = sorted(full_list)
-
-        with open(file_path, 'w') as fp:
-            csv_writer = csv.writer( fp, delimiter=",", quoting=csv.QUOTE_NONE)
-            csv_writer.writerow(self._get_default_header_())
-            for member in full_list:
-                csv_writer.writerow(member.as_list())
-
-
-    def merge(self, new_file_obj):
+        if imis_order:
+            full_list.sort(key=_by_imis)
+
+        compacting = self.file_path is not None and os.path.abspath(file_path) == os.path.abspath(self.file_path)
+        journal = SelectionJournal(self.file_path) if compacting else None
+        with phase('write') as writing:
+            with atomic_write(file_path, before_replace=journal.stamp if compacting else None) as fp:
+                csv_writer = csv.writer( fp, delimiter=",", quoting=csv.QUOTE_NONE)
+                if legacy:
+                    self._write_legacy_rows(csv_writer, full_list)
+                else:
+                    csv_writer.writerow(self._get_default_header_())
+                    for member in full_list:
+                        csv_writer.writerow(member.as_list())
+            writing.rows = len(full_list)
+
+        if compacting:
+            journal.remove()
+            if self.use_cache:
+                # Save the snapshot now so the next read doesn't parse what we just wrote
+                SnapshotCache(self.file_path).save([(m.imis, m.last_name, m.first_name, m.active, m.dates_selected)
+                                                    for m in full_list])
+            stats = MemberStats(self.file_path)
+            if stats.exists():
+                # Keep the saved counts up to date rather than leave them to
+                # be counted again
+                MemberStats.from_members(full_list, self.file_path).save()
+
+
+    def _write_legacy_rows(self, csv_writer, members):
+        """
+        Write members in the legacy number_selector layout, the dates a member
+        was selected each in a column of its own.
+        :param csv_writer: The csv writer of the file
+        :param members: list of the Members to write
+        :return: None
+        """
+        num_dates = max([member.times_selected for member in members], default=0)
+        header = self._get_legacy_header_(num_dates)
+        csv_writer.writerow(header)
+        # number_selector left an empty row under the headings
+        csv_writer.writerow([''] * len(header))
+        padding = [''] * (len(header) - 4)
+        for member in members:
+            dates = member.dates_selected.split(':') if len(member.dates_selected) > 0 else []
+            csv_writer.writerow(member.as_list()[:4] + dates + padding[len(dates):])
+
+    def merge(self, new_file_obj, track_changes=False):
         """
         Merge this iMIS file object with a new file.  It is assumed that the new
         file contains a complete list of the current active members.  It is the
@@ -268,65 +530,81 @@ class ImisFile():
 
         After the merge the internal data structures will contain the "merged"
         data, each iMIS number will appear on either the active or inactive list
-        exactly once.
+        exactly once.  The two files are joined on iMIS number in a single pass
+        and the member lists are sorted once at the end.  With track_changes who
+        joined, lapsed, came back or was renamed is noted as the members are
+        marked inactive and joined, and left in changeset.
 
         :param new_file (str/ImisFile): If it is a string then it's assumed to be a
         fully specified file path, if it is an ImisFile object who's file_path has
-        been set.
+        been set or that has been read, see from_files.
+        :param track_changes: If True leave what the merge changed in changeset, see Changeset,
+                              otherwise changeset is None
         :return: True if the merge was successful, False otherwise
         """
-        if self.file_path is  None:
-            raise NoImisFile('Must set ')
+        if self.file_path is None:
+            raise NoImisFile('Must set the iMIS data file path before merging.')
 
-        new_file = ImisFile()
         if isinstance(new_file_obj, str):
             # new_file is a file_path
+            new_file = ImisFile()
             new_file.set_file_path(new_file_obj)
-        elif new_file_obj.__class__ == ImisFile:
-            # nothing to do
-            pass
+        elif isinstance(new_file_obj, ImisFile):
+            new_file = new_file_obj
         else:
             raise ValueError('file_path must be a string or ImisFile type.')
 
         # If we haven't read in the files then read them in
-        if len(self.inactive_member_list) == 0 and len(self.active_member_list) == 0:
+        if len(self.members) == 0:
             self.read()
-        if len(new_file.inactive_member_list) == 0 and len(new_file.active_member_list) == 0:
+        if len(new_file.members) == 0 and new_file.file_path is not None:
             new_file.read()
 
+        self.changeset = None
+        with phase('merge') as merging:
+            members = self.members
+            if track_changes:
+                # Members who were active and are not in the new file by the end
+                # of the join have lapsed
+                lapsed = set()
+                joined = []
+                reactivated = []
+                renamed = []
+
+            # Mark all of the old (self) active members as inactive, the new file
+            # decides who is active now.
+            for member in members.values():
+                if member._active:
+                    if track_changes:
+                        lapsed.add(member.imis)
+                    member.active = False
+
+            # Join the members from the new file on iMIS number
+            for imis, new_member in new_file.members.items():
+                old_member = members.get(imis)
+                if old_member is None:
+                    members[imis] = new_member
+                    if track_changes:
+                        joined.append(imis)
+                    continue
+                if not track_changes:
+                    _merge_member(old_member, new_member)
+                    continue
 
-        # Mark all of the old (self) active members as inactive
-        for member in self.active_member_list:
-            member.active = False
-            self.inactive_member_list.append(member)
-        self.active_member_list=[]
-
-        # Go through the active member list from the new_file.  If a member
-        # is found in the inactive list then move this member to the active
-        # member list. Note that any dates that the members iMIS number was
-        # selected will be in the old data
-        new_file.active_member_list.sort()
-        for new_member in new_file.active_member_list:
-            try:
-                pos = self.inactive_member_list.index(new_member)
-                old_member = self.inactive_member_list.pop(pos)
-            except ValueError:
-                # The member isn't in the list
-                old_member = None
-
-            # Update the old member to active and verify the name
-            old_member.active = True
-            if len(new_member.last_name) > 0 \
-                    and new_member.last_name != old_member.last_name:
-                old_member.last_name = new_member.last_name
-            if len(new_member.first_name) > 0 \
-                    and new_member.first_name != old_member.first_name:
-                old_member.first_name = new_member.first_name
-
-            self.active_member_list.append(old_member)
-
-        self.inactive_member_list = self.inactive_member_list + new_file.inactive_member_list
-        self.inactive_member_list.sort()
-
-
-
+                last_name, first_name = old_member._last_name, old_member._first_name
+                _merge_member(old_member, new_member)
+                if old_member._active:
+                    if imis in lapsed:
+                        lapsed.discard(imis)
+                    else:
+                        reactivated.append(imis)
+                if old_member._last_name != last_name or old_member._first_name != first_name:
+                    renamed.append((imis, last_name, first_name))
+
+            if track_changes:
+                self.changeset = Changeset.from_sets(members, joined, lapsed, reactivated, renamed)
+            self._split_members()
+            self.active_member_list.sort(key=_by_sort_key)
+            self.inactive_member_list.sort(key=_by_sort_key)
+            merging.rows = len(self.members)
+        return True
@@ -0,0 +1,140 @@
+__author__ = 'Shannon Jaeger'
+
+from Exceptions import *
+from operator import itemgetter
+import re
+
+_whitespace = re.compile(r'\s+')
+_legacy_date_heading = re.compile(r'selected (\d+)$')
+
+
+def _parse_active(value):
+    """
+    Interpret the value of an Active column, "0", "false", "no" and empty
+    values mean the member is inactive.
+    :param value: The string read from the file
+    :return: True if the member is active, False otherwise
+    """
+    return value.strip().lower() not in ('', '0', 'false', 'no')
+
+
+def _normalize(heading):
+    return _whitespace.sub(' ', heading.lower()).strip()
+
+
+class ImisSchema(object):
+    """
+    The layout of an iMIS CSV file, compiled from its heading line once so
+    each row is decoded with a single itemgetter call rather than by looking
+    up and checking each column for every row.
+
+    The columns are found by heading, ignoring case and spacing, under any of
+    the names in aliases.  Both the current layout, with the dates a member
+    was selected joined in one "Dates Selected" column, and the legacy layout
+    written by number_selector, with "ID" or "IMIS" and a "Selected 1" to
+    "Selected 4" column, or more, for each date, are understood.  Only the iMIS number
+    column must be there.
+
+    Attributes:
+        columns: dict of the column of each field, imis, last_name, first_name
+                 and active, -1 if the file doesn't have it
+        date_columns: tuple of the columns holding the dates selected
+        decode: function decoding the list of fields on a line into a row,
+                (imis, last_name, first_name, active, dates_selected), or None
+                if the line has no iMIS number
+    """
+
+    # The headings each field may be found under, in order of preference
+    aliases = {'imis': ('imis', 'id'),
+               'last_name': ('last name',),
+               'first_name': ('first name',),
+               'active': ('active',)}
+    dates_selected_aliases = ('dates selected',)
+
+    def __init__(self, headings, file_path=None):
+        """
+        :param headings: list of the headings on the first line of the file
+        :param file_path: the file the headings are from, used in error messages
+        """
+        positions = {}
+        for i, heading in enumerate(headings):
+            positions.setdefault(_normalize(heading), i)
+
+        self.columns = {}
+        for field, aliases in self.aliases.items():
+            self.columns[field] = next((positions[alias] for alias in aliases if alias in positions), -1)
+        if self.columns['imis'] == -1:
+            raise InvalidImisFile('File "{0}" does not have an iMIS number column.'.format(str(file_path)))
+
+        date_columns = tuple(positions[alias] for alias in self.dates_selected_aliases if alias in positions)[:1]
+        if len(date_columns) == 0:
+            # number_selector kept each date in a column of its own, "Selected 1",
+            # "Selected 2" and so on
+            numbered = []
+            for heading, i in positions.items():
+                match = _legacy_date_heading.match(heading)
+                if match is not None:
+                    numbered.append((int(match.group(1)), i))
+            date_columns = tuple(i for _, i in sorted(numbered))
+        self.date_columns = date_columns
+        self.decode = self._compile()
+
+    def _compile(self):
+        """
+        Build the decode function for this layout.  When every column is there,
+        as it is in the files written by ImisFile and number_selector, a line
+        with all of the columns is decoded with one itemgetter call; shorter
+        lines, and files missing a column, are decoded by _decode_partial.
+        """
+        imis_col = self.columns['imis']
+        name_cols = (self.columns['last_name'], self.columns['first_name'], self.columns['active'])
+        date_columns = self.date_columns
+        if min(name_cols) < 0 or len(date_columns) == 0:
+            return self._decode_partial
+
+        width = max((imis_col,) + name_cols + date_columns) + 1
+        getter = itemgetter(imis_col, *(name_cols + date_columns))
+        decode_partial = self._decode_partial
+
+        if len(date_columns) == 1:
+            def decode(line):
+                if len(line) < width:
+                    return decode_partial(line)
+                imis, last_name, first_name, active, dates_selected = getter(line)
+                if not imis.isdigit():
+                    # Empty line or no iMIS number on line so skip it
+                    return None
+                return (int(imis), last_name, first_name,
+                        active == '1' or (active != '0' and _parse_active(active)), dates_selected)
+        else:
+            def decode(line):
+                if len(line) < width:
+                    return decode_partial(line)
+                imis, last_name, first_name, active, *dates = getter(line)
+                if not imis.isdigit():
+                    return None
+                return (int(imis), last_name, first_name,
+                        active == '1' or (active != '0' and _parse_active(active)),
+                        ':'.join(date for date in dates if date))
+        return decode
+
+    def _decode_partial(self, line):
+        """
+        Decode a line that may be missing some of the columns, a missing name
+        is empty, a missing active flag means the member is active.
+        """
+        imis_col = self.columns['imis']
+        num_cols = len(line)
+        if num_cols <= imis_col or not line[imis_col].isdigit():
+            # Empty line or no iMIS number on line so skip it
+            # TODO verify this is not an error
+            return None
+
+        last_name_col = self.columns['last_name']
+        first_name_col = self.columns['first_name']
+        active_col = self.columns['active']
+        return (int(line[imis_col]),
+                line[last_name_col] if -1 < last_name_col < num_cols else '',
+                line[first_name_col] if -1 < first_name_col < num_cols else '',
+                _parse_active(line[active_col]) if -1 < active_col < num_cols else True,
+                ':'.join(line[col] for col in self.date_columns if col < num_cols and line[col]))
@@ -0,0 +1,323 @@
+__author__ = 'Shannon Jaeger'
+
+from Changeset import Changeset
+from Exceptions import *
+from ImisFile import ImisFile, Member, _fold_dates
+from MemberPool import tier_level
+from MemberStats import _times_selected
+from utilities import atomic_write
+import csv
+import random
+import sqlite3
+import time
+
+
+def is_store_path(file_path):
+    """
+    Decide if a file path names an SQLite iMIS store rather than a CSV file,
+    based on the file extension.
+    :param file_path: The file path
+    :return: True if the path is an SQLite database
+    """
+    return str(file_path).lower().endswith(('.db', '.sqlite', '.sqlite3'))
+
+
+class ImisStore(object):
+    """
+    iMIS member data kept in an SQLite database.  It holds the same data as an
+    iMIS CSV data file but a selection only updates the rows of the members
+    selected instead of re-writing the whole file, and merges are done with
+    SQL on the database.  Names are compared ignoring case and duplicate
+    selection dates are folded with the same functions ImisFile uses, made
+    available to SQL as casefold, fold_dates and count_dates.
+
+    Attributes:
+        db_path: The path to the SQLite database file
+        connection: The sqlite3 connection to the database
+        changeset: What the last merge changed, see Changeset
+    """
+
+    def __init__(self, db_path=None):
+        self.db_path = None
+        self.connection = None
+        self.changeset = None
+        if db_path is not None:
+            self.open(db_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def open(self, db_path):
+        """
+        Open, creating it if needed, the SQLite database holding the iMIS data.
+        :param db_path: A fully specified file path to the database, or ':memory:'
+        :return: None
+        """
+        assert(db_path is not None)
+
+        self.close()
+        self.db_path = db_path
+        self.connection = sqlite3.connect(db_path)
+        self.connection.create_function('casefold', 1, str.casefold, deterministic=True)
+        self.connection.create_function('fold_dates', 2, _fold_dates, deterministic=True)
+        self.connection.create_function('count_dates', 1, _times_selected, deterministic=True)
+        with self.connection:
+            self.connection.execute("""
+                CREATE TABLE IF NOT EXISTS members (
+                    imis INTEGER PRIMARY KEY,
+                    last_name TEXT NOT NULL DEFAULT '',
+                    first_name TEXT NOT NULL DEFAULT '',
+                    active INTEGER NOT NULL DEFAULT 1,
+                    times_selected INTEGER NOT NULL DEFAULT 0,
+                    dates_selected TEXT NOT NULL DEFAULT '')""")
+            self.connection.execute("""
+                CREATE INDEX IF NOT EXISTS members_active
+                    ON members (active, times_selected)""")
+            self.connection.execute("""
+                CREATE INDEX IF NOT EXISTS members_times_selected
+                    ON members (times_selected)""")
+
+    def close(self):
+        """
+        Close the database connection, if there is one.
+        :return: None
+        """
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+    def _get_connection(self):
+        if self.connection is None:
+            raise NoImisFile('An iMIS database path has not been provided.')
+        return self.connection
+
+    @staticmethod
+    def _member_rows(members):
+        """
+        The database rows for a set of members.
+        :param members: Iterable of Member
+        :return: generator of (imis, last_name, first_name, active, times_selected, dates_selected)
+        """
+        for member in members:
+            dates = [date for date in member.dates_selected.split(':') if len(date) > 0]
+            yield (member.imis, member.last_name, member.first_name, int(member.active),
+                   len(dates), ':'.join(dates))
+
+    def import_csv(self, file_path):
+        """
+        Replace the contents of the database with the members in an iMIS CSV
+        data file.  All of the rows are inserted in a single transaction.
+        :param file_path: The iMIS data file
+        :return: The number of members imported
+        """
+        connection = self._get_connection()
+        imis_file = ImisFile(file_path)
+        with connection:
+            connection.execute('DELETE FROM members')
+            connection.executemany('INSERT INTO members VALUES (?, ?, ?, ?, ?, ?)',
+                                   self._member_rows(imis_file.members.values()))
+        return len(imis_file.members)
+
+    def export_csv(self, file_path):
+        """
+        Write the members in the database to an iMIS CSV data file, the same
+        format ImisFile writes.  Active members are written first, each group
+        sorted by name.  The file is replaced in one step, see atomic_write.
+        :param file_path: The file to write
+        :return: None
+        """
+        connection = self._get_connection()
+        cursor = connection.execute("""
+            SELECT imis, last_name, first_name, active, dates_selected FROM members
+            ORDER BY active DESC, casefold(last_name), casefold(first_name), imis""")
+        with atomic_write(file_path) as fp:
+            csv_writer = csv.writer(fp, delimiter=",", quoting=csv.QUOTE_NONE)
+            csv_writer.writerow(ImisFile()._get_default_header_())
+            for imis, last_name, first_name, active, dates_selected in cursor:
+                csv_writer.writerow([str(imis), last_name, first_name,
+                                     '1' if active else '0', dates_selected])
+
+    def get_member(self, imis):
+        """
+        Look up a member by iMIS number.
+        :param imis: The iMIS number
+        :return: Member or None if there is no such member
+        """
+        row = self._get_connection().execute("""
+            SELECT imis, first_name, last_name, active, dates_selected FROM members
+            WHERE imis = ?""", (int(imis),)).fetchone()
+        return Member(*row) if row is not None else None
+
+    def count(self, active=None):
+        """
+        Count the members in the database.
+        :param active: If True or False only count the active or inactive members
+        :return: The number of members
+        """
+        if active is None:
+            sql, args = 'SELECT COUNT(*) FROM members', ()
+        else:
+            sql, args = 'SELECT COUNT(*) FROM members WHERE active = ?', (int(active),)
+        return self._get_connection().execute(sql, args).fetchone()[0]
+
+    def stats(self):
+        """
+        Count the members, the same counts as MemberStats, with one query on
+        the active and times selected columns.
+        :return dict: total, active, inactive, inactive_selected, selected, unselected
+                      and wins, {times selected: active members}
+        """
+        counts = {'total': 0, 'active': 0, 'inactive': 0, 'inactive_selected': 0, 'selected': 0,
+                  'unselected': 0, 'wins': {}}
+        for active, times_selected, num_members in self._get_connection().execute(
+                'SELECT active, times_selected, COUNT(*) FROM members GROUP BY active, times_selected'):
+            counts['total'] += num_members
+            if active:
+                counts['active'] += num_members
+                counts['wins'][times_selected] = num_members
+                counts['selected' if times_selected > 0 else 'unselected'] += num_members
+            else:
+                counts['inactive'] += num_members
+                if times_selected > 0:
+                    counts['inactive_selected'] += num_members
+        return counts
+
+    def merge(self, new_file_obj, track_changes=False):
+        """
+        Merge a new iMIS member list into the database, the same way
+        ImisFile.merge does: the members in the new list are the active
+        members, everyone else becomes inactive, the selection dates of known
+        members are kept, folded with those of members the new list has as
+        inactive, see Member.fold, and members never seen before are added.  The new
+        list is loaded into a temporary table and joined on iMIS number in SQL.
+        With track_changes who joined, lapsed, came back or may be renamed is
+        found with the same join before the members are updated, and left in
+        changeset.
+
+        :param new_file_obj (str/ImisFile): The new member list
+        :param track_changes: If True leave what the merge changed in changeset, see Changeset,
+                              otherwise changeset is None
+        :return: True if the merge was successful
+        """
+        connection = self._get_connection()
+        if isinstance(new_file_obj, str):
+            new_file = ImisFile(new_file_obj)
+        elif isinstance(new_file_obj, ImisFile):
+            new_file = new_file_obj
+            if len(new_file.members) == 0 and new_file.file_path is not None:
+                new_file.read()
+        else:
+            raise ValueError('file_path must be a string or ImisFile type.')
+
+        self.changeset = None
+        with connection:
+            connection.execute("""
+                CREATE TEMP TABLE new_members (
+                    imis INTEGER PRIMARY KEY, last_name TEXT, first_name TEXT,
+                    active INTEGER, times_selected INTEGER, dates_selected TEXT)""")
+            try:
+                connection.executemany('INSERT INTO new_members VALUES (?, ?, ?, ?, ?, ?)',
+                                       self._member_rows(new_file.members.values()))
+                if track_changes:
+                    connection.execute('CREATE TEMP TABLE changes (change TEXT, imis INTEGER PRIMARY KEY, '
+                                       'old_last_name TEXT, old_first_name TEXT)')
+                    connection.execute("""
+                        INSERT INTO changes
+                        SELECT 'joined', n.imis, NULL, NULL FROM new_members n
+                            LEFT JOIN members m USING (imis) WHERE m.imis IS NULL
+                        UNION ALL
+                        SELECT 'lapsed', m.imis, NULL, NULL FROM members m
+                            LEFT JOIN new_members n USING (imis) WHERE m.active != 0 AND NOT coalesce(n.active, 0)
+                        UNION ALL
+                        SELECT 'reactivated', m.imis, NULL, NULL FROM members m
+                            JOIN new_members n USING (imis) WHERE m.active = 0 AND n.active != 0""")
+                    # Members whose names differ from the new list's, the join
+                    # decides if they are renamed
+                    connection.execute("""
+                        INSERT INTO changes
+                        SELECT 'renamed', m.imis, m.last_name, m.first_name FROM members m
+                            JOIN new_members n USING (imis)
+                            WHERE n.last_name != m.last_name OR n.first_name != m.first_name
+                        ON CONFLICT (imis) DO UPDATE SET
+                            old_last_name = excluded.old_last_name, old_first_name = excluded.old_first_name""")
+                connection.execute('UPDATE members SET active = 0 WHERE active != 0')
+                # Active members in the new list take its names, inactive ones
+                # only fill in missing names and fold in their dates.
+                connection.execute("""
+                    INSERT INTO members SELECT * FROM new_members WHERE true
+                    ON CONFLICT (imis) DO UPDATE SET
+                        active = excluded.active,
+                        dates_selected = CASE WHEN excluded.active THEN members.dates_selected
+                            ELSE fold_dates(members.dates_selected, excluded.dates_selected) END,
+                        times_selected = CASE WHEN excluded.active THEN members.times_selected
+                            ELSE count_dates(fold_dates(members.dates_selected, excluded.dates_selected)) END,
+                        last_name = CASE
+                            WHEN (excluded.active AND excluded.last_name != '')
+                                OR members.last_name = '' THEN excluded.last_name
+                            ELSE members.last_name END,
+                        first_name = CASE
+                            WHEN (excluded.active AND excluded.first_name != '')
+                                OR members.first_name = '' THEN excluded.first_name
+                            ELSE members.first_name END""")
+                if track_changes:
+                    changeset = Changeset()
+                    for change, imis, last_name, first_name, old_last_name, old_first_name in connection.execute("""
+                            SELECT c.change, c.imis, m.last_name, m.first_name, c.old_last_name, c.old_first_name
+                            FROM changes c JOIN members m USING (imis)"""):
+                        if change != 'renamed':
+                            getattr(changeset, change).append((imis, last_name, first_name))
+                        if old_last_name is not None and (last_name, first_name) != (old_last_name, old_first_name):
+                            changeset.renamed.append((imis, last_name, first_name, old_last_name, old_first_name))
+                    self.changeset = changeset
+            finally:
+                connection.execute('DROP TABLE IF EXISTS temp.changes')
+                connection.execute('DROP TABLE temp.new_members')
+        return True
+
+    def select(self, how_many=3, use_all=False, date=None, rng=None, tier_threshold=None):
+        """
+        Select members at random from the active members and record the date
+        they were selected.  Only the rows of the selected members are updated.
+
+        :param how_many: The number of members to select
+        :param use_all: If True members that have been selected before may be selected again
+        :param date: The selection date as YYYYMMDD, today if not given
+        :param rng: A random.Random instance, a system seeded one is used if not given
+        :param tier_threshold: If given the members selected up to the level set by this
+                               percentage are eligible, see MemberPool.tier_level
+        :return list: The selected Members
+        """
+        connection = self._get_connection()
+        if rng is None:
+            rng = random.Random()
+        if date is None:
+            date = time.strftime("%Y%m%d")
+
+        with connection:
+            if tier_threshold is not None:
+                tier_sizes = dict(connection.execute(
+                    'SELECT times_selected, COUNT(*) FROM members WHERE active = 1 GROUP BY times_selected'))
+                where = 'active = 1 AND times_selected <= {0:d}'.format(tier_level(tier_sizes, tier_threshold))
+            else:
+                where = 'active = 1' if use_all else 'active = 1 AND times_selected = 0'
+            num_eligible = connection.execute('SELECT COUNT(*) FROM members WHERE {0}'.format(where)).fetchone()[0]
+            if how_many > num_eligible:
+                raise NotEnoughMembers('Can not select {0} members, only {1} eligible members are left.'
+                                       .format(how_many, num_eligible))
+            # The members are drawn by their place in the members_active index,
+            # so only the members selected are read
+            selected = [connection.execute(
+                'SELECT imis FROM members WHERE {0} ORDER BY times_selected, imis LIMIT 1 OFFSET ?'.format(where),
+                (offset,)).fetchone()[0] for offset in rng.sample(range(num_eligible), how_many)]
+
+            connection.executemany("""
+                UPDATE members SET
+                    times_selected = times_selected + 1,
+                    dates_selected = CASE WHEN dates_selected = '' THEN ?1
+                                          ELSE dates_selected || ':' || ?1 END
+                WHERE imis = ?2""", [(date, imis) for imis in selected])
+
+        return [self.get_member(imis) for imis in selected]
@@ -0,0 +1,169 @@
+__author__ = 'Shannon Jaeger'
+
+from Exceptions import *
+import random
+
+
+def tier_level(tier_sizes, threshold):
+    """
+    The most times a member may have been selected and still be eligible
+    for a tiered selection.  Members selected x times become eligible once
+    threshold percent of the active members have been selected at least x
+    times, so members that have never been selected are always eligible and
+    members selected once join them when most members have been selected.
+    :param tier_sizes: dict of the number of active members selected each number of times,
+                       {times_selected: num_members}
+    :param threshold: The percentage, 0 to 100, of active members
+    :return int: The level, members selected this many times or fewer are eligible
+    """
+    if not 0 <= threshold <= 100:
+        raise ValueError('The tier threshold must be a percentage from 0 to 100, not {0}.'.format(threshold))
+    total = sum(tier_sizes.values())
+    level = 0
+    at_least = total
+    for times_selected in sorted(tier_sizes):
+        # at_least is the number of members selected times_selected times or more
+        if at_least * 100 < threshold * total:
+            break
+        level = times_selected
+        at_least -= tier_sizes[times_selected]
+    return level
+
+
+class MemberPool(object):
+    """
+    A pool of members eligible for selection.  Members are drawn without
+    replacement with a partial Fisher-Yates shuffle, each member drawn costs
+    O(1) no matter how many members have been drawn before, and the same
+    member is never drawn twice from the same pool.
+
+    Attributes:
+        members: the members that have not been drawn yet
+    """
+
+    def __init__(self, members, rng=None):
+        """
+        :param members: The eligible members, the pool keeps its own copy
+        :param rng: A random.Random instance, a system seeded one is used if not given
+        """
+        self.members = list(members)
+        self.rng = rng if rng is not None else random.Random()
+
+    @classmethod
+    def from_imis_file(cls, imis_file, use_all=False, rng=None):
+        """
+        Build the pool of members that may be selected from an ImisFile.  Only
+        active members are eligible and, unless use_all is given, only those
+        that have never been selected.
+        :param imis_file: An ImisFile that has been read
+        :param use_all: If True members selected before are also eligible
+        :param rng: A random.Random instance
+        :return: MemberPool
+        """
+        if use_all:
+            return cls(imis_file.active_member_list, rng)
+        return cls([member for member in imis_file.active_member_list
+                    if len(member.dates_selected) < 1], rng)
+
+    def __len__(self):
+        return len(self.members)
+
+    def draw(self, how_many):
+        """
+        Draw how_many distinct members from the pool.  The members drawn are
+        removed from the pool so later draws will not return them again.
+        :param how_many: The number of members to draw
+        :return list: The members drawn
+        """
+        if how_many < 0:
+            raise ValueError('Can not select a negative number of members.')
+        if how_many > len(self.members):
+            raise NotEnoughMembers('Can not select {0} members, only {1} eligible members are left.'
+                                   .format(how_many, len(self.members)))
+
+        members = self.members
+        randrange = self.rng.randrange
+        drawn = []
+        for _ in range(how_many):
+            # Swap a random member to the end of the pool and take it off
+            last = len(members) - 1
+            idx = randrange(last + 1)
+            members[idx], members[last] = members[last], members[idx]
+            drawn.append(members.pop())
+        return drawn
+
+
+class TieredMemberPool(object):
+    """
+    A pool of active members kept in tiers by the number of times they have
+    been selected.  Only the tiers up to the level set by the threshold, see
+    tier_level, are eligible, the level is fixed when the pool is made.
+    Members are drawn without replacement, each member drawn costs O(1) for
+    its tier plus a step for each eligible tier.
+
+    Attributes:
+        tiers: the members that have not been drawn yet, {times_selected: [Member, ...]}
+        level: members selected this many times or fewer are eligible
+    """
+
+    def __init__(self, members, threshold, rng=None):
+        """
+        :param members: The active members, the pool keeps its own lists
+        :param threshold: The percentage of active members, see tier_level
+        :param rng: A random.Random instance, a system seeded one is used if not given
+        """
+        self.tiers = {}
+        for member in members:
+            self.tiers.setdefault(member.times_selected, []).append(member)
+        self.level = tier_level({times_selected: len(tier) for times_selected, tier in self.tiers.items()},
+                                threshold)
+        self.rng = rng if rng is not None else random.Random()
+
+    @classmethod
+    def from_imis_file(cls, imis_file, threshold, rng=None):
+        """
+        Build the pool of members that may be selected from an ImisFile.
+        :param imis_file: An ImisFile that has been read
+        :param threshold: The percentage of active members, see tier_level
+        :param rng: A random.Random instance
+        :return: TieredMemberPool
+        """
+        return cls(imis_file.active_member_list, threshold, rng)
+
+    def _eligible_tiers(self):
+        return [self.tiers[times_selected] for times_selected in sorted(self.tiers)
+                if times_selected <= self.level]
+
+    def __len__(self):
+        return sum(len(tier) for tier in self._eligible_tiers())
+
+    def draw(self, how_many):
+        """
+        Draw how_many distinct members from the eligible tiers, every eligible
+        member is equally likely to be drawn.  The members drawn are removed
+        from the pool so later draws will not return them again.
+        :param how_many: The number of members to draw
+        :return list: The members drawn
+        """
+        tiers = self._eligible_tiers()
+        num_eligible = sum(len(tier) for tier in tiers)
+        if how_many < 0:
+            raise ValueError('Can not select a negative number of members.')
+        if how_many > num_eligible:
+            raise NotEnoughMembers('Can not select {0} members, only {1} eligible members are left.'
+                                   .format(how_many, num_eligible))
+
+        randrange = self.rng.randrange
+        drawn = []
+        for _ in range(how_many):
+            idx = randrange(num_eligible)
+            for tier in tiers:
+                if idx < len(tier):
+                    break
+                idx -= len(tier)
+            # Swap the member to the end of its tier and take it off
+            last = len(tier) - 1
+            tier[idx], tier[last] = tier[last], tier[idx]
+            drawn.append(tier.pop())
+            num_eligible -= 1
+        return drawn
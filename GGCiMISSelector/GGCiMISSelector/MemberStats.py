@@ -0,0 +1,216 @@
+__author__ = 'Shannon Jaeger'
+
+from SelectionJournal import SelectionJournal
+from utilities import atomic_write
+import marshal
+import os
+
+
+def _times_selected(dates_selected):
+    return dates_selected.count(':') + 1 if len(dates_selected) > 0 else 0
+
+
+class MemberStats(object):
+    """
+    The counts the legacy number_selector printed for an iMIS data file, and
+    the number of active members that have been selected each number of
+    times, kept next to the data file in <data file>.stats.
+
+    The counts are made in one pass over the rows of the data file, with the
+    selections in its journal added, and saved with the inode, modification
+    time and size of the data file and the size of its journal.  Selecting
+    members updates the saved counts as the selections are recorded, and
+    merging and compacting save the counts of the file they write, so the
+    counts are only made again when the data file or journal was changed some
+    other way.
+
+    Attributes:
+        data_file_path: The iMIS data file
+        file_path: The path to the stats file
+        total: The number of members
+        active: The number of active members
+        inactive_selected: The number of inactive members that have been selected
+        selected: The number of active members that have been selected
+        wins: dict of the number of active members selected each number of times, {times: members}
+    """
+
+    # Bump when the counts kept change so old stats files are ignored
+    version = 2
+
+    def __init__(self, data_file_path=None):
+        """
+        :param data_file_path: The iMIS data file the counts are of, if any
+        """
+        self.data_file_path = str(data_file_path) if data_file_path is not None else None
+        self.file_path = self.data_file_path + '.stats' if data_file_path is not None else None
+        self.total = 0
+        self.active = 0
+        self.inactive_selected = 0
+        self.selected = 0
+        self.wins = {}
+
+    @property
+    def inactive(self):
+        return self.total - self.active
+
+    @property
+    def unselected(self):
+        return self.active - self.selected
+
+    def add(self, active, times_selected):
+        """
+        Count a member.
+        :param active: True if the member is active
+        :param times_selected: The number of times the member has been selected
+        :return: None
+        """
+        self.total += 1
+        if active:
+            self.active += 1
+            self.wins[times_selected] = self.wins.get(times_selected, 0) + 1
+            if times_selected > 0:
+                self.selected += 1
+        elif times_selected > 0:
+            self.inactive_selected += 1
+
+    @classmethod
+    def from_members(cls, members, data_file_path=None):
+        """
+        :param members: iterable of Member
+        :param data_file_path: The iMIS data file the members are from, if any
+        :return: MemberStats of the members
+        """
+        stats = cls(data_file_path)
+        for member in members:
+            stats.add(member.active, member.times_selected)
+        return stats
+
+    @classmethod
+    def from_table(cls, table, data_file_path=None):
+        """
+        :param table: MemberTable
+        :param data_file_path: The iMIS data file the table is of, if any
+        :return: MemberStats of the members in the table
+        """
+        counts = table.stats()
+        stats = cls(data_file_path)
+        stats.total, stats.active = counts['total'], counts['active']
+        stats.inactive_selected, stats.selected = counts['inactive_selected'], counts['selected']
+        stats.wins = counts['wins']
+        return stats
+
+    @classmethod
+    def count(cls, data_file_path):
+        """
+        Count the members of an iMIS data file in one pass over its rows, only
+        the iMIS numbers seen are kept.  A file with more than one row for a
+        member is read into a MemberTable instead, so the rows are folded
+        together without making a Member of each.
+        :param data_file_path: The iMIS data file
+        :return: MemberStats
+        """
+        # ImisFile keeps the saved counts up to date as it writes, so it
+        # imports this module
+        from ImisFile import ImisFile
+
+        selections = SelectionJournal(data_file_path).selections()
+        stats = cls(data_file_path)
+        seen = set()
+        for imis, _, _, active, dates_selected in ImisFile().iter_rows(data_file_path):
+            if imis in seen:
+                from MemberTable import MemberTable
+                return cls.from_table(MemberTable.read(data_file_path), data_file_path)
+            seen.add(imis)
+            stats.add(active, _times_selected(dates_selected) + len(selections.get(imis, ())))
+        return stats
+
+    def _stat_key(self):
+        st = os.stat(self.data_file_path)
+        return (self.version, os.path.abspath(self.data_file_path), st.st_ino, st.st_mtime_ns, st.st_size,
+                SelectionJournal(self.data_file_path).size())
+
+    @classmethod
+    def load(cls, data_file_path):
+        """
+        Load the saved counts of an iMIS data file.
+        :param data_file_path: The iMIS data file
+        :return: MemberStats, or None if there are none or they are out of date
+        """
+        stats = cls(data_file_path)
+        try:
+            with open(stats.file_path, 'rb') as fp:
+                saved = marshal.loads(fp.read())
+            if saved['key'] != stats._stat_key():
+                return None
+            stats.total, stats.active, stats.inactive_selected, stats.selected = saved['counts']
+            stats.wins = dict(saved['wins'])
+        except (OSError, EOFError, ValueError, TypeError, KeyError):
+            return None
+        return stats
+
+    @classmethod
+    def open(cls, data_file_path):
+        """
+        The counts of an iMIS data file, the saved ones if they are up to date,
+        otherwise the members are counted and the counts saved.
+        :param data_file_path: The iMIS data file
+        :return: MemberStats
+        """
+        stats = cls.load(data_file_path)
+        if stats is None:
+            key = cls(data_file_path)._stat_key()
+            stats = cls.count(data_file_path)
+            if stats._stat_key() == key:
+                stats.save()
+        return stats
+
+    def save(self):
+        """
+        Save the counts as those of the data file and journal as they are now.
+        :return: None
+        """
+        saved = {'key': self._stat_key(),
+                 'counts': (self.total, self.active, self.inactive_selected, self.selected),
+                 'wins': self.wins}
+        with atomic_write(self.file_path, 'wb') as fp:
+            fp.write(marshal.dumps(saved))
+
+    def exists(self):
+        return os.path.exists(self.file_path)
+
+    def remove(self):
+        if os.path.exists(self.file_path):
+            os.remove(self.file_path)
+
+    def record_selections(self, members, date):
+        """
+        Update the counts for members about to be selected on date, before the
+        selection is added to them.
+        :param members: iterable of Member
+        :param date: The date of the selection, YYYYMMDD
+        :return: None
+        """
+        for member in members:
+            times_selected = member.times_selected
+            if member.active:
+                self.wins[times_selected] -= 1
+                if self.wins[times_selected] == 0:
+                    del self.wins[times_selected]
+                self.wins[times_selected + 1] = self.wins.get(times_selected + 1, 0) + 1
+                if times_selected == 0:
+                    self.selected += 1
+            elif times_selected == 0:
+                self.inactive_selected += 1
+
+    def as_dict(self):
+        """
+        :return dict: total, active, inactive, inactive_selected, selected, unselected,
+                      the same as MemberTable.stats, and wins
+        """
+        return {'total': self.total,
+                'active': self.active,
+                'inactive': self.inactive,
+                'inactive_selected': self.inactive_selected,
+                'selected': self.selected,
+                'unselected': self.unselected,
+                'wins': dict(self.wins)}
@@ -0,0 +1,369 @@
+__author__ = 'Shannon Jaeger'
+
+from Exceptions import *
+from ImisFile import ImisFile, Member, _fold_dates
+from SelectionJournal import SelectionJournal
+from utilities import atomic_write
+from array import array
+from itertools import compress
+import csv
+import os
+import random
+import sys
+import time
+
+# NumPy is optional, when it is installed the selection, merge and statistics
+# are done with vectorized operations on the columns.
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+def _split_dates(dates_selected):
+    return [date for date in dates_selected.split(':') if len(date) > 0]
+
+
+def _last_date(dates):
+    """
+    The most recent of a list of YYYYMMDD dates as an integer, 0 if there are none.
+    """
+    values = [int(date) for date in dates if date.isdigit()]
+    return max(values) if len(values) > 0 else 0
+
+
+class MemberTable(object):
+    """
+    The members of an iMIS data file stored as columns instead of Member
+    objects.  Row i of every column holds the data of one member.  This uses a
+    fraction of the memory of a list of Members and lets selection, merging
+    and statistics work on whole columns at a time.
+
+    Attributes:
+        imis: array('q') of iMIS numbers
+        active: bytearray, 1 for an active member and 0 for an inactive one
+        times_selected: array('I') of the number of times each member was selected
+        last_selected: array('i') of the last date, YYYYMMDD, each member was selected, 0 if never
+        dates_selected: list of the ':' separated selection dates
+        last_names, first_names: lists of interned names
+        file_path: The iMIS data file the table was read from, if any
+    """
+
+    def __init__(self):
+        self.file_path = None
+        self.imis = array('q')
+        self.active = bytearray()
+        self.times_selected = array('I')
+        self.last_selected = array('i')
+        self.dates_selected = []
+        self.last_names = []
+        self.first_names = []
+        self._index = None
+
+    def __len__(self):
+        return len(self.imis)
+
+    @classmethod
+    def from_rows(cls, rows):
+        """
+        Build a table from (imis, last_name, first_name, active, dates_selected)
+        rows, see ImisFile.iter_rows.  Rows with the same iMIS number are folded
+        together the same way ImisFile.read does.
+        :param rows: iterable of rows
+        :return: MemberTable
+        """
+        table = cls()
+        index = table._get_index()
+        for imis, last_name, first_name, active, dates_selected in rows:
+            row = index.get(imis)
+            if row is None:
+                index[imis] = len(table.imis)
+                table._append(imis, last_name, first_name, active, dates_selected)
+            else:
+                table._fold(row, last_name, first_name, active, dates_selected)
+        return table
+
+    @classmethod
+    def read(cls, file_path):
+        """
+        Read an iMIS CSV data file into a table, the rows are streamed from the
+        file so no Member objects are created.  Selections in the file's
+        journal are applied the same way ImisFile.read applies them.
+        :param file_path: The iMIS data file
+        :return: MemberTable
+        """
+        table = cls.from_rows(ImisFile().iter_rows(file_path))
+        table.file_path = file_path
+        for imis, dates in SelectionJournal(file_path).selections().items():
+            row = table.index_of(imis)
+            if row is None:
+                continue
+            for date in dates:
+                table._add_selection(row, date)
+        return table
+
+    @classmethod
+    def from_imis_file(cls, imis_file):
+        """
+        Build a table from an ImisFile, from its members if it has been read or
+        straight from its file if not.
+        :param imis_file: An ImisFile
+        :return: MemberTable
+        """
+        if len(imis_file.members) == 0:
+            return cls.from_rows(imis_file.iter_rows())
+        return cls.from_rows((m.imis, m.last_name, m.first_name, m.active, m.dates_selected)
+                             for m in imis_file.active_member_list + imis_file.inactive_member_list)
+
+    def to_imis_file(self, file_path=None):
+        """
+        Build an ImisFile holding the members in this table, in table order.
+        :param file_path: The file path for the ImisFile, if any
+        :return: ImisFile
+        """
+        imis_file = ImisFile()
+        if file_path is not None:
+            imis_file.set_file_path(file_path)
+        for row in range(len(self.imis)):
+            imis_file.members[self.imis[row]] = self.member(row)
+        imis_file._split_members()
+        return imis_file
+
+    def member(self, row):
+        """
+        :param row: A row of the table
+        :return: Member for the row
+        """
+        return Member(self.imis[row], self.first_names[row], self.last_names[row],
+                      bool(self.active[row]), self.dates_selected[row])
+
+    def index_of(self, imis):
+        """
+        :param imis: An iMIS number
+        :return: The row of the member with the iMIS number, or None if there isn't one
+        """
+        return self._get_index().get(int(imis))
+
+    def _get_index(self):
+        if self._index is None:
+            self._index = dict(zip(self.imis, range(len(self.imis))))
+        return self._index
+
+    def _append(self, imis, last_name, first_name, active, dates_selected):
+        dates = _split_dates(dates_selected)
+        self.imis.append(imis)
+        self.active.append(1 if active else 0)
+        self.times_selected.append(len(dates))
+        self.last_selected.append(_last_date(dates))
+        self.dates_selected.append(':'.join(dates) if len(dates) > 0 else '')
+        self.last_names.append(sys.intern(last_name))
+        self.first_names.append(sys.intern(first_name))
+
+    def _fold(self, row, last_name, first_name, active, dates_selected):
+        """
+        Fold a duplicate entry into a row, see Member.fold.
+        """
+        if len(self.last_names[row]) < 1:
+            self.last_names[row] = sys.intern(last_name)
+        if len(self.first_names[row]) < 1:
+            self.first_names[row] = sys.intern(first_name)
+        if active:
+            self.active[row] = 1
+
+        dates = _split_dates(_fold_dates(self.dates_selected[row], dates_selected))
+        self.times_selected[row] = len(dates)
+        self.last_selected[row] = _last_date(dates)
+        self.dates_selected[row] = ':'.join(dates)
+
+    def write(self, file_path=None):
+        """
+        Write the table to an iMIS CSV data file in the same format as
+        ImisFile.write, active members first.  As with ImisFile.write the file
+        is replaced in one step and writing the table back to the file it was
+        read from compacts the selection journal.
+        :param file_path: The file to write, the file the table was read from if not given
+        :return: None
+        """
+        if file_path is None and self.file_path is None:
+            raise NoImisFile('A file path for the iMIS data must be specified before the data can be written.')
+        if file_path is None:
+            file_path = self.file_path
+
+        compacting = self.file_path is not None and os.path.abspath(file_path) == os.path.abspath(self.file_path)
+        journal = SelectionJournal(self.file_path) if compacting else None
+        with atomic_write(file_path, before_replace=journal.stamp if compacting else None) as fp:
+            csv_writer = csv.writer(fp, delimiter=",", quoting=csv.QUOTE_NONE)
+            csv_writer.writerow(ImisFile()._get_default_header_())
+            for active in (1, 0):
+                for row in range(len(self.imis)):
+                    if self.active[row] == active:
+                        csv_writer.writerow([str(self.imis[row]), self.last_names[row], self.first_names[row],
+                                             '1' if active else '0', self.dates_selected[row]])
+
+        if compacting:
+            journal.remove()
+
+    def eligible(self, use_all=False):
+        """
+        The rows of the members that may be selected, the active members and
+        unless use_all is given only those that have never been selected.
+        :param use_all: If True members selected before are also eligible
+        :return: sequence of rows
+        """
+        if numpy is not None:
+            mask = numpy.frombuffer(self.active, dtype=numpy.uint8) != 0
+            if not use_all:
+                mask &= numpy.frombuffer(self.times_selected, dtype=numpy.uint32) == 0
+            return numpy.flatnonzero(mask)
+
+        if use_all:
+            return list(compress(range(len(self.imis)), self.active))
+        return list(compress(range(len(self.imis)),
+                             [active and not count for active, count in zip(self.active, self.times_selected)]))
+
+    def select(self, how_many=3, use_all=False, date=None, rng=None):
+        """
+        Select members at random and record the date they were selected.
+        :param how_many: The number of members to select
+        :param use_all: If True members that have been selected before may be selected again
+        :param date: The selection date as YYYYMMDD, today if not given
+        :param rng: A random.Random instance, a system seeded one is used if not given
+        :return list: The selected Members
+        """
+        if rng is None:
+            rng = random.Random()
+        if date is None:
+            date = time.strftime("%Y%m%d")
+
+        eligible = self.eligible(use_all)
+        if how_many > len(eligible):
+            raise NotEnoughMembers('Can not select {0} members, only {1} eligible members are left.'
+                                   .format(how_many, len(eligible)))
+
+        selected = []
+        for pos in rng.sample(range(len(eligible)), how_many):
+            row = int(eligible[pos])
+            self._add_selection(row, date)
+            selected.append(self.member(row))
+        return selected
+
+    def _add_selection(self, row, date):
+        self.times_selected[row] += 1
+        self.last_selected[row] = max(self.last_selected[row], int(date))
+        if len(self.dates_selected[row]) < 1:
+            self.dates_selected[row] = date
+        else:
+            self.dates_selected[row] += ':' + date
+
+    def _match_rows(self, new_table):
+        """
+        Join another table on iMIS number.
+        :param new_table: MemberTable
+        :return: list with the row in this table of each row of new_table, -1 where there isn't one
+        """
+        if numpy is not None and len(self.imis) > 0:
+            old_imis = numpy.frombuffer(self.imis, dtype=numpy.int64)
+            new_imis = numpy.frombuffer(new_table.imis, dtype=numpy.int64)
+            order = numpy.argsort(old_imis, kind='stable')
+            sorted_imis = old_imis[order]
+            pos = numpy.minimum(numpy.searchsorted(sorted_imis, new_imis), len(sorted_imis) - 1)
+            return numpy.where(sorted_imis[pos] == new_imis, order[pos], -1).tolist()
+
+        index = self._get_index()
+        return [index.get(imis, -1) for imis in new_table.imis]
+
+    def merge(self, new_file_obj):
+        """
+        Merge a new iMIS member list into the table the same way ImisFile.merge
+        does, and leave the rows in the same order ImisFile.merge leaves its
+        member lists.
+
+        :param new_file_obj (str/ImisFile/MemberTable): The new member list
+        :return: True if the merge was successful
+        """
+        if isinstance(new_file_obj, str):
+            new_table = MemberTable.read(new_file_obj)
+        elif isinstance(new_file_obj, ImisFile):
+            new_table = MemberTable.from_imis_file(new_file_obj)
+        elif isinstance(new_file_obj, MemberTable):
+            new_table = new_file_obj
+        else:
+            raise ValueError('file_path must be a string, ImisFile or MemberTable type.')
+
+        matches = self._match_rows(new_table)
+
+        # The new file decides who is active now
+        self.active = bytearray(len(self.imis))
+        self._index = None
+        for new_row, row in enumerate(matches):
+            if row < 0:
+                self._append(new_table.imis[new_row], new_table.last_names[new_row],
+                             new_table.first_names[new_row], new_table.active[new_row],
+                             new_table.dates_selected[new_row])
+            elif new_table.active[new_row]:
+                self.active[row] = 1
+                if len(new_table.last_names[new_row]) > 0:
+                    self.last_names[row] = new_table.last_names[new_row]
+                if len(new_table.first_names[new_row]) > 0:
+                    self.first_names[row] = new_table.first_names[new_row]
+            else:
+                self._fold(row, new_table.last_names[new_row], new_table.first_names[new_row],
+                           False, new_table.dates_selected[new_row])
+
+        self._sort_rows()
+        return True
+
+    def _sort_rows(self):
+        """
+        Re-order the rows, active members first and each group by name, see
+        Member.sort_key.
+        """
+        active, last_names, first_names, imis = self.active, self.last_names, self.first_names, self.imis
+        order = sorted(range(len(imis)), key=lambda row: (not active[row], last_names[row].casefold(),
+                                                          first_names[row].casefold(), imis[row]))
+        self.imis = array('q', [imis[row] for row in order])
+        self.active = bytearray([active[row] for row in order])
+        self.times_selected = array('I', [self.times_selected[row] for row in order])
+        self.last_selected = array('i', [self.last_selected[row] for row in order])
+        self.dates_selected = [self.dates_selected[row] for row in order]
+        self.last_names = [last_names[row] for row in order]
+        self.first_names = [first_names[row] for row in order]
+        self._index = None
+
+    def stats(self):
+        """
+        Count the members, the same counts the legacy number_selector printed
+        and the same as MemberStats.as_dict.
+        :return dict: total, active, inactive, inactive_selected, selected,
+                      unselected (active members that have never been selected)
+                      and wins, {times selected: active members}
+        """
+        total = len(self.imis)
+        if numpy is not None:
+            active = numpy.frombuffer(self.active, dtype=numpy.uint8) != 0
+            times_selected = numpy.frombuffer(self.times_selected, dtype=numpy.uint32)
+            selected = times_selected > 0
+            num_active = int(numpy.count_nonzero(active))
+            num_selected = int(numpy.count_nonzero(active & selected))
+            num_inactive_selected = int(numpy.count_nonzero(~active & selected))
+            wins = numpy.bincount(times_selected[active])
+            wins = dict((int(times), int(wins[times])) for times in numpy.flatnonzero(wins))
+        else:
+            num_active = self.active.count(1)
+            num_selected = num_inactive_selected = 0
+            wins = {}
+            for active, count in zip(self.active, self.times_selected):
+                if active:
+                    wins[count] = wins.get(count, 0) + 1
+                if count and active:
+                    num_selected += 1
+                elif count:
+                    num_inactive_selected += 1
+
+        return {'total': total,
+                'active': num_active,
+                'inactive': total - num_active,
+                'inactive_selected': num_inactive_selected,
+                'selected': num_selected,
+                'unselected': num_active - num_selected,
+                'wins': wins}
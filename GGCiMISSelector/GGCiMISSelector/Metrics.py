@@ -0,0 +1,200 @@
+__author__ = 'Shannon Jaeger'
+
+import time
+
+
+class _NoPhase(object):
+    """
+    The phase handed out while no metrics are being recorded, it records
+    nothing so instrumented code costs next to nothing.
+    """
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+    @property
+    def rows(self):
+        return None
+
+    @rows.setter
+    def rows(self, value):
+        pass
+
+
+_NO_PHASE = _NoPhase()
+
+
+def phase(name):
+    """
+    Time a phase of the work being done, for example reading a file, if
+    metrics are being recorded:
+
+        with phase('read') as current:
+            ...
+            current.rows = num_rows
+
+    :param name: The name of the phase
+    :return: A context manager for the phase, its rows may be set to the number of rows handled
+    """
+    metrics = Metrics.active
+    if metrics is None:
+        return _NO_PHASE
+    return _Phase(metrics, name)
+
+
+class _Phase(object):
+    """
+    A phase being timed, see phase.
+    """
+    __slots__ = ('metrics', 'name', 'rows', 'depth', 'seconds', 'peak_bytes', '_start')
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+        self.rows = None
+        self.depth = 0
+        self.seconds = 0.0
+        self.peak_bytes = None
+
+    def __enter__(self):
+        self.metrics._enter(self)
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.seconds = time.perf_counter() - self._start
+        self.metrics._exit(self)
+        return False
+
+    def as_dict(self):
+        rows_per_second = None
+        if self.rows is not None and self.seconds > 0:
+            rows_per_second = self.rows / self.seconds
+        return {'phase': self.name,
+                'depth': self.depth,
+                'seconds': self.seconds,
+                'rows': self.rows,
+                'rows_per_second': rows_per_second,
+                'peak_bytes': self.peak_bytes}
+
+
+class Metrics(object):
+    """
+    Record the wall time, number of rows and, with tracemalloc, the peak
+    memory of each phase of a run.  Phases are recorded by code wrapped in
+    phase() while the metrics are started, phases inside other phases are
+    recorded as well and are included in the phases around them.
+
+    Attributes:
+        active: The Metrics being recorded, None if nothing is
+        phases: The phases recorded, in the order they finished
+        trace_memory: True if the peak memory of each phase is measured
+    """
+
+    active = None
+
+    def __init__(self, trace_memory=True):
+        """
+        :param trace_memory: If True measure the peak memory of each phase with tracemalloc,
+                             which slows Python down while it is on
+        """
+        self.trace_memory = trace_memory
+        self.phases = []
+        self._stack = []
+        self._started_tracing = False
+        # tracemalloc, imported when the metrics are started so code that is
+        # only instrumented doesn't load it
+        self._tracemalloc = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+        return False
+
+    def start(self):
+        """
+        Start recording the phases run from now on.
+        :return: self
+        """
+        if self.trace_memory:
+            import tracemalloc
+            self._tracemalloc = tracemalloc
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self._started_tracing = True
+        Metrics.active = self
+        return self
+
+    def stop(self):
+        """
+        Stop recording phases.
+        :return: None
+        """
+        if Metrics.active is self:
+            Metrics.active = None
+        if self._started_tracing:
+            self._tracemalloc.stop()
+            self._started_tracing = False
+
+    def _enter(self, current):
+        current.depth = len(self._stack)
+        tracemalloc = self._tracemalloc
+        if tracemalloc is not None and tracemalloc.is_tracing():
+            # The peak of the enclosing phases so far is kept before the peak
+            # is reset for this one
+            self._raise_peaks(tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+        self._stack.append(current)
+
+    def _exit(self, current):
+        tracemalloc = self._tracemalloc
+        if tracemalloc is not None and tracemalloc.is_tracing():
+            self._raise_peaks(tracemalloc.get_traced_memory()[1])
+        if self._stack and self._stack[-1] is current:
+            self._stack.pop()
+        self.phases.append(current)
+
+    def _raise_peaks(self, peak):
+        for current in self._stack:
+            if current.peak_bytes is None or current.peak_bytes < peak:
+                current.peak_bytes = peak
+
+    def results(self):
+        """
+        :return list: a dict for each phase with its phase name, depth, seconds, rows,
+                      rows_per_second and peak_bytes, in the order the phases started
+        """
+        return [current.as_dict() for current in sorted(self.phases, key=lambda p: p._start)]
+
+    def report(self):
+        """
+        :return str: The phases as a table
+        """
+        lines = ['{0:<28} {1:>10} {2:>10} {3:>12} {4:>10}'.format('Phase', 'Seconds', 'Rows', 'Rows/sec',
+                                                                  'Peak MB')]
+        for result in self.results():
+            lines.append('{0:<28} {1:>10.3f} {2:>10} {3:>12} {4:>10}'.format(
+                '  ' * result['depth'] + result['phase'],
+                result['seconds'],
+                result['rows'] if result['rows'] is not None else '',
+                '{0:.0f}'.format(result['rows_per_second']) if result['rows_per_second'] is not None else '',
+                '{0:.1f}'.format(result['peak_bytes'] / 2.0 ** 20) if result['peak_bytes'] is not None else ''))
+        return '\n'.join(lines)
+
+    def write_json(self, file_path, **extra):
+        """
+        Write the results to a JSON file.
+        :param file_path: The file to write
+        :param extra: Other values to store alongside the phases, such as the command run
+        :return: None
+        """
+        import json
+        with open(file_path, 'w') as fp:
+            json.dump(dict(extra, phases=self.results()), fp, indent=2)
+            fp.write('\n')
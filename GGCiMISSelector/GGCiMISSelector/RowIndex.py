@@ -0,0 +1,319 @@
+__author__ = 'Shannon Jaeger'
+
+from Exceptions import *
+from ImisFile import Member
+from ImisSchema import ImisSchema
+from utilities import atomic_write
+from array import array
+import csv
+import locale
+import mmap
+import os
+import random
+import struct
+
+# magic, version, data file inode, mtime_ns and size, usable flag, number of
+# rows, active rows and unselected rows, length of the heading line
+_HEADER = struct.Struct('<8sIqqqIqqqq')
+_MAGIC = b'IMISIDX\0'
+
+
+def _padded(length):
+    """
+    :return: length rounded up to a multiple of 8 so the arrays stay aligned
+    """
+    return (length + 7) & ~7
+
+
+class RowIndex(object):
+    """
+    An index of the rows of an iMIS CSV data file, kept next to it in
+    <data file>.idx, so members can be drawn from the file without reading
+    all of it.
+
+    The index holds the byte offset of every row of the data file and the
+    numbers of the rows that are active and of those that are active and have
+    never been selected, the two pools a draw is made from.  The data file is
+    memory mapped and only the rows drawn are decoded, so once the index is
+    built a draw costs the same however large the file is.  The index is
+    rebuilt whenever the data file's inode, modification time or size change.
+
+    Files the index can't describe exactly, those with an iMIS number on more
+    than one row or with lines ending in a bare carriage return, are marked
+    unusable and have to be read with ImisFile.
+
+    Attributes:
+        data_file_path: The iMIS data file
+        file_path: The path to the index file
+        usable: True if the data file can be drawn from through the index
+    """
+
+    # Bump when the layout of the index changes so old indexes are rebuilt
+    version = 2
+
+    def __init__(self, data_file_path):
+        """
+        :param data_file_path: The iMIS data file the index belongs to
+        """
+        assert(data_file_path is not None)
+        self.data_file_path = str(data_file_path)
+        self.file_path = self.data_file_path + '.idx'
+        self.usable = False
+        self._schema = None
+        self._data_fp = None
+        self._data_map = None
+        self._index_map = None
+        self._offsets = None
+        self._active = None
+        self._unselected = None
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _stat_key(self):
+        st = os.stat(self.data_file_path)
+        return st.st_ino, st.st_mtime_ns, st.st_size
+
+    def open(self):
+        """
+        Open the data file and its index, the index is built first if it is
+        missing or out of date.
+        :return: self
+        """
+        if self._data_map is not None:
+            return self
+        if not self._load():
+            self.build()
+            if not self._load():
+                raise InvalidImisFile('Could not index file "{0}".'.format(self.data_file_path))
+        return self
+
+    def close(self):
+        """
+        Release the memory maps of the data file and the index.
+        :return: None
+        """
+        # The views have to go before the maps they look into
+        for view in (self._offsets, self._active, self._unselected):
+            if view is not None:
+                view.release()
+        self._offsets = self._active = self._unselected = None
+        for resource in (self._index_map, self._data_map, self._data_fp):
+            if resource is not None:
+                resource.close()
+        self._index_map = self._data_map = self._data_fp = None
+
+    def build(self):
+        """
+        Read the whole data file and write its index.
+        :return: None
+        """
+        stat_key = self._stat_key()
+        offsets = array('q')
+        active = array('I')
+        unselected = array('I')
+        usable = False
+
+        with open(self.data_file_path, 'rb') as fp:
+            heading = fp.readline()
+            if len(heading.strip()) == 0:
+                raise InvalidImisFile('File "{0}" is empty.'.format(self.data_file_path))
+            # Lines ending in a bare carriage return can't be found by their '\n'
+            if b'\r' not in heading.rstrip(b'\r\n'):
+                usable = self._index_rows(fp, heading, offsets, active, unselected)
+
+        if not usable:
+            heading = b''
+            offsets, active, unselected = array('q'), array('I'), array('I')
+        header = _HEADER.pack(_MAGIC, self.version, stat_key[0], stat_key[1], stat_key[2], usable,
+                              len(offsets), len(active), len(unselected), len(heading))
+        with atomic_write(self.file_path, 'wb') as fp:
+            for block in (header, heading, offsets.tobytes(), active.tobytes(), unselected.tobytes()):
+                fp.write(block)
+                fp.write(b'\0' * (_padded(len(block)) - len(block)))
+
+    def _index_rows(self, fp, heading, offsets, active, unselected):
+        """
+        Add the offset of each row of the data file to offsets and the number
+        of the row to active and unselected when it belongs in those pools.
+        :param fp: The data file, opened in binary mode and read up to the end of the heading
+        :param heading: The heading line of the data file
+        :return: True if the file can be indexed, False if the index can't describe it
+        """
+        encoding = locale.getpreferredencoding(False)
+        decode = ImisSchema(next(csv.reader([heading.decode(encoding)], delimiter=",", quoting=csv.QUOTE_NONE)),
+                            self.data_file_path).decode
+        seen = set()
+        line_offsets = array('q')
+        bare_returns = []
+
+        def lines():
+            offset = len(heading)
+            for raw in fp:
+                if b'\r' in raw.rstrip(b'\r\n'):
+                    bare_returns.append(offset)
+                line_offsets.append(offset)
+                offset += len(raw)
+                yield raw.decode(encoding)
+
+        # Without quoting each line of the file is one row
+        reader = csv.reader(lines(), delimiter=",", quoting=csv.QUOTE_NONE)
+        try:
+            for line_number, line in enumerate(reader):
+                row = decode(line)
+                if row is None:
+                    continue
+                if row[0] in seen or bare_returns:
+                    return False
+                seen.add(row[0])
+
+                row_number = len(offsets)
+                offsets.append(line_offsets[line_number])
+                if row[3]:
+                    active.append(row_number)
+                    if len(row[4]) < 1:
+                        unselected.append(row_number)
+        except csv.Error:
+            # A bare carriage return in a row
+            return False
+        return len(bare_returns) == 0
+
+    def _load(self):
+        """
+        Map the index and the data file if the index matches the data file.
+        :return: True if the index was loaded, False if it is missing or out of date
+        """
+        stat_key = self._stat_key()
+        try:
+            with open(self.file_path, 'rb') as fp:
+                index_map = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return False
+
+        try:
+            (magic, version, ino, mtime_ns, size, usable,
+             num_rows, num_active, num_unselected, heading_length) = _HEADER.unpack_from(index_map)
+        except struct.error:
+            index_map.close()
+            return False
+        offset = _padded(_HEADER.size)
+        end = offset + _padded(heading_length) + _padded(8 * num_rows) + \
+            _padded(4 * num_active) + _padded(4 * num_unselected)
+        if magic != _MAGIC or version != self.version or (ino, mtime_ns, size) != stat_key or \
+                len(index_map) < end:
+            index_map.close()
+            return False
+
+        if usable:
+            heading = index_map[offset:offset + heading_length].decode(locale.getpreferredencoding(False))
+            self._schema = ImisSchema(next(csv.reader([heading], delimiter=",", quoting=csv.QUOTE_NONE)),
+                                      self.data_file_path)
+        offset += _padded(heading_length)
+
+        self._index_map = index_map
+        view = memoryview(index_map)
+        self._offsets = view[offset:offset + 8 * num_rows].cast('q')
+        offset += _padded(8 * num_rows)
+        self._active = view[offset:offset + 4 * num_active].cast('I')
+        offset += _padded(4 * num_active)
+        self._unselected = view[offset:offset + 4 * num_unselected].cast('I')
+        view.release()
+        self.usable = bool(usable)
+
+        self._data_fp = open(self.data_file_path, 'rb')
+        self._data_map = mmap.mmap(self._data_fp.fileno(), 0, access=mmap.ACCESS_READ)
+        return True
+
+    def __len__(self):
+        return len(self._offsets) if self._offsets is not None else 0
+
+    def pool(self, use_all=False):
+        """
+        The numbers of the rows members may be drawn from.
+        :param use_all: If True the active rows, otherwise the active rows never selected
+        :return: sequence of row numbers
+        """
+        self.open()
+        return self._active if use_all else self._unselected
+
+    def row(self, row_number):
+        """
+        Decode one row of the data file.
+        :param row_number: The number of the row, counting the rows with an iMIS number
+        :return: (imis, last_name, first_name, active, dates_selected), see ImisFile.iter_rows
+        """
+        self.open()
+        start = self._offsets[row_number]
+        end = self._data_map.find(b'\n', start)
+        if end < 0:
+            end = len(self._data_map)
+        line = self._data_map[start:end].decode(locale.getpreferredencoding(False))
+        row = self._schema.decode(next(csv.reader([line], delimiter=",", quoting=csv.QUOTE_NONE), []))
+        if row is None or (start > 0 and self._data_map[start - 1:start] != b'\n'):
+            raise InvalidImisFile('The index of file "{0}" is out of date.'.format(self.data_file_path))
+        return row
+
+    def draw(self, how_many, use_all=False, rng=None, selections=None):
+        """
+        Draw how_many distinct members from the data file.  Only active members
+        are eligible and, unless use_all is given, only those that have never
+        been selected, neither in the data file nor in selections.
+
+        Rows are drawn with a partial Fisher-Yates shuffle that only keeps track
+        of the rows it has swapped, so a draw costs O(how_many) however many
+        rows there are.
+
+        :param how_many: The number of members to draw
+        :param use_all: If True members selected before are also eligible
+        :param rng: A random.Random instance, a system seeded one is used if not given
+        :param selections: dict of dates selected since the data file was written,
+                           {imis: [date, ...]}, see SelectionJournal.selections
+        :return list: The Members drawn, with the dates in selections added
+        """
+        if not self.usable:
+            raise InvalidImisFile('File "{0}" can not be drawn from through an index.'
+                                  .format(self.data_file_path))
+        if how_many < 0:
+            raise ValueError('Can not select a negative number of members.')
+        if rng is None:
+            rng = random.Random()
+        if selections is None:
+            selections = {}
+
+        pool = self.pool(use_all)
+        num_rows = len(pool)
+        if how_many > num_rows:
+            raise NotEnoughMembers('Can not select {0} members, only {1} eligible members are left.'
+                                   .format(how_many, num_rows))
+
+        randrange = rng.randrange
+        swapped = {}
+        drawn = []
+        i = 0
+        while len(drawn) < how_many and i < num_rows:
+            j = randrange(i, num_rows)
+            row_number = pool[swapped.get(j, j)]
+            swapped[j] = swapped.get(i, i)
+            i += 1
+
+            imis, last_name, first_name, active, dates_selected = self.row(row_number)
+            if not use_all and imis in selections:
+                # Selected since the data file was written
+                continue
+            member = Member(imis, first_name, last_name, active, dates_selected)
+            for date in selections.get(imis, ()):
+                member.add_selection(date)
+            drawn.append(member)
+
+        if len(drawn) < how_many:
+            raise NotEnoughMembers('Can not select {0} members, only {1} eligible members are left.'
+                                   .format(how_many, len(drawn)))
+        return drawn
+
+    def remove(self):
+        self.close()
+        if os.path.exists(self.file_path):
+            os.remove(self.file_path)
@@ -0,0 +1,320 @@
+__author__ = 'Shannon Jaeger'
+
+from ImisFile import ImisFile
+from SelectionJournal import SelectionJournal
+from utilities import atomic_write
+from array import array
+from bisect import bisect_left, bisect_right
+from itertools import accumulate
+from operator import itemgetter
+import calendar
+import datetime
+import marshal
+import os
+import struct
+
+# The key is stored ahead of the index with its length, so it can be checked
+# without loading the index
+_KEY_LENGTH = struct.Struct('<I')
+
+_by_imis = itemgetter(0)
+
+
+def to_ordinal(date):
+    """
+    :param date: A YYYYMMDD date
+    :return: The date's proleptic Gregorian ordinal, see datetime.date.toordinal,
+             None if it isn't a date
+    """
+    if len(date) != 8 or not date.isdigit():
+        return None
+    try:
+        return datetime.date(int(date[:4]), int(date[4:6]), int(date[6:])).toordinal()
+    except ValueError:
+        return None
+
+
+def from_ordinal(ordinal):
+    """
+    :param ordinal: A date ordinal, see to_ordinal
+    :return: The date as YYYYMMDD
+    """
+    return datetime.date.fromordinal(ordinal).strftime('%Y%m%d')
+
+
+def date_range(date):
+    """
+    The first and last day of a year, month or day.
+    :param date: YYYY, YYYYMM or YYYYMMDD, dashes are ignored
+    :return: (first, last) date ordinals
+    """
+    text = date.replace('-', '')
+    try:
+        if len(text) == 4 and text.isdigit():
+            year = int(text)
+            return datetime.date(year, 1, 1).toordinal(), datetime.date(year, 12, 31).toordinal()
+        if len(text) == 6 and text.isdigit():
+            year, month = int(text[:4]), int(text[4:])
+            return (datetime.date(year, month, 1).toordinal(),
+                    datetime.date(year, month, calendar.monthrange(year, month)[1]).toordinal())
+    except ValueError:
+        pass
+    ordinal = to_ordinal(text)
+    if ordinal is None:
+        raise ValueError('A date must be YYYY, YYYYMM or YYYYMMDD, not "{0}".'.format(date))
+    return ordinal, ordinal
+
+
+class SelectionHistory(object):
+    """
+    The dates each member of an iMIS data file was selected, held as date
+    ordinals, with an inverted index from each date to the members selected
+    on it, so the members selected on a day or in a range of dates, how many
+    selections were made in a range, and when a member was selected are
+    found without going through every member.
+
+    The index of the data file is kept next to it in <data file>.history, as
+    flat arrays sorted by date and by iMIS number that are searched with
+    bisect, and is rebuilt whenever the data file's inode, modification time
+    or size change.  Selections in the data file's journal are added to the
+    index as it's opened, the journal is kept small by compacting it.
+
+    Attributes:
+        data_file_path: The iMIS data file
+        file_path: The path to the index file
+    """
+
+    # Bump when the layout of the index changes so old indexes are rebuilt
+    version = 2
+
+    def __init__(self, data_file_path=None):
+        """
+        :param data_file_path: The iMIS data file the history belongs to, if any
+        """
+        self.data_file_path = str(data_file_path) if data_file_path is not None else None
+        self.file_path = self.data_file_path + '.history' if data_file_path is not None else None
+        # The distinct dates selections were made on, in order, and for each
+        # the members selected on it: date_imis[date_starts[i]:date_starts[i + 1]]
+        self._dates = array('i')
+        self._date_starts = array('I', [0])
+        self._date_imis = array('q')
+        # Every member in iMIS number order with the dates they were selected
+        # on, member_dates[member_starts[i]:member_starts[i + 1]], and their
+        # last and first names, names[name_starts[2 * i]:name_starts[2 * i + 2]]
+        self._imis = array('q')
+        self._member_starts = array('I', [0])
+        self._member_dates = array('i')
+        self._names = ''
+        self._name_starts = array('I', [0])
+        # Selections in the journal, not in the arrays above, as sorted
+        # (ordinal, imis) pairs and {imis: [ordinal, ...]}
+        self._extra = []
+        self._extra_by_member = {}
+
+    @classmethod
+    def from_rows(cls, rows, data_file_path=None):
+        """
+        Build the history of the members in a set of rows, each iMIS number
+        on one row only.
+        :param rows: iterable of (imis, last_name, first_name, active, dates_selected), see ImisFile.iter_rows
+        :param data_file_path: The iMIS data file the rows are from, if any
+        :return: SelectionHistory
+        """
+        history = cls(data_file_path)
+        rows = sorted(rows, key=_by_imis)
+        history._imis = array('q', map(_by_imis, rows))
+
+        names = [name for row in rows for name in (row[1], row[2])]
+        history._names = ''.join(names)
+        history._name_starts.extend(accumulate(map(len, names)))
+
+        by_date = {}
+        # Dates are parsed once however many members were selected on them
+        ordinal_of = {}
+        num_dates = []
+        member_dates = history._member_dates
+        for imis, _, _, _, dates_selected in rows:
+            if not dates_selected:
+                num_dates.append(0)
+                continue
+            ordinals = []
+            for date in dates_selected.split(':'):
+                if date not in ordinal_of:
+                    ordinal_of[date] = to_ordinal(date)
+                if ordinal_of[date] is not None:
+                    ordinals.append(ordinal_of[date])
+            ordinals.sort()
+            for ordinal in ordinals:
+                by_date.setdefault(ordinal, []).append(imis)
+            member_dates.extend(ordinals)
+            num_dates.append(len(ordinals))
+        history._member_starts.extend(accumulate(num_dates))
+
+        for ordinal in sorted(by_date):
+            history._dates.append(ordinal)
+            # Members were added in iMIS number order
+            history._date_imis.extend(by_date[ordinal])
+            history._date_starts.append(len(history._date_imis))
+        return history
+
+    def _stat_key(self):
+        st = os.stat(self.data_file_path)
+        return self.version, os.path.abspath(self.data_file_path), st.st_ino, st.st_mtime_ns, st.st_size
+
+    @classmethod
+    def open(cls, data_file_path, use_cache=True):
+        """
+        The history of an iMIS data file, from its index if that is up to
+        date, otherwise the data file is read and the index written.  The
+        selections in the data file's journal are added.
+        :param data_file_path: The iMIS data file
+        :param use_cache: If True read the data file through its snapshot, see ImisFile
+        :return: SelectionHistory
+        """
+        history = cls(data_file_path)
+        if not history._load():
+            key = history._stat_key()
+            imis_file = ImisFile(use_cache=use_cache)
+            imis_file.set_file_path(data_file_path)
+            # The journal is added after the index is saved, so the index
+            # only holds what is in the data file
+            rows = imis_file._read_rows()
+            if not isinstance(rows, list):
+                rows = list(rows)
+            if len(set(map(_by_imis, rows))) < len(rows):
+                # Fold the rows of a member the way ImisFile.read does
+                imis_file._add_rows(rows)
+                rows = [(member.imis, member.last_name, member.first_name, member.active,
+                         member.dates_selected) for member in imis_file.members.values()]
+            history = cls.from_rows(rows, data_file_path)
+            history._save(key)
+        history.add_selections(SelectionJournal(data_file_path).selections())
+        return history
+
+    def _load(self):
+        """
+        Load the index if it matches the data file.
+        :return: True if the index was loaded
+        """
+        try:
+            with open(self.file_path, 'rb') as fp:
+                key_length, = _KEY_LENGTH.unpack(fp.read(_KEY_LENGTH.size))
+                if marshal.loads(fp.read(key_length)) != self._stat_key():
+                    return False
+                blocks = marshal.loads(fp.read())
+        except (OSError, EOFError, ValueError, TypeError, struct.error):
+            return False
+
+        (dates, date_starts, date_imis, imis, member_starts, member_dates, self._names, name_starts) = blocks
+        for name, data in (('_dates', dates), ('_date_starts', date_starts), ('_date_imis', date_imis),
+                           ('_imis', imis), ('_member_starts', member_starts), ('_member_dates', member_dates),
+                           ('_name_starts', name_starts)):
+            values = array(getattr(self, name).typecode)
+            values.frombytes(data)
+            setattr(self, name, values)
+        return True
+
+    def _save(self, key):
+        """
+        Write the index, unless the data file changed since key was taken.
+        :param key: The key of the data file when it was read
+        :return: True if the index was written
+        """
+        if key != self._stat_key():
+            return False
+        blocks = (self._dates.tobytes(), self._date_starts.tobytes(), self._date_imis.tobytes(),
+                  self._imis.tobytes(), self._member_starts.tobytes(), self._member_dates.tobytes(),
+                  self._names, self._name_starts.tobytes())
+        with atomic_write(self.file_path, 'wb') as fp:
+            key = marshal.dumps(key)
+            fp.write(_KEY_LENGTH.pack(len(key)))
+            fp.write(key)
+            marshal.dump(blocks, fp)
+        return True
+
+    def remove(self):
+        if os.path.exists(self.file_path):
+            os.remove(self.file_path)
+
+    def add_selections(self, selections):
+        """
+        Add selections made since the history was built.
+        :param selections: dict of dates selected, {imis: [date, ...]}, see SelectionJournal.selections
+        :return: None
+        """
+        for imis, dates in selections.items():
+            for ordinal in map(to_ordinal, dates):
+                if ordinal is not None:
+                    self._extra.append((ordinal, imis))
+                    self._extra_by_member.setdefault(imis, []).append(ordinal)
+        self._extra.sort()
+
+    def _member_row(self, imis):
+        row = bisect_left(self._imis, imis)
+        return row if row < len(self._imis) and self._imis[row] == imis else None
+
+    def name(self, imis):
+        """
+        :param imis: An iMIS number
+        :return: (last_name, first_name) of the member, None if there is no such member
+        """
+        row = self._member_row(imis)
+        if row is None:
+            return None
+        starts = self._name_starts
+        return self._names[starts[2 * row]:starts[2 * row + 1]], self._names[starts[2 * row + 1]:starts[2 * row + 2]]
+
+    def dates_of(self, imis):
+        """
+        :param imis: An iMIS number
+        :return list: The date ordinals the member was selected on, in order
+        """
+        row = self._member_row(imis)
+        ordinals = [] if row is None else \
+            list(self._member_dates[self._member_starts[row]:self._member_starts[row + 1]])
+        if imis in self._extra_by_member:
+            ordinals = sorted(ordinals + self._extra_by_member[imis])
+        return ordinals
+
+    def _date_span(self, first, last):
+        return bisect_left(self._dates, first), bisect_right(self._dates, last)
+
+    def _extra_span(self, first, last):
+        return bisect_left(self._extra, (first,)), bisect_left(self._extra, (last + 1,))
+
+    def between(self, first, last):
+        """
+        The selections made from the first to the last date.
+        :param first: The first date ordinal
+        :param last: The last date ordinal, inclusive
+        :return list: (ordinal, imis) pairs, in date and then iMIS number order
+        """
+        start, end = self._date_span(first, last)
+        selections = []
+        for i in range(start, end):
+            ordinal = self._dates[i]
+            selections.extend((ordinal, imis) for imis in
+                              self._date_imis[self._date_starts[i]:self._date_starts[i + 1]])
+        extra_start, extra_end = self._extra_span(first, last)
+        if extra_start < extra_end:
+            selections = sorted(selections + self._extra[extra_start:extra_end])
+        return selections
+
+    def on(self, ordinal):
+        """
+        :param ordinal: A date ordinal
+        :return list: The iMIS numbers of the members selected on the date, in order
+        """
+        return [imis for _, imis in self.between(ordinal, ordinal)]
+
+    def count_between(self, first, last):
+        """
+        The number of selections made from the first to the last date, found
+        without going through them.
+        :param first: The first date ordinal
+        :param last: The last date ordinal, inclusive
+        :return: The number of selections
+        """
+        start, end = self._date_span(first, last)
+        extra_start, extra_end = self._extra_span(first, last)
+        return self._date_starts[end] - self._date_starts[start] + extra_end - extra_start
@@ -0,0 +1,145 @@
+__author__ = 'Shannon Jaeger'
+
+from utilities import fsync_dir
+import os
+
+_STAMP = 'compacted'
+
+
+class SelectionJournal(object):
+    """
+    An append-only journal of selections kept next to an iMIS data file, in
+    <data file>.journal.  Recording the members selected in a draw appends a
+    line per member to the journal instead of re-writing the whole data file.
+    The entries are applied to the members when the data file is read and
+    are folded back into the data file, and the journal removed, whenever the
+    data file is written (compacted).
+
+    Each line of the journal is "<iMIS number>,<YYYYMMDD>", a member selected
+    twice on the same day has two lines.  Just before a compacted data file
+    replaces the old one the journal is stamped with a line identifying the
+    new file, "compacted,<inode>,<modification time>,<size>".  While the data
+    file is the one named by a stamp the entries before the stamp are in it,
+    so a crash between writing the data file and removing the journal neither
+    loses selections nor applies them twice.  A stamp naming any other file
+    is from a compaction that never finished and is ignored.
+
+    Attributes:
+        data_file_path: The iMIS data file the journal belongs to
+        file_path: The path to the journal file
+    """
+
+    # Default size, in bytes, past which the journal should be compacted
+    compact_size = 64 * 1024
+
+    def __init__(self, data_file_path):
+        """
+        :param data_file_path: The iMIS data file the journal belongs to
+        """
+        assert(data_file_path is not None)
+        self.data_file_path = str(data_file_path)
+        self.file_path = str(data_file_path) + '.journal'
+
+    def exists(self):
+        return os.path.exists(self.file_path)
+
+    def size(self):
+        """
+        :return: The size of the journal in bytes, 0 if there isn't one
+        """
+        try:
+            return os.path.getsize(self.file_path)
+        except OSError:
+            return 0
+
+    def needs_compacting(self, compact_size=None):
+        """
+        :param compact_size: The size in bytes past which to compact, compact_size if not given
+        :return: True if the journal has grown past the size it should be compacted at
+        """
+        return self.size() > (compact_size if compact_size is not None else self.compact_size)
+
+    def append(self, entries):
+        """
+        Record selections in the journal.  The entries are on disk when this
+        returns.
+        :param entries: iterable of (imis, date) pairs, date as YYYYMMDD
+        :return: None
+        """
+        self._append(''.join('{0},{1}\n'.format(int(imis), date) for imis, date in entries))
+
+    def stamp(self, data_file_stat):
+        """
+        Record that a data file holding every entry in the journal is about to
+        replace the data file, see utilities.atomic_write.  Nothing is recorded
+        if there is no journal.
+        :param data_file_stat: The os.stat of the new data file
+        :return: None
+        """
+        if self.exists():
+            self._append('{0},{1.st_ino},{1.st_mtime_ns},{1.st_size}\n'.format(_STAMP, data_file_stat))
+
+    def _append(self, lines):
+        created = not self.exists()
+        with open(self.file_path, 'ab+') as fp:
+            # A line torn by a crash is ended first, so the new lines aren't
+            # written onto it
+            if fp.seek(0, os.SEEK_END) > 0:
+                fp.seek(-1, os.SEEK_END)
+                if fp.read(1) != b'\n':
+                    lines = '\n' + lines
+            fp.write(lines.encode())
+            fp.flush()
+            os.fsync(fp.fileno())
+        if created:
+            fsync_dir(os.path.dirname(os.path.abspath(self.file_path)))
+
+    def entries(self):
+        """
+        Read the entries not yet in the data file, those after the last stamp
+        naming the data file.  A line that was only partly written when a
+        crash happened is ignored.
+        :return: generator of (imis, date) pairs
+        """
+        if not self.exists():
+            return
+        entries = []
+        data_file_key = None
+        with open(self.file_path) as fp:
+            for line in fp:
+                if not line.endswith('\n'):
+                    continue
+                imis, _, date = line.strip().partition(',')
+                if imis.isdigit() and len(date) == 8 and date.isdigit():
+                    entries.append((int(imis), date))
+                elif imis == _STAMP:
+                    if data_file_key is None:
+                        data_file_key = self._data_file_key()
+                    if date == data_file_key:
+                        del entries[:]
+        yield from entries
+
+    def _data_file_key(self):
+        try:
+            st = os.stat(self.data_file_path)
+        except OSError:
+            return ''
+        return '{0.st_ino},{0.st_mtime_ns},{0.st_size}'.format(st)
+
+    def selections(self):
+        """
+        :return dict: The dates in the journal for each iMIS number, {imis: [date, ...]}
+        """
+        selections = {}
+        for imis, date in self.entries():
+            selections.setdefault(imis, []).append(date)
+        return selections
+
+    def remove(self):
+        """
+        Remove the journal, once its entries have been written to the data file.
+        :return: None
+        """
+        if self.exists():
+            os.remove(self.file_path)
+            fsync_dir(os.path.dirname(os.path.abspath(self.file_path)))
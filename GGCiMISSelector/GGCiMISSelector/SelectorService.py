@@ -0,0 +1,368 @@
+__author__ = 'Shannon Jaeger'
+
+from DataLock import DataLock
+from Exceptions import *
+from ImisFile import ImisFile
+from ImisStore import is_store_path
+from MemberPool import MemberPool, TieredMemberPool
+from MemberStats import MemberStats
+from SelectionJournal import SelectionJournal
+import asyncio
+import functools
+import json
+import os
+import random
+import signal
+import socket
+import time
+
+
+def _member_dict(member):
+    return {'imis': member.imis,
+            'last_name': member.last_name,
+            'first_name': member.first_name,
+            'active': member.active,
+            'dates_selected': member.dates_selected}
+
+
+def _draw_sizes(request):
+    """
+    The number of members to select in each draw of a select request, given
+    as sizes, or as draws of num members.
+    """
+    sizes = request.get('sizes')
+    if sizes is None:
+        sizes = [request.get('num', 3)] * request.get('draws', 1)
+    if not isinstance(sizes, list) or len(sizes) < 1 or \
+            any(not isinstance(size, int) or isinstance(size, bool) or size < 0 for size in sizes):
+        raise ValueError('The sizes of the draws must be a list of one or more numbers of members.')
+    return sizes
+
+
+class SelectorService(object):
+    """
+    A long-running service that keeps an iMIS CSV data file read into memory
+    and answers requests from other programs over a Unix socket, so the file
+    is not parsed again for every selection.
+
+    Each request is a JSON object on a line of its own, with the name of the
+    command in "command", and is answered with a JSON object on a line,
+    {"ok": true, "result": ...} or {"ok": false, "error": "<message>"}.
+    The commands are:
+
+        lookup    {"imis": <number>}, the member or null
+        stats     the member counts, the same as the stats command gives, see MemberStats.as_dict
+        select    {"num": 3, "draws": 1} or {"sizes": [...]}, "use_all" and
+                  "tier_threshold", see imisSelector.select_draws, a list of the
+                  members in each draw
+        merge     {"members": [<file path>, ...]}, "jobs", "max_rows" and "changes", see
+                  imisSelector.update_data, the new stats
+        shutdown  stop the service
+
+    Reads (lookup and stats) are answered straight away, from the data as it
+    was last read.  Changes (select and merge) are queued and carried out one
+    at a time by a single writer task, with the file work done in a thread so
+    reads carry on in the meantime.  As with the command line, selections are
+    appended to the data file's journal, which is compacted into the data file
+    once it grows past compact_size.
+
+    The data file and its journal are checked before each request, and every
+    poll_interval seconds, and read again if something else changed them.
+    Selections are made holding the data file's exclusive lock, so the
+    command line and other services can select and merge at the same time.
+
+    Attributes:
+        data_file_path: The iMIS data file
+        socket_path: The path of the Unix socket to listen on
+        data_lock: The DataLock of the data file, shared with other processes
+        imis_file: The ImisFile last read
+    """
+
+    def __init__(self, data_file_path, socket_path, make_backup=False, use_cache=True, compact_size=None,
+                 poll_interval=2.0, rng=None):
+        """
+        :param data_file_path: The iMIS data file, in csv format
+        :param socket_path: The path of the Unix socket to listen on
+        :param make_backup: If True back up the data file before it is re-written
+        :param use_cache: If True use, and keep up to date, the snapshot of the parsed data file
+        :param compact_size: Journal size in bytes to compact at, SelectionJournal.compact_size if not given
+        :param poll_interval: Seconds between checks of the data file for changes
+        :param rng: A random.Random instance, a system seeded one is used if not given
+        """
+        if is_store_path(data_file_path):
+            raise ValueError('Only an iMIS data file in csv format can be served, not "{0}".'
+                             .format(data_file_path))
+        self.data_file_path = str(data_file_path)
+        self.socket_path = str(socket_path)
+        self.make_backup = make_backup
+        self.use_cache = use_cache
+        self.compact_size = compact_size
+        self.poll_interval = poll_interval
+        self.rng = rng if rng is not None else random.Random()
+        self.data_lock = DataLock(self.data_file_path)
+        self.imis_file = None
+        self._key = None
+        self._lock = None
+        self._changes = None
+        self._stopped = None
+        self._server = None
+        self._tasks = []
+
+    def _stat_key(self):
+        st = os.stat(self.data_file_path)
+        try:
+            journal = os.stat(SelectionJournal(self.data_file_path).file_path)
+            journal_key = journal.st_mtime_ns, journal.st_size
+        except OSError:
+            journal_key = None
+        return st.st_ino, st.st_mtime_ns, st.st_size, journal_key
+
+    @staticmethod
+    def _run(function, *args):
+        """
+        Run a function in a thread, so the requests being read are still answered.
+        :return: Future of the function's result
+        """
+        return asyncio.get_running_loop().run_in_executor(None, functools.partial(function, *args))
+
+    def _load(self):
+        """
+        Read the data file, unless it's been read since it last changed,
+        alongside any select or merge from another process, see DataLock.read.
+        Run in a thread, with the lock held.
+        :return: ImisFile
+        """
+        key = self._stat_key()
+        if self.imis_file is None or key != self._key:
+            self.imis_file = self.data_lock.read(ImisFile, self.data_file_path, self.use_cache)
+            self._key = key
+        return self.imis_file
+
+    async def _read(self):
+        """
+        Read the data file, unless it's been read since it last changed.  Only
+        called with the lock held.
+        :return: ImisFile
+        """
+        return await self._run(self._load)
+
+    async def current(self):
+        """
+        The data file as it is on disk, read again if it changed.
+        :return: ImisFile
+        """
+        if self.imis_file is not None and self._stat_key() == self._key:
+            return self.imis_file
+        # Read once, however many requests find the file changed
+        async with self._lock:
+            return await self._read()
+
+    async def start(self):
+        """
+        Read the data file and start listening on the socket.
+        :return: self
+        """
+        self._lock = asyncio.Lock()
+        self._changes = asyncio.Queue()
+        self._stopped = asyncio.Event()
+        async with self._lock:
+            await self._read()
+        self._server = await asyncio.start_unix_server(self._handle_client, path=self.socket_path)
+        self._tasks = [asyncio.ensure_future(self._writer()), asyncio.ensure_future(self._watch())]
+        return self
+
+    def stop(self):
+        """
+        Have serve_forever return.
+        :return: None
+        """
+        self._stopped.set()
+
+    async def close(self):
+        """
+        Stop listening and remove the socket.
+        :return: None
+        """
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+
+    async def serve_forever(self):
+        """
+        Serve requests until stopped by a shutdown request, SIGINT or SIGTERM.
+        :return: None
+        """
+        await self.start()
+        loop = asyncio.get_running_loop()
+        for signal_number in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(signal_number, self.stop)
+            except (NotImplementedError, RuntimeError, ValueError):
+                # Signals can only be handled in the main thread
+                pass
+        try:
+            await self._stopped.wait()
+        finally:
+            await self.close()
+
+    async def _watch(self):
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            try:
+                await self.current()
+            except (OSError, InvalidImisFile) as e:
+                # Most likely caught part way through being replaced, try again
+                # next time
+                print('Could not read "{0}": {1}'.format(self.data_file_path, e))
+
+    async def _writer(self):
+        """
+        Carry out the queued changes one at a time.
+        """
+        while True:
+            change, request, future = await self._changes.get()
+            try:
+                result = await change(self, request)
+            except Exception as e:
+                if not future.cancelled():
+                    future.set_exception(e)
+            else:
+                if not future.cancelled():
+                    future.set_result(result)
+
+    async def _handle_client(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                response = await self._respond(line)
+                writer.write(json.dumps(response).encode('utf-8') + b'\n')
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def _respond(self, line):
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise ValueError('A request must be a JSON object.')
+            command = request.get('command')
+            if command in self._reads:
+                result = await self._reads[command](self, request)
+            elif command in self._changes_by_command:
+                future = asyncio.get_running_loop().create_future()
+                await self._changes.put((self._changes_by_command[command], request, future))
+                result = await future
+            elif command == 'shutdown':
+                self.stop()
+                result = None
+            else:
+                raise ValueError('Unknown command "{0}".'.format(command))
+        except Exception as e:
+            # A bad request, or one that can't be met, must not stop the service
+            return {'ok': False, 'error': str(e) or type(e).__name__}
+        return {'ok': True, 'result': result}
+
+    async def _lookup(self, request):
+        imis_file = await self.current()
+        member = imis_file.members.get(int(request['imis']))
+        return _member_dict(member) if member is not None else None
+
+    async def _stats(self, request):
+        return self._stats_of(await self.current())
+
+    @staticmethod
+    def _stats_of(imis_file):
+        return MemberStats.from_members(imis_file.members.values()).as_dict()
+
+    async def _select(self, request):
+        from imisSelector import _split_draws
+
+        sizes = _draw_sizes(request)
+        use_all = bool(request.get('use_all', False))
+        tier_threshold = request.get('tier_threshold')
+        async with self._lock:
+            selected_members = await self._run(self._select_members, sum(sizes), use_all, tier_threshold)
+        return [[_member_dict(member) for member in members] for members in _split_draws(selected_members, sizes)]
+
+    def _select_members(self, how_many, use_all, tier_threshold):
+        """
+        Draw members and record the selection holding the data file's
+        exclusive lock, so a select or merge from another process is neither
+        lost nor drawn from again.  The data file is read again first if one
+        changed it.  Run in a thread, with the lock held.
+        :return list: The Members selected
+        """
+        from imisSelector import _backup
+
+        with self.data_lock.exclusive():
+            imis_file = self._load()
+            selected_members = self._draw(imis_file, how_many, use_all, tier_threshold)
+
+            today = time.strftime("%Y%m%d")
+            journal = SelectionJournal(self.data_file_path)
+            with self.data_lock.changing():
+                journal.append([(member.imis, today) for member in selected_members])
+            for member in selected_members:
+                member.add_selection(today)
+            if journal.needs_compacting(self.compact_size):
+                if self.make_backup:
+                    _backup(self.data_file_path)
+                with self.data_lock.changing():
+                    imis_file.write()
+            # The members in memory already have the selections
+            self._key = self._stat_key()
+        return selected_members
+
+    def _draw(self, imis_file, how_many, use_all, tier_threshold):
+        if tier_threshold is not None:
+            pool = TieredMemberPool.from_imis_file(imis_file, tier_threshold, self.rng)
+        else:
+            pool = MemberPool.from_imis_file(imis_file, use_all, self.rng)
+        return pool.draw(how_many)
+
+    async def _merge(self, request):
+        from imisSelector import update_data
+
+        member_paths = request['members']
+        async with self._lock:
+            await self._run(update_data, self.data_file_path, member_paths, self.make_backup, self.use_cache,
+                            request.get('jobs'), request.get('max_rows'), request.get('changes'))
+            imis_file = await self._read()
+        return self._stats_of(imis_file)
+
+    _reads = {'lookup': _lookup, 'stats': _stats}
+    _changes_by_command = {'select': _select, 'merge': _merge}
+
+
+def request(socket_path, command, timeout=None, **arguments):
+    """
+    Send a request to a running SelectorService and wait for the answer.
+    :param socket_path: The path of the service's Unix socket
+    :param command: The command, see SelectorService
+    :param timeout: Seconds to wait for the answer, for ever if not given
+    :param arguments: The arguments of the command
+    :return: The result of the command
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.settimeout(timeout)
+        client.connect(str(socket_path))
+        client.sendall(json.dumps(dict(arguments, command=command)).encode('utf-8') + b'\n')
+        with client.makefile('rb') as fp:
+            line = fp.readline()
+    if not line:
+        raise ConnectionError('The service at "{0}" closed the connection.'.format(socket_path))
+    response = json.loads(line)
+    if not response['ok']:
+        raise ServiceError(response['error'])
+    return response['result']
@@ -0,0 +1,115 @@
+__author__ = 'Shannon Jaeger'
+
+from utilities import atomic_write
+import hashlib
+import marshal
+import os
+import struct
+
+# The key is stored ahead of the rows with its length, so it can be checked
+# without loading the rows
+_KEY_LENGTH = struct.Struct('<I')
+
+
+class SnapshotCache(object):
+    """
+    A binary snapshot of the rows parsed from an iMIS CSV data file, kept
+    next to it in <data file>.snapshot, so the next time the file is read the
+    CSV doesn't have to be parsed again.
+
+    A snapshot is only used if the data file still has the path, modification
+    time, size and content digest it had when the snapshot was made, so a
+    data file edited by hand is parsed again.  The rows are stored with
+    marshal, which can only hold plain values.
+
+    Attributes:
+        data_file_path: The iMIS data file
+        file_path: The path to the snapshot file
+    """
+
+    # Bump when the layout of the rows changes so old snapshots are ignored
+    version = 2
+
+    def __init__(self, data_file_path):
+        """
+        :param data_file_path: The iMIS data file the snapshot belongs to
+        """
+        assert(data_file_path is not None)
+        self.data_file_path = str(data_file_path)
+        self.file_path = self.data_file_path + '.snapshot'
+        self._key = None
+
+    def _stat_key(self):
+        st = os.stat(self.data_file_path)
+        return {'version': self.version,
+                'path': os.path.abspath(self.data_file_path),
+                'mtime_ns': st.st_mtime_ns,
+                'size': st.st_size}
+
+    def _digest(self):
+        digest = hashlib.blake2b(digest_size=16)
+        with open(self.data_file_path, 'rb') as fp:
+            for block in iter(lambda: fp.read(1 << 20), b''):
+                digest.update(block)
+        return digest.hexdigest()
+
+    def key(self):
+        """
+        The key a snapshot of the data file as it is now must have.
+        :return dict: version, path, mtime_ns, size and digest
+        """
+        key = self._stat_key()
+        key['digest'] = self._digest()
+        return key
+
+    def load(self):
+        """
+        Load the snapshot if it matches the data file.  The key of the data file
+        is remembered so a following save() stores the rows under the key the
+        file had before it was parsed.
+        :return: list of rows, see ImisFile.iter_rows, or None if there is no usable snapshot
+        """
+        stat_key = self._stat_key()
+        self._key = None
+        try:
+            with open(self.file_path, 'rb') as fp:
+                key_length, = _KEY_LENGTH.unpack(fp.read(_KEY_LENGTH.size))
+                key = marshal.loads(fp.read(key_length))
+                if isinstance(key, dict) and all(key.get(name) == value for name, value in stat_key.items()):
+                    # Only digest the data file when everything else matches
+                    self._key = dict(stat_key, digest=self._digest())
+                    if key.get('digest') == self._key['digest']:
+                        # marshal.load() reads a file in small pieces, loading
+                        # from one read of the whole thing is much faster
+                        return marshal.loads(fp.read())
+        except (OSError, EOFError, ValueError, TypeError, struct.error):
+            # No snapshot or a damaged one, the CSV will be parsed
+            pass
+
+        if self._key is None:
+            self._key = self.key()
+        return None
+
+    def save(self, rows):
+        """
+        Save a snapshot of the rows parsed from the data file.  The snapshot
+        isn't saved if the data file changed since load() was called.
+        :param rows: list of rows, see ImisFile.iter_rows
+        :return: True if the snapshot was saved
+        """
+        key = self._key if self._key is not None else self.key()
+        self._key = None
+        current = self._stat_key()
+        if any(key[name] != value for name, value in current.items()):
+            return False
+
+        with atomic_write(self.file_path, 'wb') as fp:
+            key = marshal.dumps(key)
+            fp.write(_KEY_LENGTH.pack(len(key)))
+            fp.write(key)
+            marshal.dump(rows, fp)
+        return True
+
+    def remove(self):
+        if os.path.exists(self.file_path):
+            os.remove(self.file_path)
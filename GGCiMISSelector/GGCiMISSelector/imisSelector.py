@@ -1,87 +1,448 @@
 __author__ = 'Shannon Jaeger'
 __version__ = '0.0.1'
 
-from ImisFile import ImisFile
+# The command line is run from cron and scripts many times a day, so only
+# what is needed to parse the arguments is imported here.  Each command
+# imports the modules it uses, so --version, --help and argument errors
+# don't load the data handling modules.
+from Exceptions import InvalidImisFile, NoImisFile, NotEnoughMembers
 import argparse
-import random
-import shutil
-import time
+import os
+
+def _backup(file_path):
+    """
+    Copy a data file to <file_path>.bk before it is altered.
+    :param file_path: The data file
+    :return: None
+    """
+    from Metrics import phase
+    import shutil
+    with phase('backup'):
+        shutil.copy(file_path, file_path+".bk")
 
-# TODO move from a csv file to a SqLite DB
 
-def update_data(current_file_path=None, new_data_file_path=None, make_backup=True):
+def member_file_paths(paths):
+    """
+    The member list files named by paths, a directory names all of the csv
+    files in it.
+    :param paths: A file or directory path, or a list of them
+    :return list: The file paths, the files in a directory in name order
+    """
+    if isinstance(paths, str):
+        paths = [paths]
+    file_paths = []
+    for path in paths:
+        if os.path.isdir(path):
+            file_paths.extend(os.path.join(path, name) for name in sorted(os.listdir(path))
+                              if name.lower().endswith('.csv'))
+        else:
+            file_paths.append(path)
+    return file_paths
+
+
+def update_data(current_file_path=None, new_data_file_path=None, make_backup=True, use_cache=True,
+                max_workers=None, max_rows=None, changes_path=None):
     """
     Merge copy of iMIS data with a new updated iMIS file.
 
     The new updated file is assumed to be the more up-to-date file, typically it
-    will be a report generated by the Girl Guides iMIS system
+    will be a report generated by the Girl Guides iMIS system.  When the members
+    are exported in several files, for example one for each council, they are
+    parsed in parallel and combined before they are merged, see ImisFile.from_files.
+    With max_rows the files are merged out of core instead, see ExternalMerge.
+    The merge is made holding the data file's exclusive lock, see DataLock.
     :param current_file_path: A properly constructed path to the file currently being
     used for iMIS number selection
     :param new_data_file_path: A properly constructed file path containing the new
-    iMIS data
+    iMIS data, or a list of them or a directory of csv files
+    :param make_backup: If True back up the current file before it is re-written
+    :param use_cache: If True use, and keep up to date, the snapshot of the parsed current file
+    :param max_workers: The most processes to parse several new files with, one per CPU if not given
+    :param max_rows: If given merge a csv data file holding at most this many rows in memory
+    :param changes_path: If given write the members who joined, lapsed, came back or were renamed
+                         to this file, as JSON lines if it ends in .jsonl or .json otherwise as csv,
+                         see Changeset, the changes are only tracked when it is given
     :return: True if the current file has been updated, False otherwise
     """
+    from DataLock import DataLock
+    from ImisFile import ImisFile
+    from ImisStore import ImisStore, is_store_path
+    from Metrics import phase
+
+    new_file_paths = member_file_paths(new_data_file_path)
+    if len(new_file_paths) == 0:
+        raise NoImisFile('No iMIS member files found in "{0}".'.format(new_data_file_path))
+
+    track_changes = changes_path is not None
+    changeset = None
+    lock = DataLock(current_file_path)
+    with lock.exclusive():
+        if max_rows is not None and not is_store_path(current_file_path):
+            if make_backup:
+                _backup(current_file_path)
+            from ExternalMerge import ExternalMerge
+            external_merge = ExternalMerge(max_rows)
+            with lock.changing():
+                # The changes are streamed to changes_path as the files are merged
+                updated = external_merge.merge(current_file_path, new_file_paths, changes_path=changes_path)
+        else:
+            if len(new_file_paths) == 1:
+                new_data = new_file_paths[0]
+            else:
+                new_data = ImisFile.from_files(new_file_paths, max_workers)
+
+            if is_store_path(current_file_path):
+                if make_backup:
+                    _backup(current_file_path)
+                with ImisStore(current_file_path) as store, phase('merge'):
+                    updated = store.merge(new_data, track_changes)
+                    changeset = store.changeset
+            else:
+                imis_file = ImisFile(current_file_path, use_cache)
+                updated = imis_file.merge(new_data, track_changes)
+                changeset = imis_file.changeset
 
-    imis_file = ImisFile(current_file_path)
-    imis_file.merge(new_data_file_path)
+                # TODO verify the correctness of the new file
+                if make_backup:
+                    _backup(current_file_path)
+                with lock.changing():
+                    imis_file.write()
 
+    if changeset is not None:
+        changeset.write(changes_path)
+    return updated
 
-    #print("          ACTIVE MEMBERS")
-    #print("--------------------------------------------------------")
-    #for member in imis_file.active_member_list:
-    #    print(str(member))
 
-    #print("\n\n          INACTIVE MEMBERS")
-    #print("--------------------------------------------------------")
-    #for member in imis_file.inactive_member_list:
-    #    print(str(member))
+def select_numbers(file_path=None, how_many=3, make_backup=False, use_all=False, rng=None,
+                   compact_size=None, use_cache=True, use_index=True, tier_threshold=None):
+    """
+    Select a set of iMIS numbers from the given file, a single draw, see
+    select_draws.
 
+    :param file_path:  The data file
+    :param how_many: The number of members to select
+    :param make_backup: If True back up the data file before it is re-written
+    :param use_all: If True members that have been selected before may be selected again
+    :param rng: A random.Random instance, a system seeded one is used if not given
+    :param compact_size: Journal size in bytes to compact at, SelectionJournal.compact_size if not given
+    :param use_cache: If True use, and keep up to date, the snapshot of the parsed data file
+    :param use_index: If True draw through the data file's index, see RowIndex
+    :param tier_threshold: If given select from the tiers of members this percentage allows,
+                           use_all is ignored
+    :return list: List of ImisFile.Member instances, the selected Members
+    """
+    return select_draws(file_path, [how_many], make_backup, use_all, rng, compact_size, use_cache,
+                        use_index, tier_threshold)[0]
 
-    # TODO verify the correctness of the new file
-    if make_backup:
-        shutil.copy(current_file_path, current_file_path+".bk")
-    imis_file.write()
 
-def select_numbers(file_path=None, how_many=3, make_backup=False, use_all=False):
+def select_draws(file_path=None, draw_sizes=(3,), make_backup=False, use_all=False, rng=None,
+                 compact_size=None, use_cache=True, use_index=True, tier_threshold=None):
     """
-    Select a set of iMIS numbers from the given file.
+    Make several draws of iMIS numbers from the given file at once, for
+    example one for each prize or newsletter issue.  The data file is read
+    once, no member is drawn more than once across the draws and all of the
+    selections are recorded together.
+
+    The selections are appended to the data file's journal rather than
+    re-writing the data file, the journal is compacted into the data file
+    once it grows past compact_size bytes.  Unless the journal is about to be
+    compacted the members are drawn through the data file's RowIndex, which
+    only decodes the rows drawn, rather than reading the whole file.
+
+    With a tier_threshold members that have been selected before become
+    eligible again once that percentage of the active members have been
+    selected as often, see MemberPool.tier_level.
+
+    The draws are made holding the data file's exclusive lock, see DataLock.
 
     :param file_path:  The data file
-    :param how_many:
-    :param use_all:
-    :return list: List of ImisFile.Member instances, the selected Members
+    :param draw_sizes: The number of members to select in each draw
+    :param make_backup: If True back up the data file before it is re-written
+    :param use_all: If True members that have been selected before may be selected again
+    :param rng: A random.Random instance, a system seeded one is used if not given
+    :param compact_size: Journal size in bytes to compact at, SelectionJournal.compact_size if not given
+    :param use_cache: If True use, and keep up to date, the snapshot of the parsed data file
+    :param use_index: If True draw through the data file's index, see RowIndex
+    :param tier_threshold: If given select from the tiers of members this percentage allows,
+                           use_all is ignored
+    :return list: A list of the ImisFile.Member instances selected in each draw
     """
+    from DataLock import DataLock
+
+    draw_sizes = list(draw_sizes)
+    if len(draw_sizes) < 1:
+        raise ValueError('At least one draw must be made.')
+    if any(how_many < 0 for how_many in draw_sizes):
+        raise ValueError('Can not select a negative number of members.')
 
-    # Read in the iMIS data
-    imis_file = ImisFile(file_path)
+    # Another select or a merge from another process waits rather than
+    # draw the same members or lose these selections
+    with DataLock(file_path).exclusive():
+        selected_members = _select(file_path, sum(draw_sizes), make_backup, use_all, rng, compact_size,
+                                   use_cache, use_index, tier_threshold)
+    draws = _split_draws(selected_members, draw_sizes)
+    _print_draws(draws)
+    return draws
 
-    # Set-up the random number generator
-    random.seed()
-    random.randrange(0, len(imis_file.active_member_list))
 
-    # Select the desired number of iMIS numbers
-    selected_members = []
-    while len(selected_members) < how_many:
-        new_idx = random.randint(0, len(imis_file.active_member_list))
-        member = imis_file.active_member_list[new_idx]
-        if use_all or len(member.dates_selected) < 1:
-            # We select this one.
-            if len(member.dates_selected) < 1:
-                member.dates_selected = time.strftime("%Y%m%d")
+def _select(file_path, how_many, make_backup, use_all, rng, compact_size, use_cache, use_index, tier_threshold):
+    """
+    Draw how_many members and record the selections, see select_draws.  The
+    members of all the draws are drawn together and dealt out to the draws
+    in order, so they are distinct and none of the draws is made unless all
+    of them can be.  Called holding the data file's exclusive lock.
+    :return list: The Members selected
+    """
+    from DataLock import DataLock
+    from ImisFile import ImisFile
+    from ImisStore import ImisStore, is_store_path
+    from MemberPool import MemberPool, TieredMemberPool
+    from MemberStats import MemberStats
+    from Metrics import phase
+    from RowIndex import RowIndex
+    from SelectionJournal import SelectionJournal
+    import time
+
+    if is_store_path(file_path):
+        # Only the rows of the selected members are updated in the database
+        if make_backup:
+            _backup(file_path)
+        with ImisStore(file_path) as store, phase('sample') as sampling:
+            selected_members = store.select(how_many, use_all, rng=rng, tier_threshold=tier_threshold)
+            sampling.rows = len(selected_members)
+        return selected_members
+
+    # Select the desired number of iMIS numbers from the eligible members,
+    # fails with NotEnoughMembers before anything is changed if there are
+    # too few of them.
+    lock = DataLock(file_path)
+    journal = SelectionJournal(file_path)
+    imis_file = None
+    selected_members = None
+    if use_index and tier_threshold is None and not journal.needs_compacting(compact_size):
+        with RowIndex(file_path) as index, phase('sample') as sampling:
+            if index.usable:
+                selected_members = index.draw(how_many, use_all, rng, journal.selections())
+                sampling.rows = len(selected_members)
+
+    if selected_members is None:
+        # Read in the iMIS data
+        imis_file = ImisFile(file_path, use_cache)
+        with phase('sample') as sampling:
+            if tier_threshold is not None:
+                pool = TieredMemberPool.from_imis_file(imis_file, tier_threshold, rng)
             else:
-                member.dates_selected += ':' + time.strftime("%Y%m%d")
-            selected_members.append(member)
+                pool = MemberPool.from_imis_file(imis_file, use_all, rng)
+            selected_members = pool.draw(how_many)
+            sampling.rows = len(selected_members)
+
+    today = time.strftime("%Y%m%d")
+    # The saved counts, if they are up to date, are updated with the selections
+    stats = MemberStats.load(file_path)
+    if stats is not None:
+        stats.record_selections(selected_members, today)
+    for member in selected_members:
+        member.add_selection(today)
+
+    with phase('write journal') as writing, lock.changing():
+        journal.append((member.imis, today) for member in selected_members)
+        writing.rows = len(selected_members)
+    if journal.needs_compacting(compact_size):
+        if imis_file is None:
+            # The journal, with the selections just made, is applied as it's read
+            imis_file = ImisFile(file_path, use_cache)
+        if make_backup:
+            _backup(file_path)
+        with lock.changing():
+            imis_file.write()
+    elif stats is not None:
+        stats.save()
+    return selected_members
+
+
+def _split_draws(selected_members, draw_sizes):
+    """
+    Deal the members selected out to the draws, in the order they were drawn.
+    :return list: A list of the Members in each draw
+    """
+    draws = []
+    start = 0
+    for how_many in draw_sizes:
+        draws.append(selected_members[start:start + how_many])
+        start += how_many
+    return draws
 
-    if make_backup:
-        shutil.copy(file_path, file_path+".bk")
-    imis_file.write()
 
-    print('Selected Members')
+def compact(file_path, make_backup=False):
+    """
+    Write the selections recorded in an iMIS data file's journal into the
+    data file and remove the journal.
+
+    :param file_path: The data file
+    :param make_backup: If True back up the data file before it is re-written
+    :return: The number of journal entries compacted
+    """
+    from DataLock import DataLock
+    from ImisFile import ImisFile
+    from SelectionJournal import SelectionJournal
+
+    lock = DataLock(file_path)
+    with lock.exclusive():
+        journal = SelectionJournal(file_path)
+        num_entries = sum(1 for _ in journal.entries())
+        if journal.exists():
+            imis_file = ImisFile(file_path, use_cache=True)
+            if make_backup:
+                _backup(file_path)
+            with lock.changing():
+                imis_file.write()
+    return num_entries
+
+
+def history(file_path, date=None, start=None, end=None, imis=None, count_only=False, use_cache=True):
+    """
+    Report the selections made on a date, in a range of dates, or of a
+    member, from the data file's SelectionHistory.
+
+    :param file_path: The iMIS data file, in csv format
+    :param date: A year YYYY, month YYYYMM or day YYYYMMDD to report the selections in
+    :param start: The first date of a range of dates, the first day of the selections if not given
+    :param end: The last date of a range of dates, the last day of the selections if not given
+    :param imis: The iMIS number of a member to report the selections of
+    :param count_only: If True only report the number of selections, not the members
+    :param use_cache: If True read the data file through its snapshot when the history is rebuilt
+    :return: list of (date, imis) pairs, dates as YYYYMMDD, in date order, or with count_only
+             the number of selections
+    """
+    from DataLock import DataLock
+    from ImisStore import is_store_path
+    from Metrics import phase
+    from SelectionHistory import SelectionHistory, date_range, from_ordinal
+    import datetime
+
+    if is_store_path(file_path):
+        raise ValueError('The selection history is kept for iMIS data files in csv format, not "{0}".'
+                         .format(file_path))
+    if sum((date is not None, start is not None or end is not None, imis is not None)) != 1:
+        raise ValueError('Give one of a date, a range of dates or an iMIS number.')
+
+    with phase('load history'):
+        selection_history = DataLock(file_path).read(SelectionHistory.open, file_path, use_cache)
+
+    with phase('query') as querying:
+        if imis is not None:
+            imis = int(imis)
+            title = 'Selections of {0}'.format(imis)
+            selections = [(ordinal, imis) for ordinal in selection_history.dates_of(imis)]
+            num_selections = len(selections)
+        else:
+            if date is not None:
+                first, last = date_range(date)
+            else:
+                first = date_range(start)[0] if start is not None else datetime.date.min.toordinal()
+                last = date_range(end)[1] if end is not None else datetime.date.max.toordinal()
+            # A bound that wasn't given is left out of the title
+            if start is None and date is None:
+                title = 'Selections up to {0}'.format(from_ordinal(last))
+            elif end is None and date is None:
+                title = 'Selections from {0} on'.format(from_ordinal(first))
+            else:
+                title = 'Selections from {0} to {1}'.format(from_ordinal(first), from_ordinal(last))
+            # Counting doesn't have to go through the selections
+            selections = selection_history.between(first, last) if not count_only else []
+            num_selections = selection_history.count_between(first, last)
+        querying.rows = num_selections
+
+    if count_only:
+        print('{0}: {1}'.format(title, num_selections))
+        return num_selections
+    print(title)
+    print('---------------------')
+    for ordinal, member_imis in selections:
+        last_name, first_name = selection_history.name(member_imis) or ('', '')
+        print('{0} {1: >8}: {2: >20} {3: >15}'.format(from_ordinal(ordinal), str(member_imis),
+                                                      last_name, first_name))
+    return [(from_ordinal(ordinal), member_imis) for ordinal, member_imis in selections]
+
+
+def stats(file_path):
+    """
+    Report the number of members, active and inactive members, and selected
+    and unselected members, as the legacy number_selector did, and how many
+    active members have been selected each number of times.  The counts of a
+    csv data file are saved, see MemberStats, so they are only made again when
+    the file has changed.
+
+    :param file_path: The iMIS data file, csv or SQLite
+    :return dict: total, active, inactive, inactive_selected, selected, unselected
+                  and wins, {times selected: active members}
+    """
+    from DataLock import DataLock
+    from ImisStore import ImisStore, is_store_path
+    from MemberStats import MemberStats
+    from Metrics import phase
+
+    with phase('stats'):
+        if is_store_path(file_path):
+            with ImisStore(file_path) as store:
+                counts = store.stats()
+        else:
+            # Counted alongside a select or merge rather than waiting for it
+            counts = DataLock(file_path).read(MemberStats.open, file_path).as_dict()
+
+    print('Total number of Members:                %d' % counts['total'])
+    print('Number of Active Members:               %d' % counts['active'])
+    print('Number of Inactive Members:             %d' % counts['inactive'])
+    print('Number of Inactive Selected Members:    %d' % counts['inactive_selected'])
+    print('Number of Unselected Members:           %d' % counts['unselected'])
+    print('Number of Selected Members:             %d' % counts['selected'])
+    print('')
+    print('Times Selected    Active Members')
+    print('---------------------')
+    for times_selected in sorted(counts['wins']):
+        print('{0: >14}    {1}'.format(times_selected, counts['wins'][times_selected]))
+    return counts
+
+
+def _print_draws(draws):
+    if len(draws) == 1:
+        _print_selected(draws[0])
+        return
+    for number, selected_members in enumerate(draws, 1):
+        if number > 1:
+            print('')
+        _print_selected(selected_members, 'Draw {0} of {1}: {2} Members'.format(number, len(draws),
+                                                                             len(selected_members)))
+
+
+def _print_selected(selected_members, title='Selected Members'):
+    print(title)
     print('---------------------')
     for member in selected_members:
         print(str(member))
 
-    return selected_members
+
+def convert(source_path, dest_path):
+    """
+    Convert an iMIS CSV data file to an SQLite iMIS database or the other way
+    around, which way is decided from the file extensions.
+
+    :param source_path: The file to convert
+    :param dest_path: The file to create
+    :return: None
+    """
+    from DataLock import DataLock
+    from ImisStore import ImisStore, is_store_path
+
+    if is_store_path(dest_path) and not is_store_path(source_path):
+        with DataLock(source_path).shared(), ImisStore(dest_path) as store:
+            store.import_csv(source_path)
+    elif is_store_path(source_path) and not is_store_path(dest_path):
+        lock = DataLock(dest_path, create=True)
+        with lock.exclusive(), lock.changing(), ImisStore(source_path) as store:
+            store.export_csv(dest_path)
+    else:
+        raise ValueError('Can only convert between a csv file and an SQLite database (.db, .sqlite).')
 
 
 def parser():
@@ -96,59 +457,217 @@ def parser():
        from the provided iMIS data file at random
     2. iMIS data file update: Update the iMIS data file being used for number
        selection from an updated iMIS member list
+    3. iMIS data file conversion: Convert an iMIS data file between csv and
+       an SQLite database (.db, .sqlite)
+    4. iMIS data file compaction: Write the selections recorded in the data
+       file's journal into the data file
+    5. iMIS selector service: Keep the data file in memory and answer
+       requests on a Unix socket
+    6. iMIS selection history: List who was selected on a date, in a range of
+       dates, or when a member was selected
+    7. iMIS statistics: Count the members, and how many times they have been
+       selected
 
     Command-line Arguments
     --------------------------
     -i <file_path> iMIS data file for number selection
     -n <integer> number of random iMIS numbers to be selected
+    -d <integer> number of draws of -n iMIS numbers to make
+    -s <integer> [<integer> ...] number of iMIS numbers to select in each draw
     -r if listed then re-use iMIS numbers that have been selected before.
+    -t <percent> re-use iMIS numbers selected x times once this percentage of
+       active members have been selected x times
     -b Create a backup iMIS data file before writing
 
     -c <file_path> Current iMIS data file being used for number selection
-    -m <file_path> New iMIS member list
+    -m <file_path> [<file_path> ...] New iMIS member lists, or directories of them
+    -j <integer> number of processes to read the member lists with
+    --max-rows <integer> merge out of core holding at most this many rows in memory
+    --changes <file_path> write who joined, lapsed, came back or was renamed, csv or .jsonl
+    -b Create a backup iMIS data file before writing
+
+    -i <file_path> iMIS data file, csv or SQLite, to convert
+    -o <file_path> iMIS data file, SQLite or csv, to create
+
+    -i <file_path> iMIS data file to compact
     -b Create a backup iMIS data file before writing
 
+    -i <file_path> iMIS data file to serve
+    --socket <file_path> Unix socket to listen on
+    --poll <seconds> time between checks of the data file for changes
+
+    -i <file_path> iMIS data file to query
+    -d <date> the selections on a date, a year YYYY, a month YYYYMM or a day YYYYMMDD
+    --from <date> --to <date> the selections in a range of dates
+    -m <integer> when a member was selected
+    -c print the number of selections only
+
+    -i <file_path> iMIS data file, csv or SQLite, to count
+
+    Every mode also takes
+    --profile print the time, rows and peak memory of each phase, as does -vb 1
+    --metrics-out <file_path> write the time, rows and peak memory of each phase as JSON
+    --cprofile-out <file_path> write cProfile statistics of the run
+
     :return: None
     """
     parser = argparse.ArgumentParser(description='iMIS number selector and data file manager.')
     parser.add_argument('-v', '--version', action='version', version='%(prog)s '+str(__version__))
 
+    # Options every command takes
+    instrument_parser = argparse.ArgumentParser(add_help=False)
+    instrument_parser.add_argument('--profile', action='store_true', dest='profile',
+                                   help='If provided, print the time, rows and peak memory of each phase.')
+    instrument_parser.add_argument('--metrics-out', type=str, dest='metrics_out', default=None,
+                                   help='File path to write the time, rows and peak memory of each phase to as JSON.')
+    instrument_parser.add_argument('--cprofile-out', type=str, dest='cprofile_out', default=None,
+                                   help='File path to write cProfile statistics of the run to, '
+                                        'for reading with pstats or snakeviz.')
+
     select_options = \
         """ -i --imis_file     File path to an iMIS data file in csv format.\n
             -n --num           Number of iMIS numbers to select.\n
+            -d --draws         Number of draws of --num iMIS numbers to make.\n
+            -s --sizes         Number of iMIS numbers to select in each draw.\n
             -r --reuse         Re-use iMIS numbers that have been selected before.\n
             -b --backup        Create a back-up of the iMIS data file before altering it.\n
         """
     subparsers = parser.add_subparsers()
-    parser_select = subparsers.add_parser('select',
+    parser_select = subparsers.add_parser('select', parents=[instrument_parser],
                                help="Select iMIS numbers: -i <file_path> [-n <num_to_pick> --resuse --backup]")
     parser_select.add_argument('-i', '--imis_file', dest='imis_file', required=True,
-                               help='Fully specified file path to the iMIS data file in csv format.')
+                               help='Fully specified file path to the iMIS data file in csv format, '
+                                    'or an SQLite database (.db, .sqlite).')
     parser_select.add_argument('-n', '--num', type=int, dest='num', default='10',
                                help='Number of iMIS numbers to select.')
-    parser_select.add_argument('-r', '--reuse', action='store_true', dest='reuse',
-                               help='If provided, re-use previously selected iMIS numbers.')
+    draws_group = parser_select.add_mutually_exclusive_group()
+    draws_group.add_argument('-d', '--draws', type=int, dest='draws', default=1,
+                             help='Number of draws of --num iMIS numbers to make, no iMIS number is '
+                                  'selected in more than one draw.')
+    draws_group.add_argument('-s', '--sizes', type=int, dest='sizes', nargs='+', default=None, metavar='NUM',
+                             help='Make a draw of each of these numbers of iMIS numbers, for example one '
+                                  'per prize tier, instead of --draws of --num.')
+    reuse_group = parser_select.add_mutually_exclusive_group()
+    reuse_group.add_argument('-r', '--reuse', action='store_true', dest='reuse',
+                             help='If provided, re-use previously selected iMIS numbers.')
+    reuse_group.add_argument('-t', '--tier-threshold', type=float, dest='tier_threshold', default=None,
+                             metavar='PERCENT',
+                             help='If provided, members selected x times may be selected again once this '
+                                  'percentage of the active members have been selected x times.')
     parser_select.add_argument('-b', '--backup', action='store_true', dest='backup',
                                help='If provided, backup any altered iMIS data file.')
     parser_select.add_argument('-v', '--version', action='version', version='%(prog)s '+str(__version__))
     parser_select.add_argument('-vb', '--verbose', dest='verbose', type=int, nargs=1, default=0,
                                choices=[0,1,2,3], help='Run verbosely, display more processing details.')
+    parser_select.add_argument('--no-cache', action='store_false', dest='cache',
+                               help='If provided, always parse the iMIS data file, ignoring its snapshot.')
+    parser_select.add_argument('--no-index', action='store_false', dest='index',
+                               help='If provided, read the whole iMIS data file instead of drawing through its index.')
+    parser_select.set_defaults(command='select')
 
 
-    parser_merge = subparsers.add_parser('merge',
+    parser_merge = subparsers.add_parser('merge', parents=[instrument_parser],
                                          help='Merge two iMIS data files together into one.')
     parser_merge.add_argument('-i', '--imis_file', type=str, dest='imis_file', required=True,
-                              help='File path to the iMIS data file in csv format.')
-    parser_merge.add_argument('-m', '--members', type=str, dest='member_file', required=True,
-                              help='File path to the iMIS Member List generate by iMIS in csv format.')
+                              help='File path to the iMIS data file in csv format, or an SQLite database.')
+    parser_merge.add_argument('-m', '--members', type=str, dest='member_file', required=True, nargs='+',
+                              help='File paths to the iMIS Member Lists generated by iMIS in csv format, '
+                                   'or directories of them.')
+    parser_merge.add_argument('-j', '--jobs', type=int, dest='jobs', default=None,
+                              help='Number of processes to read several member lists with, one per CPU by default.')
     parser_merge.add_argument('-b', '--backup', action='store_true', dest='backup',
                               help='If provided, backup any altered iMIS data file.')
+    parser_merge.add_argument('--max-rows', type=int, dest='max_rows', default=None,
+                              help='If provided, merge out of core holding at most this many rows in memory, '
+                                   'for files too large to merge in memory.')
+    parser_merge.add_argument('--changes', type=str, dest='changes', default=None,
+                              help='If provided, write the members who joined, lapsed, came back or were '
+                                   'renamed to this file, as JSON lines if it ends in .jsonl, otherwise as csv.')
     parser_merge.add_argument('-v', '--version', action='version', version='%(prog)s '+str(__version__))
     parser_merge.add_argument('-vb', '--verbose', dest='verbose', type=int, nargs=1, default=0,
                                choices=[0,1,2,3], help='Run verbosely, display more processing details.')
+    parser_merge.add_argument('--no-cache', action='store_false', dest='cache',
+                              help='If provided, always parse the iMIS data file, ignoring its snapshot.')
+    parser_merge.set_defaults(command='merge')
+
+    parser_convert = subparsers.add_parser('convert', parents=[instrument_parser],
+                                           help='Convert an iMIS data file between csv and SQLite.')
+    parser_convert.add_argument('-i', '--imis_file', type=str, dest='imis_file', required=True,
+                                help='File path to the iMIS data file, csv or SQLite, to convert.')
+    parser_convert.add_argument('-o', '--output', type=str, dest='output_file', required=True,
+                                help='File path to the SQLite (.db, .sqlite) or csv file to create.')
+    parser_convert.set_defaults(command='convert')
+
+    parser_compact = subparsers.add_parser('compact', parents=[instrument_parser],
+                                           help='Write the selections in the journal into the iMIS data file.')
+    parser_compact.add_argument('-i', '--imis_file', type=str, dest='imis_file', required=True,
+                                help='File path to the iMIS data file in csv format.')
+    parser_compact.add_argument('-b', '--backup', action='store_true', dest='backup',
+                                help='If provided, backup any altered iMIS data file.')
+    parser_compact.set_defaults(command='compact')
+
+    parser_serve = subparsers.add_parser('serve', parents=[instrument_parser],
+                                         help='Keep the iMIS data file in memory and answer requests on a socket.')
+    parser_serve.add_argument('-i', '--imis_file', type=str, dest='imis_file', required=True,
+                              help='File path to the iMIS data file in csv format.')
+    parser_serve.add_argument('--socket', type=str, dest='socket', required=True,
+                              help='File path of the Unix socket to listen on.')
+    parser_serve.add_argument('--poll', type=float, dest='poll', default=2.0, metavar='SECONDS',
+                              help='Seconds between checks of the iMIS data file for changes.')
+    parser_serve.add_argument('-b', '--backup', action='store_true', dest='backup',
+                              help='If provided, backup any altered iMIS data file.')
+    parser_serve.add_argument('--no-cache', action='store_false', dest='cache',
+                              help='If provided, always parse the iMIS data file, ignoring its snapshot.')
+    parser_serve.set_defaults(command='serve')
+
+    parser_history = subparsers.add_parser('history', parents=[instrument_parser],
+                                           help='List who was selected on a date, in a range of dates, '
+                                                'or when a member was selected.')
+    parser_history.add_argument('-i', '--imis_file', type=str, dest='imis_file', required=True,
+                                help='File path to the iMIS data file in csv format.')
+    query_group = parser_history.add_mutually_exclusive_group()
+    query_group.add_argument('-d', '--date', type=str, dest='date', default=None,
+                             help='The selections in a year YYYY, a month YYYYMM or on a day YYYYMMDD.')
+    query_group.add_argument('--from', type=str, dest='start', default=None, metavar='DATE',
+                             help='The selections from this date on, may be given with --to.')
+    query_group.add_argument('-m', '--member', type=int, dest='member', default=None, metavar='IMIS',
+                             help='The dates the member with this iMIS number was selected on.')
+    parser_history.add_argument('--to', type=str, dest='end', default=None, metavar='DATE',
+                                help='The selections up to and including this date.')
+    parser_history.add_argument('-c', '--count', action='store_true', dest='count',
+                                help='If provided, only print the number of selections.')
+    parser_history.add_argument('--no-cache', action='store_false', dest='cache',
+                                help='If provided, always parse the iMIS data file, ignoring its snapshot.')
+    parser_history.set_defaults(command='history')
+
+    parser_stats = subparsers.add_parser('stats', parents=[instrument_parser],
+                                         help='Count the members, and how many times they have been selected.')
+    parser_stats.add_argument('-i', '--imis_file', type=str, dest='imis_file', required=True,
+                              help='File path to the iMIS data file in csv format, or an SQLite database.')
+    parser_stats.set_defaults(command='stats')
 
     return parser
 
+def serve(file_path, socket_path, make_backup=False, use_cache=True, poll_interval=2.0):
+    """
+    Keep the data file in memory and answer requests for it on a Unix socket
+    until stopped, see SelectorService.
+    :param file_path: The iMIS data file, in csv format
+    :param socket_path: The path of the Unix socket to listen on
+    :param make_backup: If True back up the data file before it is re-written
+    :param use_cache: If True use, and keep up to date, the snapshot of the parsed data file
+    :param poll_interval: Seconds between checks of the data file for changes
+    :return: 0
+    """
+    from SelectorService import SelectorService
+    import asyncio
+
+    service = SelectorService(file_path, socket_path, make_backup, use_cache, poll_interval=poll_interval)
+    print('Serving "{0}" on "{1}"'.format(file_path, socket_path))
+    asyncio.run(service.serve_forever())
+    return 0
+
+
 def main(cli_args):
     try:
         the_parser = parser()
@@ -157,12 +676,93 @@ def main(cli_args):
         print(str(e))
         return -1
 
-    if hasattr(parsed_args, 'imis_file') and hasattr(parsed_args, 'num'):
-        select_numbers(parsed_args.imis_file, parsed_args.num, parsed_args.backup, parsed_args.reuse)
-    elif hasattr(parsed_args, 'imis_file') and hasattr(parsed_args, 'member_file'):
-        update_data(parsed_args.imis_file, parsed_args.member_file, parsed_args.backup)
+    # Only pay for the instrumentation when it was asked for
+    verbose = getattr(parsed_args, 'verbose', 0)
+    show_profile = getattr(parsed_args, 'profile', False) or (verbose[0] if verbose else 0) > 0
+    metrics_out = getattr(parsed_args, 'metrics_out', None)
+    cprofile_out = getattr(parsed_args, 'cprofile_out', None)
+    metrics = None
+    if show_profile or metrics_out is not None:
+        from Metrics import Metrics
+        metrics = Metrics().start()
+    profiler = None
+    if cprofile_out is not None:
+        import cProfile
+        profiler = cProfile.Profile()
+
+    if profiler is not None:
+        profiler.enable()
+    try:
+        result = _run_command(the_parser, parsed_args)
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(cprofile_out)
+        if metrics is not None:
+            metrics.stop()
+            if show_profile:
+                print(metrics.report())
+            if metrics_out is not None:
+                metrics.write_json(metrics_out, command=getattr(parsed_args, 'command', None))
+    return result
+
+
+def _run_command(the_parser, parsed_args):
+    command = getattr(parsed_args, 'command', None)
+    if command == 'select':
+        try:
+            draw_sizes = parsed_args.sizes
+            if draw_sizes is None:
+                draw_sizes = [parsed_args.num] * parsed_args.draws
+            select_draws(parsed_args.imis_file, draw_sizes, parsed_args.backup, parsed_args.reuse,
+                         use_cache=parsed_args.cache, use_index=parsed_args.index,
+                         tier_threshold=parsed_args.tier_threshold)
+        except (InvalidImisFile, NotEnoughMembers, OSError, ValueError) as e:
+            print(str(e))
+            return -1
+    elif command == 'merge':
+        try:
+            update_data(parsed_args.imis_file, parsed_args.member_file, parsed_args.backup, parsed_args.cache,
+                        parsed_args.jobs, parsed_args.max_rows, parsed_args.changes)
+        except (NoImisFile, OSError, ValueError) as e:
+            print(str(e))
+            return -1
+    elif command == 'convert':
+        try:
+            convert(parsed_args.imis_file, parsed_args.output_file)
+        except ValueError as e:
+            print(str(e))
+            return -1
+    elif command == 'compact':
+        try:
+            compact(parsed_args.imis_file, parsed_args.backup)
+        except OSError as e:
+            print(str(e))
+            return -1
+    elif command == 'serve':
+        try:
+            serve(parsed_args.imis_file, parsed_args.socket, parsed_args.backup, parsed_args.cache, parsed_args.poll)
+        except (OSError, ValueError) as e:
+            print(str(e))
+            return -1
+    elif command == 'history':
+        try:
+            history(parsed_args.imis_file, parsed_args.date, parsed_args.start, parsed_args.end,
+                    parsed_args.member, parsed_args.count, parsed_args.cache)
+        except (InvalidImisFile, OSError, ValueError) as e:
+            print(str(e))
+            return -1
+    elif command == 'stats':
+        # Only imported for the error a damaged SQLite store raises
+        import sqlite3
+        try:
+            stats(parsed_args.imis_file)
+        except (InvalidImisFile, OSError, ValueError, sqlite3.Error) as e:
+            print(str(e))
+            return -1
     else:
-        the_parser.error("\"merged\" or \"select\" must be specified.")
+        the_parser.error("\"merge\", \"select\", \"convert\", \"compact\", \"serve\", \"history\" or "
+                         "\"stats\" must be specified.")
         return -1
 
 
@@ -1,6 +1,11 @@
 __author__ = 'Shannon Jaeger'
 
 import contextlib
+import os
+import shutil
+import tempfile
+import unittest
+
 @contextlib.contextmanager
 def capture():
     import sys
@@ -16,6 +21,26 @@ def capture():
         out[1] = out[1].getvalue()
 
 
+class TempDirTestCase(unittest.TestCase):
+    """
+    A test case with a temporary directory, tmp_dir, for the files its tests
+    write.  The directory is removed after each test.
+    """
 
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
 
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
 
+    def _write_file(self, name, lines):
+        """
+        Write lines to a file in tmp_dir.
+        :param name: The name of the file
+        :param lines: The lines to write, without line endings
+        :return: The path to the file
+        """
+        file_path = os.path.join(self.tmp_dir, name)
+        with open(file_path, 'w') as fp:
+            fp.write('\n'.join(lines) + '\n')
+        return file_path
@@ -0,0 +1,497 @@
+__author__ = 'Shannon Jaeger'
+
+# Benchmarks for the iMIS file engine.  These are not unit tests, run them
+# from the GGCiMISSelector directory with:
+#
+#     python -m test.benchmark merge -s 100000 1000000
+#     python -m test.benchmark members -s 1000000
+#     python -m test.benchmark suite -s 10000 100000 1000000 -o results.json
+#     python -m test.benchmark importtime -- --version
+
+import argparse
+import contextlib
+import csv
+import json
+import math
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from ImisFile import ImisFile, Member
+from test.name_generator import NameGenerator
+import imisSelector
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+
+# The operations timed by the suite, in the order they are run
+SUITE_OPERATIONS = ['read', 'merge', 'write', 'select']
+
+# Modules the command line must not load for --version, --help or an argument error
+DATA_MODULES = ['ImisFile', 'ImisSchema', 'ImisStore', 'MemberPool', 'MemberStats', 'MemberTable',
+                'RowIndex', 'ExternalMerge', 'Changeset', 'DataLock', 'SelectionHistory', 'SelectionJournal',
+                'SnapshotCache', 'SelectorService', 'Metrics', 'csv', 'sqlite3', 'random', 'json', 'concurrent.futures',
+                'tracemalloc', 'asyncio']
+
+# Milliseconds starting the command line for --version, --help or an argument
+# error may take, the importtime benchmark reports runs past it
+IMPORT_BUDGET_MS = 40
+
+
+def make_files(size, seed=0):
+    """
+    Build a pair of in-memory iMIS files that look like a monthly update, the
+    current data file with some selection history and a new member export
+    where a few members have lapsed and a few have joined.
+    :param size: Number of members in the current data file
+    :param seed: Seed for the random number generator so runs are repeatable
+    :return: (current ImisFile, new ImisFile)
+    """
+    rng = random.Random(seed)
+
+    current = ImisFile()
+    current.set_file_path('current.csv')
+    for imis in range(10000, 10000 + size):
+        dates = '20151123' if rng.random() < 0.05 else ''
+        current.members[imis] = Member(imis, 'First%d' % rng.randrange(size),
+                                       'Last%d' % rng.randrange(size),
+                                       rng.random() < 0.9, dates)
+    current._split_members()
+
+    new = ImisFile()
+    new.set_file_path('members.csv')
+    for imis in range(10000 + size // 20, 10000 + size + size // 20):
+        new.members[imis] = Member(imis, 'First%d' % rng.randrange(size),
+                                   'Last%d' % rng.randrange(size), True)
+    new._split_members()
+
+    return current, new
+
+
+def legacy_merge(current, new):
+    """
+    The list.index/pop merge ImisFile used before members were keyed on iMIS
+    number, kept here as the baseline.  Brand new members are appended rather
+    than crashing the way the old code did.
+    """
+    for member in current.active_member_list:
+        member.active = False
+        current.inactive_member_list.append(member)
+    current.active_member_list = []
+
+    new.active_member_list.sort(key=lambda m: (m.last_name.lower(), m.first_name.lower()))
+    for new_member in new.active_member_list:
+        try:
+            pos = current.inactive_member_list.index(new_member)
+            old_member = current.inactive_member_list.pop(pos)
+        except ValueError:
+            old_member = new_member
+
+        old_member.active = True
+        if len(new_member.last_name) > 0:
+            old_member.last_name = new_member.last_name
+        if len(new_member.first_name) > 0:
+            old_member.first_name = new_member.first_name
+        current.active_member_list.append(old_member)
+
+    current.inactive_member_list = current.inactive_member_list + new.inactive_member_list
+    current.inactive_member_list.sort(key=lambda m: (m.last_name.lower(), m.first_name.lower()))
+
+
+class LegacyMember(object):
+    """
+    Member as it was before it had __slots__ and a cached sort key, a plain
+    object compared with hand written comparisons that lower case both names
+    every time.  Kept here as the baseline.
+    """
+    def __init__(self, imis, first_name, last_name, active, dates_selected):
+        self.imis = imis
+        self.first_name = first_name
+        self.last_name = last_name
+        self.active = active
+        self.dates_selected = dates_selected
+
+    def __lt__(self, other):
+        if self.active != other.active and self.active:
+            return False
+        elif self.active != other.active:
+            return True
+        elif self.last_name.lower() != other.last_name.lower():
+            return self.last_name.lower() < other.last_name.lower()
+        else:
+            return self.first_name.lower() < other.first_name.lower()
+
+
+def _time(func, *args):
+    start = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - start
+
+
+def bench_merge(sizes, legacy_max):
+    """
+    Time ImisFile.merge against the legacy merge for each size.  The legacy
+    merge is quadratic so it is only run up to legacy_max members.
+    """
+    print('{0: >10} {1: >12} {2: >12} {3: >10}'.format('members', 'merge (s)', 'legacy (s)', 'speedup'))
+    for size in sizes:
+        current, new = make_files(size)
+        merge_time = _time(current.merge, new)
+
+        legacy = ''
+        speedup = ''
+        if size <= legacy_max:
+            current, new = make_files(size)
+            legacy_time = _time(legacy_merge, current, new)
+            legacy = '{0:.3f}'.format(legacy_time)
+            speedup = '{0:.1f}x'.format(legacy_time / merge_time)
+
+        print('{0: >10} {1: >12.3f} {2: >12} {3: >10}'.format(size, merge_time, legacy, speedup))
+
+
+def _build_members(member_class, rows, sort, rng):
+    """
+    Build and sort the members, noting the memory they use once built and
+    again once sorted, when Member also holds its cached sort key.
+    """
+    tracemalloc.start()
+    start = time.perf_counter()
+    members = [member_class(*row) for row in rows]
+    build_time = time.perf_counter() - start
+    built_memory = tracemalloc.get_traced_memory()[0]
+    rng.shuffle(members)
+    sort_time = _time(sort, members)
+    sorted_memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return members, build_time, sort_time, built_memory, sorted_memory
+
+
+def bench_members(sizes):
+    """
+    Compare the memory used by, and the time to build and sort, Member with
+    the legacy __dict__ based member.  The names themselves are shared by both
+    so only the member objects are counted, as built and once sorted, which
+    adds the sort keys and case folded names Member caches.
+    """
+    print('{0: >10} {1: >10} {2: >10} {3: >10} {4: >10} {5: >12} {6: >10} {7: >12}'.format(
+        'members', 'class', 'build (s)', 'sort (s)', 'MB', 'bytes/member', 'sorted MB', 'sorted b/m'))
+    for size in sizes:
+        rng = random.Random(0)
+        rows = [(imis, 'First%d' % rng.randrange(size), 'Last%d' % rng.randrange(size),
+                 rng.random() < 0.9, '') for imis in range(size)]
+
+        for name, member_class, sort in (('Member', Member, lambda m: m.sort(key=lambda x: x.sort_key)),
+                                         ('legacy', LegacyMember, lambda m: m.sort())):
+            members, build_time, sort_time, built_memory, sorted_memory = \
+                _build_members(member_class, rows, sort, rng)
+            print('{0: >10} {1: >10} {2: >10.3f} {3: >10.3f} {4: >10.1f} {5: >12.0f} {6: >10.1f} {7: >12.0f}'.format(
+                size, name, build_time, sort_time, built_memory / 1e6, built_memory / float(size),
+                sorted_memory / 1e6, sorted_memory / float(size)))
+            del members
+
+
+def _draw_dates(count):
+    """
+    The dates of the last count bi-monthly draws, oldest first, as YYYYMMDD.
+    """
+    dates = []
+    year, month = 2016, 9
+    for _ in range(count):
+        dates.append('{0:04d}{1:02d}15'.format(year, month))
+        month -= 2
+        if month < 1:
+            year, month = year - 1, month + 12
+    return dates[::-1]
+
+
+def synthesize_files(size, dir_path, seed=0, name_generator=None):
+    """
+    Write an iMIS data file of size members and the member export that would
+    arrive for it the next month.  Names come from the census distributions
+    used by NameGenerator.
+
+    The data file has about 90% active members, and the winners of past draws
+    (about 6% of members, a few of them more than once).  The export drops
+    3% of the active members, brings back 2% of the inactive ones, changes
+    the last name of 1% and adds new members making up 4% of the size.
+
+    :param size: Number of members in the data file
+    :param dir_path: Directory to write data.csv and members.csv to
+    :param seed: Seed for the random number generator so runs are repeatable
+    :param name_generator: A NameGenerator with its data loaded, one is made if not given
+    :return: (data file path, member export path)
+    """
+    rng = random.Random(seed)
+    if name_generator is None:
+        name_generator = NameGenerator(DATA_DIR)
+        name_generator.load_data()
+
+    def names(chunk_size=100000):
+        # Draw the names in batches, about 90% of members are girls and women
+        chunk = 0
+        while True:
+            num_female = sum(1 for _ in range(chunk_size) if rng.random() < 0.9)
+            batch_seed = seed * 1000003 + 2 * chunk
+            female = name_generator.get_full_names(num_female, 'f', seed=batch_seed)
+            male = name_generator.get_full_names(chunk_size - num_female, 'm', seed=batch_seed + 1)
+            batch = list(zip(female['last'] + male['last'], female['first'] + male['first']))
+            rng.shuffle(batch)
+            for last_name, first_name in batch:
+                yield last_name.title(), first_name.title()
+            chunk += 1
+
+    name_iter = names()
+
+    def full_name():
+        return next(name_iter)
+
+    draw_dates = _draw_dates(12)
+    data_path = os.path.join(dir_path, 'data.csv')
+    member_path = os.path.join(dir_path, 'members.csv')
+    with open(data_path, 'w', newline='') as data_fp, open(member_path, 'w', newline='') as member_fp:
+        data_writer = csv.writer(data_fp)
+        member_writer = csv.writer(member_fp)
+        data_writer.writerow(ImisFile()._get_default_header_())
+        member_writer.writerow(['iMIS', 'Last Name', 'First Name'])
+
+        for imis in range(100000, 100000 + size):
+            last_name, first_name = full_name()
+            active = rng.random() < 0.9
+            dates = []
+            while rng.random() < (0.06 if len(dates) == 0 else 0.1):
+                dates.append(rng.choice(draw_dates))
+            data_writer.writerow([imis, last_name, first_name, '1' if active else '0',
+                                  ':'.join(sorted(set(dates)))])
+
+            if (active and rng.random() >= 0.03) or (not active and rng.random() < 0.02):
+                if rng.random() < 0.01:
+                    last_name = full_name()[0]
+                member_writer.writerow([imis, last_name, first_name])
+
+        for imis in range(100000 + size, 100000 + size + size // 25):
+            last_name, first_name = full_name()
+            member_writer.writerow([imis, last_name, first_name])
+
+    return data_path, member_path
+
+
+def _run_suite_operations(data_path, member_path, out_path, measure_memory):
+    """
+    Run each of the suite operations once.
+    :return dict: {operation: seconds} or {operation: peak bytes} if measure_memory
+    """
+    results = {}
+
+    @contextlib.contextmanager
+    def measure(operation):
+        if measure_memory:
+            tracemalloc.start()
+        start = time.perf_counter()
+        yield
+        if measure_memory:
+            results[operation] = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        else:
+            results[operation] = time.perf_counter() - start
+
+    with measure('read'):
+        imis_file = ImisFile(data_path)
+    with measure('merge'):
+        imis_file.merge(member_path)
+    with measure('write'):
+        imis_file.write(out_path)
+    del imis_file
+
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        with measure('select'):
+            imisSelector.select_numbers(out_path, 10, use_all=True)
+    return results
+
+
+def _scaling(results):
+    """
+    The scaling exponent of each operation between consecutive sizes, the k
+    in time ~ size^k.  1 is linear, 2 is quadratic.
+    """
+    scaling = {}
+    for operation in SUITE_OPERATIONS:
+        points = sorted((r['size'], r['seconds']) for r in results if r['operation'] == operation)
+        scaling[operation] = []
+        for (size1, time1), (size2, time2) in zip(points, points[1:]):
+            if size2 > size1 and time1 > 0 and time2 > 0:
+                scaling[operation].append({'from': size1, 'to': size2,
+                                           'exponent': math.log(time2 / time1) / math.log(float(size2) / size1)})
+    return scaling
+
+
+def bench_suite(sizes, measure_memory=True, output=None, baseline=None, seed=0):
+    """
+    Synthesize iMIS data files of each size and time ImisFile.read, merge,
+    write and imisSelector.select_numbers on them.  Peak memory is measured
+    with tracemalloc in a separate run so it doesn't slow down the timings.
+    """
+    name_generator = NameGenerator(DATA_DIR)
+    name_generator.load_data()
+
+    results = []
+    print('{0: >10} {1: >8} {2: >10} {3: >12} {4: >10}'.format('members', 'op', 'time (s)', 'rows/s', 'peak MB'))
+    for size in sizes:
+        dir_path = tempfile.mkdtemp()
+        try:
+            data_path, member_path = synthesize_files(size, dir_path, seed, name_generator)
+            out_path = os.path.join(dir_path, 'merged.csv')
+            times = _run_suite_operations(data_path, member_path, out_path, False)
+            memory = _run_suite_operations(data_path, member_path, out_path, True) if measure_memory else {}
+        finally:
+            shutil.rmtree(dir_path)
+
+        for operation in SUITE_OPERATIONS:
+            result = {'size': size, 'operation': operation, 'seconds': times[operation],
+                      'rows_per_second': size / times[operation] if times[operation] > 0 else None,
+                      'peak_bytes': memory.get(operation)}
+            results.append(result)
+            print('{0: >10} {1: >8} {2: >10.3f} {3: >12.0f} {4: >10}'.format(
+                size, operation, result['seconds'], result['rows_per_second'] or 0,
+                '{0:.1f}'.format(result['peak_bytes'] / 1e6) if result['peak_bytes'] is not None else ''))
+
+    report = {'version': imisSelector.__version__,
+              'python': platform.python_version(),
+              'platform': platform.platform(),
+              'results': results,
+              'scaling': _scaling(results)}
+
+    for operation, points in report['scaling'].items():
+        for point in points:
+            print('{0: >8} {1: >10} -> {2: <10} size^{3:.2f}'.format(operation, point['from'], point['to'],
+                                                                  point['exponent']))
+
+    if baseline is not None:
+        _compare(results, baseline)
+    if output is not None:
+        with open(output, 'w') as fp:
+            json.dump(report, fp, indent=2)
+    return report
+
+
+def _compare(results, baseline_path):
+    """
+    Print how the results compare with a report from an earlier run, a ratio
+    above 1 means this run was slower.
+    """
+    with open(baseline_path) as fp:
+        baseline = dict(((r['size'], r['operation']), r) for r in json.load(fp)['results'])
+
+    print('{0: >10} {1: >8} {2: >10} {3: >10}'.format('members', 'op', 'time', 'memory'))
+    for result in results:
+        old = baseline.get((result['size'], result['operation']))
+        if old is None:
+            continue
+        time_ratio = result['seconds'] / old['seconds'] if old['seconds'] else float('nan')
+        memory_ratio = ''
+        if result['peak_bytes'] is not None and old.get('peak_bytes'):
+            memory_ratio = '{0:.2f}x'.format(result['peak_bytes'] / float(old['peak_bytes']))
+        print('{0: >10} {1: >8} {2: >9.2f}x {3: >10}'.format(result['size'], result['operation'],
+                                                          time_ratio, memory_ratio))
+
+
+def import_time(cli_args=('--version',), runs=5):
+    """
+    Time how long the command line spends importing modules when it is run
+    with cli_args, using python -X importtime in a fresh interpreter for
+    each run.  The byte code is compiled by a first run that isn't counted.
+    :param cli_args: The command line arguments
+    :param runs: The number of runs to take the median of
+    :return: (median milliseconds importing imisSelector and the modules the command imported,
+              set of the modules imported)
+    """
+    code = 'import sys, imisSelector\ntry:\n    imisSelector.main(sys.argv[1:])\nexcept SystemExit:\n    pass'
+    package_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ)
+    env.pop('PYTHONDONTWRITEBYTECODE', None)
+
+    times = []
+    modules = set()
+    for run in range(runs + 1):
+        result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code] + list(cli_args),
+                                cwd=package_dir, env=env, stdout=subprocess.DEVNULL,
+                                stderr=subprocess.PIPE, universal_newlines=True)
+        total_us = 0
+        started = False
+        for line in result.stderr.splitlines():
+            if not line.startswith('import time:') or '|' not in line:
+                continue
+            _, cumulative, name = line[len('import time:'):].split('|')
+            if name.strip() == 'imisSelector':
+                started = True
+            if started:
+                modules.add(name.strip())
+                if not name[1:].startswith(' '):
+                    # Only the top level imports, the others are part of them
+                    total_us += int(cumulative)
+        if run > 0:
+            times.append(total_us / 1000.0)
+    return statistics.median(times), modules
+
+
+def bench_import_time(cli_args, runs):
+    median_ms, modules = import_time(cli_args, runs)
+    print('imisSelector {0}: {1:.1f} ms importing, budget {2} ms'.format(' '.join(cli_args), median_ms,
+                                                                           IMPORT_BUDGET_MS))
+    if median_ms > IMPORT_BUDGET_MS:
+        print('Over budget by {0:.1f} ms'.format(median_ms - IMPORT_BUDGET_MS))
+    loaded = sorted(module for module in DATA_MODULES if module in modules)
+    if loaded:
+        print('Data modules loaded: ' + ', '.join(loaded))
+
+
+def main(cli_args):
+    parser = argparse.ArgumentParser(description='iMIS selector benchmarks.')
+    subparsers = parser.add_subparsers(dest='benchmark')
+    parser_merge = subparsers.add_parser('merge', help='Time ImisFile.merge.')
+    parser_merge.add_argument('-s', '--sizes', type=int, nargs='+', default=[100000, 1000000],
+                              help='Number of members in the data file.')
+    parser_merge.add_argument('--legacy-max', type=int, dest='legacy_max', default=10000,
+                              help='Largest size to run the quadratic legacy merge for.')
+    parser_members = subparsers.add_parser('members', help='Time and measure Member.')
+    parser_members.add_argument('-s', '--sizes', type=int, nargs='+', default=[1000000],
+                                help='Number of members to create.')
+    parser_suite = subparsers.add_parser('suite', help='Time read, merge, write and select on synthetic files.')
+    parser_suite.add_argument('-s', '--sizes', type=int, nargs='+', default=[10000, 100000],
+                              help='Number of members in the data files, 10000 to 10000000.')
+    parser_suite.add_argument('-o', '--output', dest='output', default=None,
+                              help='File to write the results to as JSON.')
+    parser_suite.add_argument('--baseline', dest='baseline', default=None,
+                              help='JSON results of an earlier run to compare with.')
+    parser_suite.add_argument('--no-memory', action='store_false', dest='memory',
+                              help='Skip measuring peak memory.')
+    parser_suite.add_argument('--seed', type=int, dest='seed', default=0,
+                              help='Seed for the synthetic data.')
+    parser_import = subparsers.add_parser('importtime', help='Time the imports made starting the command line.')
+    parser_import.add_argument('-r', '--runs', type=int, dest='runs', default=5,
+                               help='Number of runs to take the median of.')
+    parser_import.add_argument('cli_args', nargs=argparse.REMAINDER,
+                               help='Arguments to run the command line with, --version by default.')
+    args = parser.parse_args(cli_args)
+
+    if args.benchmark == 'suite':
+        bench_suite(args.sizes, args.memory, args.output, args.baseline, args.seed)
+    elif args.benchmark == 'merge':
+        bench_merge(args.sizes, args.legacy_max)
+    elif args.benchmark == 'members':
+        bench_members(args.sizes)
+    elif args.benchmark == 'importtime':
+        cli_args = args.cli_args[1:] if args.cli_args[:1] == ['--'] else args.cli_args
+        bench_import_time(cli_args or ['--version'], args.runs)
+    else:
+        parser.print_help()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -5,9 +5,17 @@ __licence__ = '????'
 # Losely based on code developed by Trey Hunner at https://github.com/treyhunner/names
 
 import os
-from random import random
+import random as _random
+from random import random, choice
 from bisect import bisect
 
+# NumPy is optional, with it batches of names are drawn with searchsorted over
+# the cumulative frequencies, without it from a Walker alias table.
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 class SingletonMetaClass(type):
     def __init__(cls, name, bases, dict):
         super(SingletonMetaClass, cls).__init__(name, bases, dict)
@@ -110,7 +118,7 @@ class NameGenerator(object):
         :return: dict{ 'last', <last name>, 'first', <first name>}
         """
         if gender is None:
-            gender = random.choice(('male', 'female'))
+            gender = choice(('male', 'female'))
 
         if gender.lower() == 'female' or gender.lower() == 'f':
             gender = 'F'
@@ -121,23 +129,101 @@ class NameGenerator(object):
 
         assert(gender in ['F', 'M'])
 
-        last_name = first_name = ''
-        if self._last_names is None or self._female_names is None or self._male_names is None:
-            last_name = self._get_name_from_file(os.path.join(self.data_dir, self._last_file_name))
-            if gender == 'F':
-                first_name = self._get_name_from_file(os.path.join(self.data_dir, self._female_file_name))
-            else:
-                first_name = self._get_name_from_file(os.path.join(self.data_dir, self._male_file_name))
+        if not self._is_loaded():
+            # Read the data files once rather than for every name
+            self.load_data()
+
+        last_name = self._get_name_from_data(self._last_names)
+        if gender == 'F':
+            first_name = self._get_name_from_data(self._female_names)
         else:
-            last_name = self._get_name_from_data(self._last_names)
-            if gender == 'F':
-                first_name = self._get_name_from_data(self._female_names)
-            else:
-                first_name = self._get_name_from_data(self._male_names)
+            first_name = self._get_name_from_data(self._male_names)
 
         return { 'last': last_name,
                  'first': first_name}
 
+    def get_full_names(self, count, gender=None, seed=None):
+        """
+        Generate count random names in one call, much faster than calling
+        get_full_name count times.  The names follow the same distributions.
+        :param count int: The number of names
+        :param gender str: One of 'male', 'm', 'female', or 'f', if not given each
+                           name's gender is chosen randomly
+        :param seed: Seed for the random number generator so the names are repeatable
+        :return: dict{ 'last', [<last name>, ...], 'first', [<first name>, ...]}
+        """
+        if gender is not None:
+            if gender.lower() == 'female' or gender.lower() == 'f':
+                gender = 'F'
+            elif gender.lower() == 'male' or gender.lower() == 'm':
+                gender = 'M'
+            else:
+                raise Exception('Invalid gender provided: ' + str(gender))
+
+        if not self._is_loaded():
+            self.load_data()
+
+        if numpy is not None:
+            rng = numpy.random.default_rng(seed)
+            is_female = rng.random(count) < 0.5 if gender is None \
+                else numpy.full(count, gender == 'F')
+            first_names = numpy.empty(count, dtype=object)
+            first_names[is_female] = self._sample(self._female_names, int(is_female.sum()), rng)
+            first_names[~is_female] = self._sample(self._male_names, count - int(is_female.sum()), rng)
+            first_names = first_names.tolist()
+        else:
+            rng = _random.Random(seed)
+            female = self._sample(self._female_names, count, rng) if gender != 'M' else None
+            male = self._sample(self._male_names, count, rng) if gender != 'F' else None
+            if gender is None:
+                rand = rng.random
+                first_names = [f if rand() < 0.5 else m for f, m in zip(female, male)]
+            else:
+                first_names = female if gender == 'F' else male
+
+        return { 'last': self._sample(self._last_names, count, rng),
+                 'first': first_names}
+
+    def _is_loaded(self):
+        return len(self._last_names) > 0 and len(self._female_names) > 0 and len(self._male_names) > 0
+
+    @staticmethod
+    def _weights(data):
+        """
+        The weight of each name, the step in the cumulative percentages.  The
+        cumulative values read from the files aren't always increasing, names
+        where they go down get no weight.
+        """
+        weights = []
+        prev_cumulative = 0.0
+        for cumulative in data['cumulatives']:
+            weights.append(max(cumulative - prev_cumulative, 0.0))
+            prev_cumulative = max(cumulative, prev_cumulative)
+        return weights
+
+    def _sample(self, data, count, rng):
+        """
+        Draw count names from the distribution in data.  The tables used are
+        built the first time and kept in data.
+        :param data{}: Dictionary with 'names' and 'cumulatives' see _file_reader
+        :param count: The number of names
+        :param rng: numpy Generator when numpy is used, random.Random otherwise
+        :return: list of names
+        """
+        if numpy is not None:
+            if 'np_cumulatives' not in data:
+                data['np_names'] = numpy.array(data['names'], dtype=object)
+                data['np_cumulatives'] = numpy.cumsum(self._weights(data))
+            cumulatives = data['np_cumulatives']
+            index = numpy.searchsorted(cumulatives, rng.random(count) * cumulatives[-1], side='right')
+            numpy.minimum(index, len(cumulatives) - 1, out=index)
+            return data['np_names'][index].tolist()
+
+        if 'alias' not in data:
+            data['alias'] = _AliasTable(self._weights(data))
+        names = data['names']
+        return [names[index] for index in data['alias'].sample(count, rng)]
+
 
     def _get_name_from_file(self, file_name):
         """
@@ -155,7 +241,7 @@ class NameGenerator(object):
             for line in fp:
                 name, percentage, cumulative_percentage, rank = line.split()
                 names.append(name)
-                cumulative_scores.append(cumulative_percentage)
+                cumulative_scores.append(float(cumulative_percentage))
 
         max = float(cumulative_scores[-1])
         random_value = random() * max
@@ -179,3 +265,47 @@ class NameGenerator(object):
         return names[index]
 
 
+class _AliasTable(object):
+    """
+    Walker's alias method, after an O(n) set up each value is drawn from a
+    discrete distribution in O(1) with two random numbers.
+    """
+
+    def __init__(self, weights):
+        """
+        :param weights: The (not necessarily normalized) weight of each value
+        """
+        size = len(weights)
+        total = float(sum(weights))
+        scaled = [weight * size / total for weight in weights]
+        self.probability = [0.0] * size
+        self.alias = list(range(size))
+
+        small = [i for i, p in enumerate(scaled) if p < 1.0]
+        large = [i for i, p in enumerate(scaled) if p >= 1.0]
+        while small and large:
+            less, more = small.pop(), large.pop()
+            self.probability[less] = scaled[less]
+            self.alias[less] = more
+            scaled[more] -= 1.0 - scaled[less]
+            if scaled[more] < 1.0:
+                small.append(more)
+            else:
+                large.append(more)
+        for i in small + large:
+            # Only left over through rounding errors, these are (almost) 1
+            self.probability[i] = 1.0
+
+    def sample(self, count, rng):
+        """
+        :param count: The number of values to draw
+        :param rng: random.Random
+        :return: list of the indices of the values drawn
+        """
+        size = len(self.probability)
+        probability, alias, rand = self.probability, self.alias, rng.random
+        indices = []
+        for _ in range(count):
+            i = int(rand() * size)
+            indices.append(i if rand() < probability[i] else alias[i])
+        return indices
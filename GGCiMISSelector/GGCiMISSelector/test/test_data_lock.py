@@ -0,0 +1,164 @@
+__author__ = "Shannon Jaeger"
+
+import unittest
+import contextlib
+import multiprocessing
+import random
+import threading
+import imisSelector
+import number_selector
+from DataLock import DataLock, fcntl
+from ImisFile import ImisFile
+import os
+from test import TempDirTestCase
+
+NUM_MEMBERS = 300
+NUM_SELECTORS = 8
+SELECTS = 10
+DRAW_SIZE = 2
+
+
+def _quietly(function, *args):
+    """
+    Run a command in a child process without its output, the exit code
+    tells the test whether it failed.
+    """
+    try:
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            function(*args)
+    except BaseException:
+        import traceback
+        traceback.print_exc()
+        os._exit(1)
+    os._exit(0)
+
+
+def _selector(data_path, seed):
+    rng = random.Random(seed)
+    for _ in range(SELECTS):
+        # A small journal is compacted every few selects
+        imisSelector.select_numbers(data_path, DRAW_SIZE, rng=rng, compact_size=100)
+
+
+def _legacy_selector(data_path):
+    # number_selector reads the whole file and writes it back
+    for _ in range(SELECTS):
+        number_selector.main(data_path, DRAW_SIZE)
+
+
+def _merger(data_path, member_path):
+    for max_rows in (None, 50, None, 50):
+        imisSelector.update_data(data_path, member_path, make_backup=False, max_rows=max_rows)
+
+
+def _reader(data_path):
+    selected = 0
+    for _ in range(30):
+        counts = imisSelector.stats(data_path)
+        assert counts['total'] == NUM_MEMBERS and counts['active'] == NUM_MEMBERS, counts
+        assert counts['selected'] + counts['unselected'] == NUM_MEMBERS, counts
+        assert counts['selected'] >= selected, 'Selections went missing.'
+        selected = counts['selected']
+
+
+class TestDataLock(TempDirTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.data_path = self._write_file('data.csv', ['iMIS,Last Name,First Name,Active,Dates Selected'] +
+                                          ['{0},Name{0},First,1,'.format(imis)
+                                           for imis in range(1000, 1000 + NUM_MEMBERS)])
+
+    def test_version(self):
+        lock = DataLock(self.data_path)
+        self.assertEqual(lock.version(), 0)
+        with lock.exclusive():
+            with lock.exclusive(), lock.changing():
+                self.assertEqual(lock.version() % 2, 1, 'The stamp should be odd while the files change.')
+            self.assertEqual(lock.version(), 2)
+            # A read made holding the lock doesn't wait for it
+            self.assertEqual(lock.read(len, 'abc'), 3)
+        with self.assertRaises(RuntimeError):
+            with lock.shared(), lock.exclusive():
+                pass
+
+        # A read overlapping a change is made again
+        calls = []
+
+        def read():
+            calls.append(lock.version())
+            if len(calls) == 1:
+                with lock.exclusive(), lock.changing():
+                    pass
+            return len(calls)
+        self.assertEqual(lock.read(read), 2)
+        self.assertEqual(calls, [2, 4])
+
+    def test_missing_data_file(self):
+        missing_path = os.path.join(self.tmp_dir, 'missing.csv')
+        with self.assertRaises(FileNotFoundError):
+            with DataLock(missing_path).exclusive():
+                pass
+        self.assertEqual(imisSelector.main(['compact', '-i', missing_path]), -1)
+        self.assertFalse(os.path.exists(missing_path + '.lock'), 'A lock file was left for a missing data file.')
+
+        # A data file being created holding the lock
+        with DataLock(missing_path, create=True).exclusive():
+            pass
+        self.assertTrue(os.path.exists(missing_path + '.lock'))
+
+    @unittest.skipIf(fcntl is None, 'fcntl locks are only taken on Unix')
+    def test_shared_and_exclusive(self):
+        lock = DataLock(self.data_path)
+        results = {}
+
+        def try_lock(name, operation):
+            # Another thread opens the lock file itself, as another process would
+            fd = os.open(lock.file_path, os.O_RDWR)
+            try:
+                fcntl.flock(fd, operation | fcntl.LOCK_NB)
+                results[name] = True
+            except BlockingIOError:
+                results[name] = False
+            finally:
+                os.close(fd)
+
+        with lock.shared():
+            for name, operation in (('shared', fcntl.LOCK_SH), ('exclusive', fcntl.LOCK_EX)):
+                thread = threading.Thread(target=try_lock, args=(name, operation))
+                thread.start()
+                thread.join()
+        self.assertEqual(results, {'shared': True, 'exclusive': False})
+
+        with lock.exclusive():
+            thread = threading.Thread(target=try_lock, args=('while exclusive', fcntl.LOCK_SH))
+            thread.start()
+            thread.join()
+        self.assertFalse(results['while exclusive'])
+
+    @unittest.skipIf(fcntl is None, 'fcntl locks are only taken on Unix')
+    def test_concurrent_processes(self):
+        member_path = self._write_file('members.csv', ['iMIS,Last Name,First Name'] +
+                                       ['{0},Name{0},First'.format(imis) for imis in range(1000, 1000 + NUM_MEMBERS)])
+
+        processes = [multiprocessing.Process(target=_quietly, args=(_selector, self.data_path, seed))
+                     for seed in range(NUM_SELECTORS)]
+        processes.append(multiprocessing.Process(target=_quietly, args=(_merger, self.data_path, member_path)))
+        processes.append(multiprocessing.Process(target=_quietly, args=(_legacy_selector, self.data_path)))
+        processes.extend(multiprocessing.Process(target=_quietly, args=(_reader, self.data_path))
+                         for _ in range(2))
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join(60)
+        self.assertEqual([process.exitcode for process in processes], [0] * len(processes))
+
+        # Every selection was kept and no member was selected twice
+        members = ImisFile(self.data_path).members.values()
+        self.assertEqual(sum(member.times_selected for member in members), (NUM_SELECTORS + 1) * SELECTS * DRAW_SIZE)
+        self.assertEqual(max(member.times_selected for member in members), 1)
+        self.assertEqual(len(members), NUM_MEMBERS)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,206 @@
+__author__ = "Shannon Jaeger"
+
+import unittest
+import random
+import imisSelector
+from ExternalMerge import ExternalMerge
+from ImisFile import ImisFile
+from SelectionJournal import SelectionJournal
+import json
+import os
+from test import TempDirTestCase
+
+NAMES = ['Doe', 'doe', 'Smith', 'Brown', 'Adams', 'Clark', '']
+DATES = ['20140101', '20151123', '20161017']
+
+
+class _MeteredMerge(ExternalMerge):
+    """
+    ExternalMerge noting the most run files open, and rows buffered, at once.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._buffers = {}
+        self._writing = None
+        self.most_open = 0
+        self.most_buffered = 0
+        self.most_fds = 0
+
+    def _note(self):
+        writing = [] if self._writing is None else [self._writing]
+        self.most_open = max(self.most_open, len(self._buffers) + len(writing))
+        self.most_buffered = max(self.most_buffered, sum(self._buffers.values()) + sum(writing))
+        if os.path.isdir('/proc/self/fd'):
+            self.most_fds = max(self.most_fds, len(os.listdir('/proc/self/fd')))
+
+    def _read_batches(self, run_path):
+        try:
+            for batch in super()._read_batches(run_path):
+                self._buffers[run_path] = len(batch)
+                self._note()
+                yield batch
+        finally:
+            self._buffers.pop(run_path, None)
+
+    def _write_run(self, rows):
+        # A spilled run is held whole, a merged one a buffer at a time
+        self._writing = len(rows) if isinstance(rows, list) else self._buffer_rows()
+        self._note()
+        try:
+            return super()._write_run(rows)
+        finally:
+            self._writing = None
+
+
+class TestExternalMerge(TempDirTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.rng = random.Random(7)
+
+    def _random_rows(self, num_rows, with_dates):
+        rng = self.rng
+        rows = []
+        for _ in range(num_rows):
+            # Plenty of repeated iMIS numbers, so duplicates are folded
+            row = [str(rng.randrange(1000, 1000 + num_rows)), rng.choice(NAMES), rng.choice(NAMES),
+                   rng.choice(['1', '1', '0'])]
+            if with_dates:
+                row.append(':'.join(sorted(set(rng.sample(DATES, rng.randrange(3))))))
+            rows.append(','.join(row))
+        return rows
+
+    def _data_file(self, num_rows=200, sort=False):
+        rows = self._random_rows(num_rows, True)
+        if sort:
+            rows.sort(key=lambda row: int(row.split(',')[0]))
+        data_path = self._write_file('data.csv', ['iMIS,Last Name,First Name,Active,Dates Selected'] + rows)
+        SelectionJournal(data_path).append([(1005, '20161018'), (1006, '20140101'), (5, '20161018')])
+        return data_path
+
+    def _member_file(self, name, num_rows=150, sort=False):
+        rows = self._random_rows(num_rows, False)
+        if sort:
+            rows.sort(key=lambda row: int(row.split(',')[0]))
+        return self._write_file(name, ['iMIS,Last Name,First Name,Active'] + rows)
+
+    def _read(self, file_path):
+        with open(file_path) as fp:
+            return fp.read()
+
+    def _in_memory(self, data_path, new_data):
+        expected_path = os.path.join(self.tmp_dir, 'expected.csv')
+        imis_file = ImisFile(data_path)
+        imis_file.merge(new_data)
+        imis_file.write(expected_path)
+        return self._read(expected_path)
+
+    def test_same_as_in_memory_merge(self):
+        data_path = self._data_file()
+        member_path = self._member_file('members.csv')
+        expected = self._in_memory(data_path, member_path)
+
+        merged_path = os.path.join(self.tmp_dir, 'merged.csv')
+        for max_rows in (1, 7, 1000):
+            ExternalMerge(max_rows, self.tmp_dir).merge(data_path, member_path, merged_path)
+            self.assertEqual(self._read(merged_path), expected,
+                             'Merging out of core with {0} rows changed the result.'.format(max_rows))
+        self.assertEqual(os.listdir(self.tmp_dir).count('data.csv.journal'), 1)
+
+        # Merging into the data file compacts its journal
+        imisSelector.update_data(data_path, member_path, make_backup=True, max_rows=10)
+        self.assertEqual(self._read(data_path), expected)
+        self.assertFalse(SelectionJournal(data_path).exists())
+
+    def test_several_member_files(self):
+        data_path = self._data_file()
+        member_paths = [self._member_file('north.csv'), self._member_file('south.csv')]
+        expected = self._in_memory(data_path, ImisFile.from_files(member_paths, max_workers=1))
+
+        merged_path = os.path.join(self.tmp_dir, 'merged.csv')
+        ExternalMerge(13).merge(data_path, member_paths, merged_path)
+        self.assertEqual(self._read(merged_path), expected)
+
+    def test_sorted_input_not_sorted_again(self):
+        data_path = self._data_file(sort=True)
+        member_path = self._member_file('members.csv', sort=True)
+        expected = self._in_memory(data_path, member_path)
+
+        merged_path = os.path.join(self.tmp_dir, 'merged.csv')
+        merger = ExternalMerge(10)
+        merger.merge(data_path, member_path, merged_path)
+        self.assertEqual(self._read(merged_path), expected)
+
+        # Only the merged rows were sorted, into runs of 10 rows less two one row buffers
+        num_merged = len(self._read(merged_path).splitlines()) - 1
+        self.assertEqual(merger._run_rows(), 8)
+        self.assertEqual(merger._num_runs, (num_merged + 7) // 8)
+
+    def test_bounded_merge(self):
+        data_path = self._data_file(3000)
+        member_path = self._member_file('members.csv', 2500)
+        expected = self._in_memory(data_path, member_path)
+
+        merged_path = os.path.join(self.tmp_dir, 'merged.csv')
+        fds = len(os.listdir('/proc/self/fd')) if os.path.isdir('/proc/self/fd') else 0
+        merger = _MeteredMerge(50, self.tmp_dir)
+        merger.merge(data_path, member_path, merged_path)
+        self.assertEqual(self._read(merged_path), expected)
+
+        # Many more runs than are merged at once, merged in passes
+        self.assertGreater(merger._num_runs, 4 * merger.fan_in)
+        self.assertLessEqual(merger.most_buffered, 50)
+        self.assertLessEqual(merger.most_open, merger.fan_in + 2)
+        if fds > 0:
+            # The runs, the data file being written and the directory listed
+            self.assertLessEqual(merger.most_fds - fds, merger.fan_in + 4)
+
+        with self.assertRaises(ValueError):
+            ExternalMerge(50, fan_in=1)
+
+    def test_changeset(self):
+        data_path = self._data_file()
+        member_path = self._member_file('members.csv')
+        imis_file = ImisFile(data_path)
+        imis_file.merge(member_path, track_changes=True)
+        expected = list(imis_file.changeset.rows())
+        self.assertGreater(len(expected), 0)
+        expected_path = os.path.join(self.tmp_dir, 'expected_changes.csv')
+        imis_file.changeset.write(expected_path)
+
+        merged_path = os.path.join(self.tmp_dir, 'merged.csv')
+        merger = ExternalMerge(7, self.tmp_dir)
+        merger.merge(data_path, member_path, merged_path)
+        self.assertIsNone(merger.changeset, 'The changes were tracked without a file to write them to.')
+
+        # The changes are streamed to the file, only their counts are kept
+        changes_path = os.path.join(self.tmp_dir, 'changes.csv')
+        merger.merge(data_path, member_path, merged_path, changes_path)
+        self.assertEqual(self._read(changes_path), self._read(expected_path))
+        self.assertEqual(merger.changeset.counts(), imis_file.changeset.counts())
+
+        db_path = os.path.join(self.tmp_dir, 'data.db')
+        imisSelector.convert(data_path, db_path)
+        changes_path = os.path.join(self.tmp_dir, 'changes.jsonl')
+        imisSelector.update_data(db_path, member_path, make_backup=False, changes_path=changes_path)
+        with open(changes_path) as fp:
+            changes = [json.loads(line) for line in fp]
+        self.assertEqual([(change['change'], change['imis']) for change in changes],
+                         [row[:2] for row in expected])
+        self.assertEqual([(change['old_last_name'], change['old_first_name']) for change in changes
+                          if change['change'] == 'renamed'],
+                         [row[4:] for row in expected if row[0] == 'renamed'])
+
+        # As JSON lines streamed from a merge out of core
+        streamed_path = os.path.join(self.tmp_dir, 'streamed.jsonl')
+        imisSelector.update_data(data_path, member_path, make_backup=False, max_rows=7, changes_path=streamed_path)
+        self.assertEqual(self._read(streamed_path), self._read(changes_path))
+
+    def test_max_rows(self):
+        with self.assertRaises(ValueError):
+            ExternalMerge(0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,12 +1,13 @@
 __author__ = "Shannon Jaeger"
 
 import unittest
-from ImisFile import ImisFile
+import imisSelector
+from ImisFile import ImisFile, Member
 from Exceptions import *
 import os
+from test import TempDirTestCase
 
-class TestImisFiles(unittest.TestCase):
-
+class TestImisFiles(TempDirTestCase):
 
     def test_read(self):
         try:
@@ -78,6 +79,216 @@ class TestImisFiles(unittest.TestCase):
             self.fail('Unexpected exception thrown.')
 
 
+    def test_member_hashable(self):
+        members = {Member(123, 'Jane', 'Doe'), Member('123', 'Janet', 'Doe'), Member(456)}
+        self.assertEqual(len(members), 2, 'Members with the same iMIS number should hash the same.')
+        self.assertIn(Member(456), members)
+
+    def test_member_sort_key(self):
+        zoe = Member(1, 'Zoe', 'adams', True)
+        anne = Member(2, 'Anne', 'Brown', True)
+        old = Member(3, 'Jane', 'Zed', False)
+        self.assertEqual(sorted([anne, zoe, old]), [old, zoe, anne])
+        self.assertEqual(zoe.sort_key, (True, 'adams', 'zoe', 1))
+
+        zoe.last_name = 'Clark'
+        self.assertEqual(sorted([anne, zoe, old], key=lambda m: m.sort_key), [old, anne, zoe],
+                         'Sort key not updated when the name changed.')
+        old.active = True
+        self.assertEqual(sorted([anne, zoe, old]), [anne, zoe, old])
+
+        with self.assertRaises(AttributeError):
+            zoe.nickname = 'Z'
+
+    def test_read_duplicates_folded(self):
+        file_path = self._write_file('duplicates.csv',
+                                     ['iMIS,Last Name,First Name,Active,Dates Selected',
+                                      '100,Doe,Jane,1,20151123',
+                                      '200,Smith,John,0,',
+                                      '100,,,1,20160120:20151123',
+                                      '200,Smith,Johnny,1,20140101'])
+        imis_file = ImisFile(file_path)
+
+        self.assertEqual(len(imis_file.members), 2)
+        self.assertEqual(len(imis_file.active_member_list), 2)
+        self.assertEqual(len(imis_file.inactive_member_list), 0)
+
+        jane = imis_file.members[100]
+        self.assertEqual(jane.last_name, 'Doe')
+        self.assertEqual(jane.first_name, 'Jane')
+        self.assertEqual(jane.dates_selected, '20151123:20160120', 'Selection dates lost when folding.')
+
+        john = imis_file.members[200]
+        self.assertEqual(john.first_name, 'John')
+        self.assertTrue(john.active)
+        self.assertEqual(john.dates_selected, '20140101')
+
+    def test_read_inactive(self):
+        file_path = self._write_file('inactive.csv',
+                                     ['iMIS,Last Name,First Name,Active,Dates Selected',
+                                      '100,Doe,Jane,0,',
+                                      '200,Smith,John,1,'])
+        imis_file = ImisFile(file_path)
+        self.assertEqual([m.imis for m in imis_file.inactive_member_list], [100])
+        self.assertEqual([m.imis for m in imis_file.active_member_list], [200])
+
+    def test_merge(self):
+        data_path = self._write_file('data.csv',
+                                     ['iMIS,Last Name,First Name,Active,Dates Selected',
+                                      '100,Doe,Jane,1,20151123',
+                                      '200,Smith,John,1,',
+                                      '300,Brown,Anne,0,20140101'])
+        member_path = self._write_file('members.csv',
+                                       ['iMIS,Last Name,First Name',
+                                        '100,Doe-Ray,Jane',
+                                        '300,Brown,Anne',
+                                        '400,Adams,Zoe'])
+        imis_file = ImisFile(data_path)
+        self.assertTrue(imis_file.merge(member_path))
+
+        self.assertEqual([m.imis for m in imis_file.active_member_list], [400, 300, 100],
+                         'Active members should be sorted by name.')
+        self.assertEqual([m.imis for m in imis_file.inactive_member_list], [200])
+        self.assertEqual(imis_file.members[100].last_name, 'Doe-Ray', 'Name change not merged.')
+        self.assertEqual(imis_file.members[100].dates_selected, '20151123', 'Selection dates lost.')
+        self.assertEqual(imis_file.members[300].dates_selected, '20140101', 'Selection dates lost.')
+        self.assertFalse(imis_file.members[200].active)
+
+    def test_merge_imis_file_object(self):
+        data_path = self._write_file('data.csv',
+                                     ['iMIS,Last Name,First Name,Active,Dates Selected',
+                                      '100,Doe,Jane,1,'])
+        member_path = self._write_file('members.csv', ['iMIS', '200'])
+
+        imis_file = ImisFile(data_path)
+        imis_file.merge(ImisFile(member_path))
+        self.assertEqual([m.imis for m in imis_file.active_member_list], [200])
+        self.assertEqual([m.imis for m in imis_file.inactive_member_list], [100])
+
+        with self.assertRaises(ValueError):
+            imis_file.merge(42)
+
+    def test_merge_changeset(self):
+        data_path = self._write_file('data.csv',
+                                     ['iMIS,Last Name,First Name,Active,Dates Selected',
+                                      '100,Doe,Jane,1,20151123',
+                                      '200,Smith,John,1,',
+                                      '300,Brown,Anne,0,20140101',
+                                      '500,Clark,Ella,0,'])
+        member_path = self._write_file('members.csv',
+                                       ['iMIS,Last Name,First Name',
+                                        '100,Doe-Ray,Jane',
+                                        '300,Brown,Anne',
+                                        '400,Adams,Zoe'])
+        imis_file = ImisFile(data_path)
+        imis_file.merge(member_path)
+        self.assertIsNone(imis_file.changeset, 'The changes were tracked without being asked for.')
+        imis_file = ImisFile(data_path)
+        imis_file.merge(member_path, track_changes=True)
+        changeset = imis_file.changeset
+        self.assertEqual(changeset.joined, [(400, 'Adams', 'Zoe')])
+        self.assertEqual(changeset.lapsed, [(200, 'Smith', 'John')])
+        self.assertEqual(changeset.reactivated, [(300, 'Brown', 'Anne')])
+        self.assertEqual(changeset.renamed, [(100, 'Doe-Ray', 'Jane', 'Doe', 'Jane')])
+        self.assertEqual(changeset.counts(), {'joined': 1, 'lapsed': 1, 'reactivated': 1, 'renamed': 1})
+
+        changes_path = os.path.join(self.tmp_dir, 'changes.csv')
+        jsonl_path = os.path.join(self.tmp_dir, 'changes.jsonl')
+        self.assertEqual(imisSelector.main(['merge', '-i', data_path, '-m', member_path,
+                                            '--changes', changes_path]), 0)
+        with open(changes_path) as fp:
+            self.assertEqual(fp.read().splitlines(),
+                             ['Change,iMIS,Last Name,First Name,Old Last Name,Old First Name',
+                              'joined,400,Adams,Zoe,,',
+                              'lapsed,200,Smith,John,,',
+                              'reactivated,300,Brown,Anne,,',
+                              'renamed,100,Doe-Ray,Jane,Doe,Jane'])
+
+        # Merged again nothing changes
+        imisSelector.update_data(data_path, member_path, make_backup=False, changes_path=jsonl_path)
+        with open(jsonl_path) as fp:
+            self.assertEqual(fp.read(), '')
+
+    def test_merge_several_files(self):
+        data_path = self._write_file('data.csv',
+                                     ['iMIS,Last Name,First Name,Active,Dates Selected',
+                                      '100,Doe,Jane,1,20151123',
+                                      '200,Smith,John,1,',
+                                      '300,Brown,Anne,0,20140101'])
+        os.mkdir(os.path.join(self.tmp_dir, 'exports'))
+        self._write_file(os.path.join('exports', 'north.csv'), ['iMIS,Last Name,First Name',
+                                                                '100,Doe-Ray,Jane',
+                                                                '400,Adams,'])
+        self._write_file(os.path.join('exports', 'south.csv'), ['iMIS,Last Name,First Name',
+                                                                '300,Brown,Anne',
+                                                                '400,,Zoe'])
+        self._write_file(os.path.join('exports', 'notes.txt'), ['not a member list'])
+        export_dir = os.path.join(self.tmp_dir, 'exports')
+        file_paths = imisSelector.member_file_paths([export_dir])
+        self.assertEqual([os.path.basename(p) for p in file_paths], ['north.csv', 'south.csv'])
+
+        # Parsed in worker processes or not the result is the same
+        serial = ImisFile.from_files(file_paths, max_workers=1)
+        parallel = ImisFile.from_files(file_paths, max_workers=2)
+        self.assertEqual(sorted(m.as_list() for m in parallel.members.values()),
+                         sorted(m.as_list() for m in serial.members.values()))
+        self.assertEqual(serial.members[400].as_list(), ['400', 'Adams', 'Zoe', '1', ''])
+
+        imisSelector.update_data(data_path, [export_dir], make_backup=False)
+        imis_file = ImisFile(data_path)
+        self.assertEqual([m.imis for m in imis_file.active_member_list], [400, 300, 100])
+        self.assertEqual([m.imis for m in imis_file.inactive_member_list], [200])
+        self.assertEqual(imis_file.members[100].as_list(), ['100', 'Doe-Ray', 'Jane', '1', '20151123'])
+
+        empty_dir = os.path.join(self.tmp_dir, 'empty')
+        os.mkdir(empty_dir)
+        with self.assertRaises(NoImisFile):
+            imisSelector.update_data(data_path, empty_dir, make_backup=False)
+
+    def test_iter_rows(self):
+        file_path = self._write_file('rows.csv',
+                                     ['Dates Selected, Active ,iMIS,First Name',
+                                      '20151123,1,100,Jane',
+                                      ',,,',
+                                      '',
+                                      ',0,200'])
+        imis_file = ImisFile()
+        rows = imis_file.iter_rows(file_path)
+        self.assertEqual(next(rows), (100, '', 'Jane', True, '20151123'))
+        self.assertEqual(next(rows), (200, '', '', False, ''))
+        with self.assertRaises(StopIteration):
+            next(rows)
+        self.assertEqual(len(imis_file.members), 0, 'Streaming rows should not load the file.')
+
+        members = list(imis_file.iter_members(file_path))
+        self.assertEqual([m.imis for m in members], [100, 200])
+        self.assertEqual(members[0].first_name, 'Jane')
+
+    def test_iter_rows_legacy_layout(self):
+        # As written by number_selector.merge_files
+        file_path = self._write_file('legacy.csv',
+                                     ['IMIS,Last Name,First Name,Active,Selected 1,Selected 2,Selected 3,Selected 4\r',
+                                      ',,,,,,,\r',
+                                      '100,Doe,Jane,1,20141001,,20150601,\r',
+                                      '200,Smith,John,0,,,,\r',
+                                      '300,Brown,Anne,1,20141001\r'])
+        self.assertEqual(list(ImisFile().iter_rows(file_path)),
+                         [(100, 'Doe', 'Jane', True, '20141001:20150601'),
+                          (200, 'Smith', 'John', False, ''),
+                          (300, 'Brown', 'Anne', True, '20141001')])
+
+        file_path = self._write_file('export.csv', [' ID ,First  Name,Last Name', '400,Zoe,Adams'])
+        self.assertEqual(list(ImisFile().iter_rows(file_path)), [(400, 'Adams', 'Zoe', True, '')])
+
+    def test_iter_rows_empty_file(self):
+        file_path = os.path.join(os.path.dirname(__file__), 'data', 'empty_file.csv')
+        with self.assertRaises(InvalidImisFile):
+            list(ImisFile().iter_rows(file_path))
+
+        file_path = os.path.join(os.path.dirname(__file__), 'data', 'noheadings.csv')
+        with self.assertRaises(InvalidImisFile):
+            ImisFile(file_path)
+
 
 if __name__ == '__main__':
     unittest.main()
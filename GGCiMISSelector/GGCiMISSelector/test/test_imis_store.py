@@ -0,0 +1,131 @@
+__author__ = "Shannon Jaeger"
+
+import unittest
+import random
+import imisSelector
+from ImisFile import ImisFile
+from ImisStore import ImisStore
+from MemberStats import MemberStats
+from Exceptions import *
+import os
+from test import TempDirTestCase
+
+DATA_LINES = ['iMIS,Last Name,First Name,Active,Dates Selected',
+              '100,Doe,Jane,1,20151123',
+              '200,Smith,John,1,',
+              '300,Brown,Anne,0,20140101:20151123',
+              '500,Clark,Ella,1,']
+
+MEMBER_LINES = ['iMIS,Last Name,First Name',
+                '100,Doe-Ray,Jane',
+                '300,Brown,Anne',
+                '400,Adams,Zoe',
+                '500,,']
+
+class TestImisStore(TempDirTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.data_path = self._write_file('data.csv', DATA_LINES)
+        self.member_path = self._write_file('members.csv', MEMBER_LINES)
+
+    def _read_lines(self, file_path):
+        with open(file_path) as fp:
+            return fp.read().splitlines()
+
+    def test_no_database(self):
+        with self.assertRaises(NoImisFile):
+            ImisStore().count()
+
+    def test_round_trip(self):
+        db_path = os.path.join(self.tmp_dir, 'data.db')
+        with ImisStore(db_path) as store:
+            self.assertEqual(store.import_csv(self.data_path), 4)
+            self.assertEqual(store.count(), 4)
+            self.assertEqual(store.count(active=False), 1)
+            self.assertEqual(store.get_member(300).dates_selected, '20140101:20151123')
+            self.assertIsNone(store.get_member(999))
+
+        csv_path = os.path.join(self.tmp_dir, 'export.csv')
+        imisSelector.convert(db_path, csv_path)
+
+        imis_file = ImisFile(self.data_path)
+        expected_path = os.path.join(self.tmp_dir, 'expected.csv')
+        imis_file.write(expected_path)
+        self.assertEqual(sorted(self._read_lines(csv_path)), sorted(self._read_lines(expected_path)))
+
+    def test_merge_matches_imis_file(self):
+        imis_file = ImisFile(self.data_path)
+        imis_file.merge(self.member_path)
+        expected_path = os.path.join(self.tmp_dir, 'expected.csv')
+        imis_file.write(expected_path)
+
+        csv_path = os.path.join(self.tmp_dir, 'merged.csv')
+        with ImisStore(':memory:') as store:
+            store.import_csv(self.data_path)
+            self.assertTrue(store.merge(self.member_path))
+            store.export_csv(csv_path)
+
+        self.assertEqual(self._read_lines(csv_path), self._read_lines(expected_path))
+
+    def test_random_merge_matches_imis_file(self):
+        # Names differing in case, and 'ß' which lower() and casefold() order differently
+        names = ['Straße', 'STRASSE', 'strasse', 'Doe', 'doe', 'Éric', '']
+        dates = ['20140101', '20151123', '20161017']
+        rng = random.Random(5)
+
+        def rows(num_rows):
+            for _ in range(num_rows):
+                yield '{0},{1},{2},{3},{4}'.format(rng.randrange(1000, 1000 + num_rows), rng.choice(names),
+                                                   rng.choice(names), rng.choice('110'),
+                                                   ':'.join(sorted(rng.choices(dates, k=rng.randrange(3)))))
+        header = 'iMIS,Last Name,First Name,Active,Dates Selected'
+        data_path = self._write_file('random.csv', [header] + list(rows(300)))
+        # Members the new list has as inactive bring selection dates to fold in
+        member_path = self._write_file('random_members.csv', [header] + list(rows(300)))
+
+        imis_file = ImisFile(data_path)
+        imis_file.merge(member_path)
+        expected_path = os.path.join(self.tmp_dir, 'expected.csv')
+        imis_file.write(expected_path)
+
+        csv_path = os.path.join(self.tmp_dir, 'merged.csv')
+        with ImisStore(':memory:') as store:
+            store.import_csv(data_path)
+            store.merge(member_path)
+            store.export_csv(csv_path)
+            # times_selected is kept with the folded dates
+            self.assertEqual(store.stats(), MemberStats.from_members(imis_file.members.values()).as_dict())
+
+        self.assertEqual(self._read_lines(csv_path), self._read_lines(expected_path))
+
+    def test_select(self):
+        with ImisStore(':memory:') as store:
+            store.import_csv(self.data_path)
+
+            selected = store.select(2, date='20161017', rng=random.Random(1))
+            self.assertEqual(sorted(m.imis for m in selected), [200, 500])
+            self.assertEqual(store.get_member(200).dates_selected, '20161017')
+
+            with self.assertRaises(NotEnoughMembers):
+                store.select(1)
+
+            selected = store.select(3, use_all=True, date='20161018')
+            self.assertEqual(sorted(m.imis for m in selected), [100, 200, 500])
+            self.assertEqual(store.get_member(100).dates_selected, '20151123:20161018')
+
+    def test_select_tiered(self):
+        with ImisStore(':memory:') as store:
+            store.import_csv(self.data_path)
+
+            # Only 100 of the active members has been selected
+            selected = store.select(2, rng=random.Random(1), tier_threshold=50)
+            self.assertEqual(sorted(m.imis for m in selected), [200, 500])
+            selected = store.select(3, tier_threshold=100)
+            self.assertEqual(sorted(m.imis for m in selected), [100, 200, 500])
+            with self.assertRaises(NotEnoughMembers):
+                store.select(4, tier_threshold=100)
+
+
+if __name__ == '__main__':
+    unittest.main()
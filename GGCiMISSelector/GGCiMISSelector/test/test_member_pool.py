@@ -0,0 +1,112 @@
+__author__ = "Shannon Jaeger"
+
+import unittest
+import random
+import imisSelector
+from ImisFile import ImisFile, Member
+from MemberPool import MemberPool, TieredMemberPool, tier_level
+from Exceptions import *
+import os
+from test import TempDirTestCase
+
+class TestMemberPool(TempDirTestCase):
+
+    def test_draw_distinct(self):
+        pool = MemberPool([Member(imis) for imis in range(100)], random.Random(1))
+        drawn = pool.draw(60) + pool.draw(40)
+        self.assertEqual(len(set(drawn)), 100, 'The same member was drawn twice.')
+        self.assertEqual(len(pool), 0)
+
+    def test_draw_too_many(self):
+        pool = MemberPool([Member(imis) for imis in range(5)], random.Random(1))
+        with self.assertRaises(NotEnoughMembers):
+            pool.draw(6)
+        self.assertEqual(len(pool), 5, 'A failed draw should not change the pool.')
+        self.assertEqual(len(pool.draw(5)), 5)
+        with self.assertRaises(NotEnoughMembers):
+            pool.draw(1)
+
+    def test_from_imis_file(self):
+        imis_file = ImisFile()
+        imis_file.members = {1: Member(1, active=True),
+                             2: Member(2, active=True, dates_selected='20151123'),
+                             3: Member(3, active=False)}
+        imis_file._split_members()
+
+        self.assertEqual([m.imis for m in MemberPool.from_imis_file(imis_file).members], [1])
+        self.assertEqual(sorted(m.imis for m in MemberPool.from_imis_file(imis_file, use_all=True).members),
+                         [1, 2])
+
+    def test_tier_level(self):
+        self.assertEqual(tier_level({}, 50), 0)
+        self.assertEqual(tier_level({0: 10}, 50), 0)
+        self.assertEqual(tier_level({0: 6, 1: 4}, 50), 0)
+        self.assertEqual(tier_level({0: 5, 1: 5}, 50), 1)
+        self.assertEqual(tier_level({0: 1, 1: 5, 2: 4}, 40), 2)
+        self.assertEqual(tier_level({0: 1, 3: 9}, 90), 3)
+        self.assertEqual(tier_level({1: 3, 2: 1}, 100), 1)
+        self.assertEqual(tier_level({0: 9, 1: 1, 2: 1}, 0), 2)
+        with self.assertRaises(ValueError):
+            tier_level({0: 1}, 101)
+
+    def test_tiered_draw(self):
+        members = [Member(imis, active=True, dates_selected=['20151123'] * (imis % 3)) for imis in range(30)]
+
+        pool = TieredMemberPool(members, 70, random.Random(1))
+        self.assertEqual(pool.level, 0)
+        self.assertEqual(len(pool), 10)
+        drawn = pool.draw(10)
+        self.assertTrue(all(m.times_selected == 0 for m in drawn))
+        with self.assertRaises(NotEnoughMembers):
+            pool.draw(1)
+
+        pool = TieredMemberPool(members, 60, random.Random(1))
+        self.assertEqual(pool.level, 1)
+        drawn = pool.draw(20)
+        self.assertEqual(len(set(drawn)), 20, 'The same member was drawn twice.')
+        self.assertTrue(all(m.times_selected <= 1 for m in drawn))
+
+    def test_select_numbers(self):
+        file_path = os.path.join(self.tmp_dir, 'data.csv')
+        with open(file_path, 'w') as fp:
+            fp.write('iMIS,Last Name,First Name,Active,Dates Selected\n')
+            fp.write('100,Doe,Jane,1,20151123\n')
+            fp.write('200,Smith,John,1,\n')
+            fp.write('300,Brown,Anne,1,\n')
+            fp.write('400,Adams,Zoe,0,\n')
+
+        selected = imisSelector.select_numbers(file_path, 2, rng=random.Random(3))
+        self.assertEqual(sorted(m.imis for m in selected), [200, 300])
+
+        imis_file = ImisFile(file_path)
+        self.assertTrue(all(len(imis_file.members[imis].dates_selected) == 8 for imis in [200, 300]))
+
+        # Everyone active has been selected now
+        with self.assertRaises(NotEnoughMembers):
+            imisSelector.select_numbers(file_path, 1)
+        self.assertEqual(len(imisSelector.select_numbers(file_path, 3, use_all=True)), 3)
+
+
+    def test_select_numbers_tiered(self):
+        file_path = os.path.join(self.tmp_dir, 'data.csv')
+        with open(file_path, 'w') as fp:
+            fp.write('iMIS,Last Name,First Name,Active,Dates Selected\n')
+            fp.write('100,Doe,Jane,1,20141123:20151123\n')
+            fp.write('200,Smith,John,1,20151123\n')
+            fp.write('300,Brown,Anne,1,20151123\n')
+            fp.write('400,Adams,Zoe,0,\n')
+            fp.write('500,Clark,Ella,1,20141123:20151123\n')
+
+        # Half of the active members have been selected twice
+        with self.assertRaises(NotEnoughMembers):
+            imisSelector.select_numbers(file_path, 3, tier_threshold=60)
+        selected = imisSelector.select_numbers(file_path, 2, tier_threshold=60)
+        self.assertEqual(sorted(m.imis for m in selected), [200, 300])
+
+        self.assertEqual(imisSelector.main(['select', '-i', file_path, '-n', '2', '-t', '100']), 0)
+        self.assertEqual(imisSelector.main(['select', '-i', file_path, '-n', '1', '-t', '150']), -1)
+        with self.assertRaises(SystemExit):
+            imisSelector.main(['select', '-i', file_path, '-n', '1', '-t', '50', '-r'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,114 @@
+__author__ = "Shannon Jaeger"
+
+import unittest
+import random
+import contextlib
+import io
+import imisSelector
+import MemberTable as member_table
+from ImisFile import ImisFile
+from ImisStore import ImisStore
+from MemberStats import MemberStats
+from MemberTable import MemberTable
+from SelectionJournal import SelectionJournal
+from unittest import mock
+import os
+from test import TempDirTestCase
+
+DATA_LINES = ['iMIS,Last Name,First Name,Active,Dates Selected',
+              '100,Doe,Jane,1,20151123',
+              '200,Smith,John,1,',
+              '300,Brown,Anne,0,20140101:20151123',
+              '500,Clark,Ella,1,',
+              '600,Young,Ruth,1,',
+              '700,Hill,Mary,1,20140101:20160120']
+
+MEMBER_LINES = ['iMIS,Last Name,First Name',
+                '100,Doe,Jane',
+                '300,Brown,Anne',
+                '400,Adams,Zoe']
+
+
+class TestMemberStats(TempDirTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.data_path = self._write_file('data.csv', DATA_LINES)
+
+    def _check_saved(self):
+        """
+        The saved counts must be up to date and the same as counting again.
+        """
+        saved = MemberStats.load(self.data_path)
+        self.assertIsNotNone(saved, 'The saved counts were not kept up to date.')
+        self.assertEqual(saved.as_dict(), MemberStats.count(self.data_path).as_dict())
+        return saved.as_dict()
+
+    def test_count(self):
+        # Member 100 is selected again on the day it was first selected
+        SelectionJournal(self.data_path).append([(200, '20161017'), (100, '20151123')])
+        counts = MemberStats.count(self.data_path).as_dict()
+        self.assertEqual(counts, {'total': 6, 'active': 5, 'inactive': 1, 'inactive_selected': 1,
+                                  'selected': 3, 'unselected': 2, 'wins': {0: 2, 1: 1, 2: 2}})
+        self.assertEqual(counts, MemberTable.read(self.data_path).stats())
+
+        # Rows of the same member are folded together, in a MemberTable with
+        # NumPy and without it
+        self._write_file('data.csv', DATA_LINES + ['200,,,1,20160120'])
+        expected = MemberStats.from_members(ImisFile(self.data_path).members.values()).as_dict()
+        with mock.patch.object(MemberTable, 'read', wraps=MemberTable.read) as read:
+            self.assertEqual(MemberStats.count(self.data_path).as_dict(), expected)
+        self.assertEqual(read.call_count, 1)
+        with mock.patch.object(member_table, 'numpy', None):
+            self.assertEqual(MemberStats.count(self.data_path).as_dict(), expected)
+        self.assertEqual(expected['wins'], {0: 2, 2: 3})
+
+    def test_saved_counts(self):
+        self.assertIsNone(MemberStats.load(self.data_path))
+        # Nothing is saved until the counts are asked for
+        imisSelector.select_numbers(self.data_path, 1, rng=random.Random(1))
+        self.assertFalse(os.path.exists(self.data_path + '.stats'))
+
+        counts = imisSelector.stats(self.data_path)
+        self.assertEqual(counts['selected'], 3)
+        self.assertEqual(self._check_saved(), counts)
+
+        # Selecting, compacting and merging keep the saved counts up to date
+        imisSelector.select_draws(self.data_path, [1, 1], rng=random.Random(2))
+        self.assertEqual(self._check_saved()['unselected'], 0)
+        imisSelector.select_numbers(self.data_path, 2, use_all=True, rng=random.Random(3))
+        self._check_saved()
+        imisSelector.select_numbers(self.data_path, 1, use_all=True, rng=random.Random(4), compact_size=0)
+        self.assertFalse(SelectionJournal(self.data_path).exists())
+        self._check_saved()
+
+        member_path = self._write_file('members.csv', MEMBER_LINES)
+        imisSelector.update_data(self.data_path, member_path, make_backup=False)
+        self.assertEqual(self._check_saved()['active'], 3)
+        imisSelector.update_data(self.data_path, member_path, make_backup=False, max_rows=2)
+        self._check_saved()
+
+        # Changed some other way, they're counted again
+        self._write_file('data.csv', DATA_LINES[:2])
+        self.assertIsNone(MemberStats.load(self.data_path))
+        self.assertEqual(imisSelector.main(['stats', '-i', self.data_path]), 0)
+        self.assertEqual(self._check_saved()['total'], 1)
+
+    def test_stats_errors(self):
+        bad_path = self._write_file('bad.csv', ['Name,Council', 'Doe,Alberta'])
+        bad_store = self._write_file('bad.db', ['not a database'])
+        with contextlib.redirect_stdout(io.StringIO()) as output:
+            self.assertEqual(imisSelector.main(['stats', '-i', bad_path]), -1)
+            self.assertEqual(imisSelector.main(['stats', '-i', os.path.join(self.tmp_dir, 'missing.csv')]), -1)
+            self.assertEqual(imisSelector.main(['stats', '-i', bad_store]), -1)
+        self.assertIn('iMIS number column', output.getvalue())
+
+    def test_store_stats(self):
+        db_path = os.path.join(self.tmp_dir, 'data.db')
+        with ImisStore(db_path) as store:
+            store.import_csv(self.data_path)
+        self.assertEqual(imisSelector.stats(db_path), MemberStats.count(self.data_path).as_dict())
+
+
+if __name__ == '__main__':
+    unittest.main()
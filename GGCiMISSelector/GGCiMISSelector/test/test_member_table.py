@@ -0,0 +1,99 @@
+__author__ = "Shannon Jaeger"
+
+import unittest
+import random
+import MemberTable as member_table
+from ImisFile import ImisFile
+from MemberTable import MemberTable
+from Exceptions import *
+import os
+from test import TempDirTestCase
+
+DATA_LINES = ['iMIS,Last Name,First Name,Active,Dates Selected',
+              '100,Doe,Jane,1,20151123',
+              '200,Smith,John,1,',
+              '300,Brown,Anne,0,20140101:20151123',
+              '500,Clark,Ella,1,',
+              '200,,,1,20160120']
+
+MEMBER_LINES = ['iMIS,Last Name,First Name',
+                '100,Doe-Ray,Jane',
+                '300,Brown,Anne',
+                '400,Adams,Zoe',
+                '500,,']
+
+class TestMemberTable(TempDirTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.data_path = self._write_file('data.csv', DATA_LINES)
+        self.member_path = self._write_file('members.csv', MEMBER_LINES)
+        self.numpy = member_table.numpy
+
+    def tearDown(self):
+        member_table.numpy = self.numpy
+        super().tearDown()
+
+    def _read_lines(self, file_path):
+        with open(file_path) as fp:
+            return fp.read().splitlines()
+
+    def _with_and_without_numpy(self, test):
+        test()
+        if self.numpy is not None:
+            member_table.numpy = None
+            test()
+            member_table.numpy = self.numpy
+
+    def test_read_write(self):
+        table = MemberTable.read(self.data_path)
+        self.assertEqual(len(table), 4)
+        self.assertEqual(table.dates_selected[table.index_of(200)], '20160120')
+        self.assertEqual(table.last_selected[table.index_of(300)], 20151123)
+
+        table_path = os.path.join(self.tmp_dir, 'table.csv')
+        file_path = os.path.join(self.tmp_dir, 'file.csv')
+        table.write(table_path)
+        ImisFile(self.data_path).write(file_path)
+        self.assertEqual(self._read_lines(table_path), self._read_lines(file_path))
+
+        self.assertEqual(len(ImisFile(self.data_path).as_table()), 4)
+
+    def test_merge_matches_imis_file(self):
+        imis_file = ImisFile(self.data_path)
+        imis_file.merge(self.member_path)
+        file_path = os.path.join(self.tmp_dir, 'file.csv')
+        imis_file.write(file_path)
+
+        def test():
+            table = MemberTable.read(self.data_path)
+            self.assertTrue(table.merge(self.member_path))
+            table_path = os.path.join(self.tmp_dir, 'table.csv')
+            table.write(table_path)
+            self.assertEqual(self._read_lines(table_path), self._read_lines(file_path))
+        self._with_and_without_numpy(test)
+
+    def test_select(self):
+        def test():
+            table = MemberTable.read(self.data_path)
+            selected = table.select(1, date='20161017', rng=random.Random(1))
+            self.assertEqual([m.imis for m in selected], [500])
+            self.assertEqual(table.dates_selected[table.index_of(500)], '20161017')
+            self.assertEqual(table.times_selected[table.index_of(500)], 1)
+
+            with self.assertRaises(NotEnoughMembers):
+                table.select(1)
+            self.assertEqual(len(table.select(3, use_all=True)), 3)
+        self._with_and_without_numpy(test)
+
+    def test_stats(self):
+        def test():
+            table = MemberTable.read(self.data_path)
+            self.assertEqual(table.stats(), {'total': 4, 'active': 3, 'inactive': 1,
+                                             'inactive_selected': 1, 'selected': 2, 'unselected': 1,
+                                             'wins': {0: 1, 1: 2}})
+        self._with_and_without_numpy(test)
+
+
+if __name__ == '__main__':
+    unittest.main()
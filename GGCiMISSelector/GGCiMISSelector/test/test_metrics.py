@@ -0,0 +1,68 @@
+__author__ = "Shannon Jaeger"
+
+import unittest
+import contextlib
+import imisSelector
+import io
+import json
+import pstats
+from Metrics import Metrics, phase
+import os
+from test import TempDirTestCase
+
+DATA_LINES = ['iMIS,Last Name,First Name,Active,Dates Selected',
+              '100,Doe,Jane,1,20151123',
+              '200,Smith,John,1,',
+              '300,Brown,Anne,1,']
+
+class TestMetrics(TempDirTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.data_path = self._write_file('data.csv', DATA_LINES)
+
+    def test_disabled(self):
+        self.assertIsNone(Metrics.active)
+        with phase('read') as current:
+            current.rows = 10
+        self.assertIs(phase('write'), phase('read'), 'A phase was made while nothing is recorded.')
+
+    def test_nested_phases(self):
+        with Metrics() as metrics:
+            with phase('read') as reading:
+                with phase('build members') as building:
+                    data = [bytearray(1024) for _ in range(1024)]
+                    building.rows = len(data)
+                del data
+                reading.rows = 1024
+        self.assertIsNone(Metrics.active)
+
+        results = metrics.results()
+        self.assertEqual([(r['phase'], r['depth'], r['rows']) for r in results],
+                         [('read', 0, 1024), ('build members', 1, 1024)])
+        self.assertGreater(results[1]['peak_bytes'], 1024 * 1024)
+        self.assertGreaterEqual(results[0]['peak_bytes'], results[1]['peak_bytes'])
+        self.assertGreater(results[0]['rows_per_second'], 0)
+        self.assertIn('  build members', metrics.report())
+
+    def test_command_line(self):
+        metrics_path = os.path.join(self.tmp_dir, 'metrics.json')
+        cprofile_path = os.path.join(self.tmp_dir, 'select.prof')
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            self.assertEqual(imisSelector.main(['select', '-i', self.data_path, '-n', '1', '--no-index',
+                                                '--profile', '--metrics-out', metrics_path,
+                                                '--cprofile-out', cprofile_path]), 0)
+        self.assertIn('write journal', output.getvalue())
+
+        with open(metrics_path) as fp:
+            metrics = json.load(fp)
+        self.assertEqual(metrics['command'], 'select')
+        self.assertEqual([p['phase'] for p in metrics['phases']],
+                         ['read', 'build members', 'parse headings', 'sample', 'write journal'])
+        self.assertEqual(metrics['phases'][0]['rows'], 3)
+        self.assertGreater(pstats.Stats(cprofile_path).total_calls, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
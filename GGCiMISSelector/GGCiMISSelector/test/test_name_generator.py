@@ -0,0 +1,53 @@
+__author__ = "Shannon Jaeger"
+
+import unittest
+import test.name_generator as name_generator
+from test.name_generator import NameGenerator, _AliasTable
+from collections import Counter
+import os
+import random
+
+class TestNameGenerator(unittest.TestCase):
+
+    def setUp(self):
+        self.generator = NameGenerator(os.path.join(os.path.dirname(__file__), 'data'))
+        self.numpy = name_generator.numpy
+
+    def tearDown(self):
+        name_generator.numpy = self.numpy
+
+    def test_get_full_name(self):
+        # The data is loaded on first use
+        name = self.generator.get_full_name()
+        self.assertTrue(len(name['last']) > 0 and len(name['first']) > 0)
+        self.assertIn(self.generator.get_full_name('f')['first'], self.generator._female_names['names'])
+
+    def test_get_full_names(self):
+        for numpy in set([self.numpy, None]):
+            name_generator.numpy = numpy
+            names = self.generator.get_full_names(2000, 'm', seed=5)
+            self.assertEqual(len(names['last']), 2000)
+            self.assertEqual(len(names['first']), 2000)
+            self.assertTrue(set(names['first']) <= set(self.generator._male_names['names']))
+            self.assertEqual(names, self.generator.get_full_names(2000, 'm', seed=5),
+                             'The same seed should give the same names.')
+
+            # The most common names in the census come out on top
+            names = self.generator.get_full_names(20000, seed=1)
+            self.assertEqual(Counter(names['last']).most_common(1)[0][0], 'SMITH')
+            first_names = set(names['first'])
+            self.assertTrue(first_names & set(self.generator._male_names['names']))
+            self.assertTrue(first_names & set(self.generator._female_names['names']))
+
+        with self.assertRaises(Exception):
+            self.generator.get_full_names(1, 'x')
+
+    def test_alias_table(self):
+        table = _AliasTable([1.0, 0.0, 3.0])
+        counts = Counter(table.sample(40000, random.Random(1)))
+        self.assertNotIn(1, counts)
+        self.assertAlmostEqual(counts[2] / 40000.0, 0.75, delta=0.02)
+
+
+if __name__ == '__main__':
+    unittest.main()
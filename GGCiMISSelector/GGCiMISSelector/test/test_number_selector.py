@@ -0,0 +1,178 @@
+__author__ = "Shannon Jaeger"
+
+import unittest
+import random
+import contextlib
+import datetime
+import importlib
+import io
+import number_selector
+from DataLock import DataLock
+from ImisFile import ImisFile
+import os
+from test import TempDirTestCase
+
+LAST_NAMES = ['Smith', 'Brown', 'Tremblay', 'Martin', 'Roy', 'Wilson', 'MacDonald', 'Gagnon']
+FIRST_NAMES = ['Emma', 'Olivia', 'Chloe', 'Sophie', 'Ava', 'Zoe', 'Lily', 'Grace']
+DATES = ['20140915', '20141115', '20150115', '20150315', '20151123', '20160120']
+
+
+def _reference_merge_files(filename1, filename2, filename3):
+    """
+    The merge number_selector.merge_files made before it used ImisFile, the
+    debugging output left out, to compare the new engine against.
+    """
+    f1_data = number_selector.read_full_file(filename1)
+    f2_data = number_selector.read_full_file(filename2)
+
+    def column(columns, *names):
+        columns = [' '.join(heading.lower().split()) for heading in columns]
+        return next((columns.index(name) for name in names if name in columns), -1)
+
+    new_IMIS = column(f1_data['headings'], 'id', 'imis')
+    new_last_name = column(f1_data['headings'], 'last name')
+    new_first_name = column(f1_data['headings'], 'first name')
+    old_IMIS = column(f2_data['headings'], 'id', 'imis')
+    old_last_name = column(f2_data['headings'], 'last name')
+    old_first_name = column(f2_data['headings'], 'first name')
+    old_active = column(f2_data['headings'], 'active')
+
+    new_numbers = number_selector.get_number_list(f1_data['member_data'], new_IMIS)
+    old_numbers = number_selector.get_number_list(f2_data['member_data'], old_IMIS)
+    new_number_list = sorted(set(new_numbers + old_numbers))
+
+    data = []
+    new_data = f1_data['member_data']
+    old_data = f2_data['member_data']
+    for number in new_number_list:
+        new_row = [str(number)]
+        new_i = new_numbers.index(number) if number in new_numbers else -1
+        old_i = old_numbers.index(number) if number in old_numbers else -1
+
+        if new_i >= 0 and new_last_name >= 0:
+            new_row.append(new_data[new_i][new_last_name])
+        elif old_i >= 0 and old_last_name >= 0:
+            new_row.append(old_data[old_i][old_last_name])
+        else:
+            new_row.append('')
+        if new_i >= 0 and new_first_name >= 0:
+            new_row.append(new_data[new_i][new_first_name])
+        elif old_i >= 0 and old_first_name >= 0:
+            new_row.append(old_data[old_i][old_first_name])
+        else:
+            new_row.append('')
+        new_row.append('1' if new_i >= 0 else '0')
+
+        for j in range(1, 5):
+            if old_i >= 0 and old_active + j < len(old_data[old_i]):
+                new_row.append(old_data[old_i][old_active + j].replace('\n', ''))
+            else:
+                new_row.append('')
+        data.append(new_row)
+
+    with open(filename3, 'w', newline='') as fp:
+        fp.write('IMIS,Last Name,First Name,Active,Selected 1,Selected 2,Selected 3,Selected 4\r\n')
+        fp.write(',,,,,,,\r\n')
+        for row in data:
+            fp.write(','.join(row) + '\r\n')
+
+
+class TestNumberSelector(TempDirTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.rng = random.Random(11)
+
+    def _read(self, file_path):
+        with open(file_path, 'rb') as fp:
+            return fp.read()
+
+    def _legacy_files(self, size):
+        """
+        A data file of size members in the legacy layout and the member export
+        that arrives for it, which drops some members, brings some back and
+        adds new ones.  The export has a column after the names, as the iMIS
+        reports do, the legacy reader left the line ending on the last column.
+        """
+        rng = self.rng
+        data_lines = ['IMIS,Last Name,First Name,Active,Selected 1,Selected 2,Selected 3,Selected 4']
+        member_lines = ['iMIS,Last Name,First Name,Council']
+        imis_numbers = rng.sample(range(10000, 10000 + 3 * size), size + size // 10)
+        for imis in imis_numbers[:size]:
+            dates = sorted(rng.sample(DATES, rng.choice([0, 0, 0, 1, 2, 4])))
+            last_name = rng.choice(LAST_NAMES + [''])
+            data_lines.append(','.join([str(imis), last_name, rng.choice(FIRST_NAMES), rng.choice('10')] +
+                                       dates + [''] * (4 - len(dates))))
+        rng.shuffle(imis_numbers)
+        for imis in imis_numbers:
+            if rng.random() < 0.9:
+                member_lines.append('{0},{1},{2},Alberta'.format(imis, rng.choice(LAST_NAMES),
+                                                                 rng.choice(FIRST_NAMES)))
+        return self._write_file('data.csv', data_lines), self._write_file('members.csv', member_lines)
+
+    def test_import_has_no_side_effects(self):
+        cwd = os.getcwd()
+        output = io.StringIO()
+        try:
+            os.chdir(self.tmp_dir)
+            with contextlib.redirect_stdout(output):
+                importlib.reload(number_selector)
+        finally:
+            os.chdir(cwd)
+        self.assertEqual(output.getvalue(), '')
+        self.assertEqual(os.listdir(self.tmp_dir), [])
+
+    def test_merge_same_as_legacy(self):
+        data_path, member_path = self._legacy_files(3000)
+        expected_path = os.path.join(self.tmp_dir, 'expected.csv')
+        merged_path = os.path.join(self.tmp_dir, 'merged.csv')
+        _reference_merge_files(member_path, data_path, expected_path)
+        rows = number_selector.merge_files(member_path, data_path, merged_path)
+        self.assertEqual(self._read(merged_path), self._read(expected_path))
+        self.assertEqual(DataLock(merged_path).version(), 2, 'The merged file was not written holding its lock.')
+        self.assertEqual(len(rows), len(self._read(expected_path).splitlines()) - 2)
+
+        # The merged file reads back the same as the merge
+        imis_file = ImisFile(merged_path)
+        self.assertEqual([number_selector._legacy_row(imis_file.members[imis]) for imis in sorted(imis_file.members)],
+                         rows)
+
+    def test_select(self):
+        data_path = self._write_file('data.csv',
+                                     ['IMIS,Last Name,First Name,Active,Selected 1,Selected 2,Selected 3,Selected 4',
+                                      '100,Doe,Jane,1,20141001,20150601,,',
+                                      '200,Smith,John,0,20141001,,,',
+                                      '300,Brown,Anne,1,,,,',
+                                      '400,Adams,Zoe,1,,,,'])
+        file_data = number_selector.read_data_file(data_path)
+        self.assertEqual([row[0] for row in file_data['members']], ['100', '300', '400'])
+        self.assertEqual((file_data['selected'], file_data['inactive'], file_data['inactive_selected']), (1, 1, 1))
+
+        selected = number_selector.select_members(file_data, 2, random.Random(3))
+        self.assertEqual(sorted(selected), [1, 2], 'Only members never selected may be selected.')
+        number_selector.update_member_data([0], file_data['members'])
+        today = datetime.date.today().strftime('%Y%m%d')
+        self.assertEqual(file_data['members'][0][4:], ['20141001', '20150601', today, ''])
+
+        number_selector.update_imis_file(data_path, file_data['members'])
+        self.assertTrue(os.path.exists(data_path + '.bak'))
+        self.assertEqual(DataLock(data_path).version(), 2, 'The file was not written holding its lock.')
+        imis_file = ImisFile(data_path)
+        self.assertEqual(imis_file.members[100].dates_selected, '20141001:20150601:' + today)
+        self.assertEqual(imis_file.members[200].as_list(), ['200', 'Smith', 'John', '0', '20141001'],
+                         'Inactive members should be kept.')
+
+        number_selector.update_member_data([0], file_data['members'])
+        self.assertEqual(file_data['members'][0][4:], ['20141001', '20150601', today, ''],
+                         'A member should only be selected once a day.')
+
+        # More dates than Selected columns get columns of their own
+        file_data['members'][0][4:] = DATES[:5]
+        number_selector.update_imis_file(data_path, file_data['members'])
+        with open(data_path) as fp:
+            self.assertTrue(fp.readline().rstrip().endswith('Selected 4,Selected 5'))
+        self.assertEqual(ImisFile(data_path).members[100].dates_selected, ':'.join(DATES[:5]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+__author__ = "Shannon Jaeger"
+
+import unittest
+import random
+import imisSelector
+from ImisFile import ImisFile
+from RowIndex import RowIndex
+from SelectionJournal import SelectionJournal
+from Exceptions import *
+import os
+from test import TempDirTestCase
+
+DATA_LINES = ['iMIS,Last Name,First Name,Active,Dates Selected',
+              '100,Doe,Jane,1,20151123',
+              '200,Smith,John,1,',
+              '',
+              '300,Brown,Anne,0,',
+              '400,Adams,Zoe,1,',
+              '500,Clark,Ella,1,']
+
+class TestRowIndex(TempDirTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.data_path = self._write_file('data.csv', DATA_LINES)
+
+    def test_rows(self):
+        with RowIndex(self.data_path) as index:
+            self.assertTrue(os.path.exists(index.file_path))
+            self.assertTrue(index.usable)
+            self.assertEqual([index.row(i) for i in range(len(index))],
+                             list(ImisFile().iter_rows(self.data_path)))
+            self.assertEqual([index.row(i)[0] for i in index.pool()], [200, 400, 500])
+            self.assertEqual([index.row(i)[0] for i in index.pool(use_all=True)], [100, 200, 400, 500])
+
+    def test_draw(self):
+        with RowIndex(self.data_path) as index:
+            selected = index.draw(3, rng=random.Random(5))
+            self.assertEqual(sorted(m.imis for m in selected), [200, 400, 500])
+
+            # Members selected since the file was written are not eligible,
+            # unless selected members are being re-used
+            selections = {200: ['20161017'], 300: ['20161017']}
+            selected = index.draw(2, rng=random.Random(5), selections=selections)
+            self.assertEqual(sorted(m.imis for m in selected), [400, 500])
+            with self.assertRaises(NotEnoughMembers):
+                index.draw(3, selections=selections)
+
+            selected = index.draw(4, use_all=True, selections=selections)
+            self.assertEqual({m.imis: m.dates_selected for m in selected},
+                             {100: '20151123', 200: '20161017', 400: '', 500: ''})
+
+    def test_rebuilt_when_file_changes(self):
+        index = RowIndex(self.data_path)
+        index.open()
+        index.close()
+
+        self._write_file('data.csv', DATA_LINES[:-1] + ['500,Clark,Ella,0,', '600,Young,Amy,1,'])
+        with index:
+            self.assertEqual([index.row(i)[0] for i in index.pool()], [200, 400, 600])
+
+    def test_duplicates_not_usable(self):
+        self._write_file('data.csv', DATA_LINES + ['200,Smith,John,1,20161017'])
+        with RowIndex(self.data_path) as index:
+            self.assertFalse(index.usable)
+
+        # The whole file is read instead, and the duplicate folded
+        for _ in range(10):
+            selected = imisSelector.select_numbers(self.data_path, 2)
+            self.assertEqual(sorted(m.imis for m in selected), [400, 500])
+            SelectionJournal(self.data_path).remove()
+
+    def test_bare_carriage_returns_not_usable(self):
+        with open(self.data_path, 'w', newline='') as fp:
+            fp.write('\r'.join(DATA_LINES) + '\r')
+        with RowIndex(self.data_path) as index:
+            self.assertFalse(index.usable)
+        self.assertEqual(sorted(m.imis for m in imisSelector.select_numbers(self.data_path, 3)),
+                         [200, 400, 500])
+
+    def test_select_numbers(self):
+        selected = imisSelector.select_numbers(self.data_path, 2, rng=random.Random(1))
+        self.assertFalse(os.path.exists(self.data_path + '.snapshot'), 'The whole data file was read.')
+
+        remaining = imisSelector.select_numbers(self.data_path, 1)
+        self.assertEqual(sorted(m.imis for m in selected + remaining), [200, 400, 500])
+        with self.assertRaises(NotEnoughMembers):
+            imisSelector.select_numbers(self.data_path, 1)
+
+        imisSelector.compact(self.data_path)
+        imis_file = ImisFile(self.data_path)
+        self.assertEqual(sum(1 for m in imis_file.active_member_list if len(m.dates_selected) > 0), 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
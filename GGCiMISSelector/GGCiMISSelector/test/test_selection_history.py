@@ -0,0 +1,96 @@
+__author__ = "Shannon Jaeger"
+
+import unittest
+import contextlib
+import io
+import shutil
+import imisSelector
+from SelectionHistory import SelectionHistory, date_range, from_ordinal, to_ordinal
+from SelectionJournal import SelectionJournal
+import os
+from test import TempDirTestCase
+
+DATA_LINES = ['iMIS,Last Name,First Name,Active,Dates Selected',
+              '100,Doe,Jane,1,20151123:20160120',
+              '200,Smith,John,0,20151123',
+              '300,Brown,Anne,1,',
+              '400,Adams,Zoe,1,20161201',
+              '200,Smith,John,1,20160301']
+
+
+class TestSelectionHistory(TempDirTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.data_path = self._write_file('data.csv', DATA_LINES)
+
+    def test_dates(self):
+        self.assertEqual(from_ordinal(to_ordinal('20160229')), '20160229')
+        self.assertIsNone(to_ordinal('20150229'))
+        self.assertIsNone(to_ordinal(''))
+        self.assertEqual(date_range('2016-02'), (to_ordinal('20160201'), to_ordinal('20160229')))
+        self.assertEqual(date_range('2015'), (to_ordinal('20150101'), to_ordinal('20151231')))
+        with self.assertRaises(ValueError):
+            date_range('201513')
+
+    def test_queries(self):
+        history = SelectionHistory.open(self.data_path)
+        self.assertTrue(os.path.exists(history.file_path))
+
+        self.assertEqual(history.on(to_ordinal('20151123')), [100, 200])
+        self.assertEqual(history.between(*date_range('2016')),
+                         [(to_ordinal('20160120'), 100), (to_ordinal('20160301'), 200), (to_ordinal('20161201'), 400)])
+        self.assertEqual(history.count_between(*date_range('2016')), 3)
+        self.assertEqual(history.count_between(*date_range('201511')), 2)
+        self.assertEqual(history.count_between(*date_range('2014')), 0)
+        self.assertEqual([from_ordinal(ordinal) for ordinal in history.dates_of(200)], ['20151123', '20160301'])
+        self.assertEqual(history.dates_of(300), [])
+        self.assertEqual(history.dates_of(999), [])
+        self.assertEqual(history.name(400), ('Adams', 'Zoe'))
+        self.assertIsNone(history.name(999))
+
+        # Journal selections are added to the index loaded from disk
+        SelectionJournal(self.data_path).append([(300, '20161201'), (100, '20160120')])
+        history = SelectionHistory.open(self.data_path)
+        self.assertEqual(history.on(to_ordinal('20161201')), [300, 400])
+        self.assertEqual(history.count_between(*date_range('2016')), 5)
+        self.assertEqual(history.on(to_ordinal('20160120')), [100, 100], 'A second selection on a day was lost.')
+        self.assertEqual(len(history.dates_of(100)), 3)
+
+        # A re-written data file is indexed again
+        imisSelector.compact(self.data_path)
+        history = SelectionHistory.open(self.data_path)
+        self.assertEqual(history.count_between(*date_range('2016')), 5)
+        self.assertEqual(history.on(to_ordinal('20160120')), [100, 100])
+
+    def test_history_command(self):
+        self.assertEqual(imisSelector.history(self.data_path, date='201511'),
+                         [('20151123', 100), ('20151123', 200)])
+        self.assertEqual(imisSelector.history(self.data_path, start='20160201', count_only=True), 2)
+        self.assertEqual(imisSelector.history(self.data_path, imis=100),
+                         [('20151123', 100), ('20160120', 100)])
+        with self.assertRaises(ValueError):
+            imisSelector.history(self.data_path)
+
+        self.assertEqual(imisSelector.main(['history', '-i', self.data_path, '--to', '2015', '-c']), 0)
+        self.assertEqual(imisSelector.main(['history', '-i', self.data_path, '-d', '2016', '--to', '2017']), -1)
+        self.assertEqual(imisSelector.main(['history', '-i', self.data_path, '-d', '2016-13']), -1)
+
+        # A bound that wasn't given isn't printed
+        with contextlib.redirect_stdout(io.StringIO()) as output:
+            imisSelector.history(self.data_path, end='2015', count_only=True)
+            imisSelector.history(self.data_path, start='2016', count_only=True)
+        self.assertEqual(output.getvalue().splitlines(),
+                         ['Selections up to 20151231: 2', 'Selections from 20160101 on: 3'])
+
+    def test_history_errors(self):
+        empty_path = shutil.copy(os.path.join(os.path.dirname(__file__), 'data', 'empty_file.csv'), self.tmp_dir)
+        with contextlib.redirect_stdout(io.StringIO()) as output:
+            self.assertEqual(imisSelector.main(['history', '-i', os.path.join(self.tmp_dir, 'missing.csv'),
+                                                '-d', '2015']), -1)
+            self.assertEqual(imisSelector.main(['history', '-i', empty_path, '-d', '2015']), -1)
+        self.assertIn('missing.csv', output.getvalue())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,168 @@
+__author__ = "Shannon Jaeger"
+
+import unittest
+import random
+import contextlib
+import io
+import shutil
+import imisSelector
+from ImisFile import ImisFile
+from MemberTable import MemberTable
+from SelectionJournal import SelectionJournal
+from utilities import atomic_write
+from unittest import mock
+import os
+from test import TempDirTestCase
+
+DATA_LINES = ['iMIS,Last Name,First Name,Active,Dates Selected',
+              '100,Doe,Jane,1,20151123',
+              '200,Smith,John,1,',
+              '300,Brown,Anne,1,',
+              '400,Adams,Zoe,1,']
+
+class TestSelectionJournal(TempDirTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.data_path = self._write_file('data.csv', DATA_LINES)
+        self.journal = SelectionJournal(self.data_path)
+
+    def _read_data(self):
+        with open(self.data_path) as fp:
+            return fp.read()
+
+    def test_append_entries(self):
+        self.assertFalse(self.journal.exists())
+        self.assertEqual(list(self.journal.entries()), [])
+
+        self.journal.append([(200, '20161017'), (300, '20161017')])
+        self.journal.append([(200, '20161201')])
+        # A line only partly written before a crash
+        with open(self.journal.file_path, 'a') as fp:
+            fp.write('400,2016')
+
+        self.assertEqual(list(self.journal.entries()),
+                         [(200, '20161017'), (300, '20161017'), (200, '20161201')])
+        self.assertEqual(self.journal.selections(), {200: ['20161017', '20161201'], 300: ['20161017']})
+
+        # Selections recorded after the torn line are kept
+        self.journal.append([(300, '20161201')])
+        self.assertEqual(list(self.journal.entries())[-1], (300, '20161201'))
+        self.assertEqual(len(list(self.journal.entries())), 4)
+
+    def test_read_applies_journal(self):
+        self.journal.append([(100, '20151123'), (100, '20161017'), (200, '20161017'), (999, '20161017')])
+
+        imis_file = ImisFile(self.data_path)
+        self.assertEqual(imis_file.members[100].dates_selected, '20151123:20151123:20161017',
+                         'A second selection on the same day was lost.')
+        self.assertEqual(imis_file.members[200].dates_selected, '20161017')
+
+        table = MemberTable.read(self.data_path)
+        self.assertEqual(table.dates_selected[table.index_of(100)], '20151123:20151123:20161017')
+        self.assertEqual(table.times_selected[table.index_of(200)], 1)
+
+        # Writing somewhere else leaves the journal alone, writing the file compacts it
+        imis_file.write(os.path.join(self.tmp_dir, 'copy.csv'))
+        self.assertTrue(self.journal.exists())
+        imis_file.write()
+        self.assertFalse(self.journal.exists())
+        self.assertEqual(ImisFile(self.data_path).members[100].times_selected, 3)
+
+    def test_compaction_stamp(self):
+        self.journal.append([(200, '20161017')])
+        imis_file = ImisFile(self.data_path)
+
+        # A crash after the data file is replaced but before the journal is
+        # removed leaves the stamp naming the new data file
+        with mock.patch.object(SelectionJournal, 'remove'):
+            imis_file.write()
+        self.assertTrue(self.journal.exists())
+        self.assertEqual(list(self.journal.entries()), [])
+        self.assertEqual(ImisFile(self.data_path).members[200].times_selected, 1)
+
+        # Selections made after the stamp are still applied
+        self.journal.append([(200, '20161201')])
+        self.assertEqual(ImisFile(self.data_path).members[200].dates_selected, '20161017:20161201')
+
+        # A crash after the stamp but before the data file is replaced loses nothing
+        def crash(data_file_stat):
+            self.journal.stamp(data_file_stat)
+            raise RuntimeError('crash')
+        before = self._read_data()
+        with self.assertRaises(RuntimeError):
+            with atomic_write(self.data_path, before_replace=crash) as fp:
+                fp.write(before)
+        self.assertEqual(self._read_data(), before)
+        self.assertEqual(list(self.journal.entries()), [(200, '20161201')])
+
+    def test_same_day_selections(self):
+        with open(self.data_path, 'w') as fp:
+            fp.write(DATA_LINES[0] + '\n' + '200,Smith,John,1,\n')
+        for compact_size in (None, None, 0):
+            imisSelector.select_numbers(self.data_path, 1, use_all=True, compact_size=compact_size)
+        self.assertEqual(ImisFile(self.data_path).members[200].times_selected, 3)
+        self.assertEqual(imisSelector.stats(self.data_path)['wins'], {3: 1})
+
+    def test_select_appends_to_journal(self):
+        before = self._read_data()
+        selected = imisSelector.select_numbers(self.data_path, 2, rng=random.Random(2))
+        self.assertEqual(self._read_data(), before, 'The data file was re-written for a draw.')
+        self.assertEqual(sorted(imis for imis, _ in self.journal.entries()), sorted(m.imis for m in selected))
+
+        # The journal is compacted once it grows past the threshold
+        imisSelector.select_numbers(self.data_path, 1, make_backup=True, compact_size=0)
+        self.assertFalse(self.journal.exists())
+        self.assertTrue(os.path.exists(self.data_path + '.bk'))
+        imis_file = ImisFile(self.data_path)
+        self.assertEqual(sum(1 for m in imis_file.active_member_list if len(m.dates_selected) > 0), 4)
+
+    def test_select_draws(self):
+        before = self._read_data()
+        draws = imisSelector.select_draws(self.data_path, [1, 2], rng=random.Random(5))
+        self.assertEqual([len(members) for members in draws], [1, 2])
+        selected = [member.imis for members in draws for member in members]
+        self.assertEqual(len(set(selected)), 3, 'A member was selected in more than one draw.')
+        self.assertNotIn(100, selected)
+        self.assertEqual(self._read_data(), before, 'The data file was re-written for a draw.')
+        self.assertEqual(sorted(imis for imis, _ in self.journal.entries()), sorted(selected))
+
+        # All of the draws or none of them
+        with self.assertRaises(imisSelector.NotEnoughMembers):
+            imisSelector.select_draws(self.data_path, [0, 1], use_index=False)
+        self.assertEqual(len(list(self.journal.entries())), 3)
+
+        self.assertEqual(imisSelector.main(['select', '-i', self.data_path, '-r', '-s', '2', '1', '1']), 0)
+        self.assertEqual(imisSelector.main(['select', '-i', self.data_path, '-r', '-d', '5', '-n', '1']), -1)
+        self.assertEqual(imisSelector.main(['select', '-i', self.data_path, '-d', '0']), -1)
+        entries = list(self.journal.entries())
+        self.assertEqual(len(entries), 7)
+        self.assertEqual(len(set(imis for imis, _ in entries[3:])), 4)
+
+        # Files that aren't iMIS data are reported, not a traceback
+        data_dir = os.path.join(os.path.dirname(__file__), 'data')
+        with contextlib.redirect_stdout(io.StringIO()) as output:
+            for name in ('empty_file.csv', 'noheadings.csv'):
+                file_path = shutil.copy(os.path.join(data_dir, name), self.tmp_dir)
+                self.assertEqual(imisSelector.main(['select', '-i', file_path, '-n', '1']), -1)
+        self.assertEqual(len(output.getvalue().splitlines()), 2)
+
+    def test_compact(self):
+        self.journal.append([(200, '20161017')])
+        self.assertEqual(imisSelector.main(['compact', '-i', self.data_path]), 0)
+        self.assertFalse(self.journal.exists())
+        self.assertIn('200,Smith,John,1,20161017', self._read_data())
+        self.assertEqual(imisSelector.compact(self.data_path), 0)
+
+    def test_atomic_write(self):
+        before = self._read_data()
+        with self.assertRaises(RuntimeError):
+            with atomic_write(self.data_path) as fp:
+                fp.write('partial')
+                raise RuntimeError('crash')
+        self.assertEqual(self._read_data(), before)
+        self.assertEqual(os.listdir(self.tmp_dir), ['data.csv'], 'The temporary file was left behind.')
+
+
+if __name__ == '__main__':
+    unittest.main()
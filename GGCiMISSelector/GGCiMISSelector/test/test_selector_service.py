@@ -0,0 +1,100 @@
+__author__ = "Shannon Jaeger"
+
+import unittest
+import asyncio
+import contextlib
+import io
+import imisSelector
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from Exceptions import ServiceError
+from ImisFile import ImisFile
+from SelectionJournal import SelectionJournal
+from SelectorService import SelectorService, request
+import os
+from test import TempDirTestCase
+
+HEADER = 'iMIS,Last Name,First Name,Active,Dates Selected'
+
+
+class TestSelectorService(TempDirTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.socket_path = os.path.join(self.tmp_dir, 'selector.sock')
+        self.data_path = self._write_file('data.csv', [HEADER] +
+                                          ['{0},Last{0},First{0},{1},{2}'.format(imis, 1 if imis <= 40 else 0,
+                                                                                '20151123' if imis <= 5 else '')
+                                           for imis in range(1, 51)])
+        self.service = SelectorService(self.data_path, self.socket_path, poll_interval=0.05,
+                                       rng=random.Random(19))
+        self.thread = threading.Thread(target=asyncio.run, args=(self.service.serve_forever(),))
+        self.thread.start()
+        deadline = time.time() + 10
+        while not os.path.exists(self.socket_path):
+            self.assertTrue(self.thread.is_alive() and time.time() < deadline, 'The service did not start.')
+            time.sleep(0.01)
+
+    def tearDown(self):
+        if self.thread.is_alive():
+            request(self.socket_path, 'shutdown', timeout=10)
+            self.thread.join(10)
+        super().tearDown()
+
+    def _request(self, command, **arguments):
+        return request(self.socket_path, command, timeout=10, **arguments)
+
+    def test_reads(self):
+        # The same counts as the stats command, the win counts keyed by strings in JSON
+        with contextlib.redirect_stdout(io.StringIO()):
+            counts = imisSelector.stats(self.data_path)
+        self.assertEqual(self._request('stats'), dict(counts, wins={'0': 35, '1': 5}))
+        self.assertEqual(self._request('stats'), {'total': 50, 'active': 40, 'inactive': 10,
+                                                  'inactive_selected': 0, 'selected': 5, 'unselected': 35,
+                                                  'wins': {'0': 35, '1': 5}})
+        self.assertEqual(self._request('lookup', imis=3),
+                         {'imis': 3, 'last_name': 'Last3', 'first_name': 'First3', 'active': True,
+                          'dates_selected': '20151123'})
+        self.assertIsNone(self._request('lookup', imis=999))
+
+        with self.assertRaises(ServiceError):
+            self._request('drop')
+        with self.assertRaises(ServiceError):
+            self._request('lookup')
+
+    def test_concurrent_selects(self):
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            results = list(executor.map(lambda _: self._request('select', sizes=[2, 1]), range(8)))
+        selected = [member['imis'] for draws in results for members in draws for member in members]
+        self.assertEqual(len(selected), 24)
+        self.assertEqual(len(set(selected)), 24, 'A member was selected more than once.')
+        self.assertTrue(all(6 <= imis <= 40 for imis in selected))
+
+        # The selections are on disk and in memory
+        self.assertEqual(sorted(imis for imis, _ in SelectionJournal(self.data_path).entries()), sorted(selected))
+        self.assertEqual(self._request('stats')['unselected'], 35 - 24)
+
+        with self.assertRaises(ServiceError):
+            self._request('select', num=12)
+        self.assertEqual(len(self._request('select', num=11)[0]), 11)
+
+    def test_reload_on_change(self):
+        self.assertEqual(self._request('stats')['total'], 50)
+        # Written by another program
+        self._write_file('data.csv', [HEADER, '7,Seven,Lucky,1,'])
+        self.assertEqual(self._request('stats'), {'total': 1, 'active': 1, 'inactive': 0, 'inactive_selected': 0,
+                                                  'selected': 0, 'unselected': 1, 'wins': {'0': 1}})
+        SelectionJournal(self.data_path).append([(7, '20161017')])
+        self.assertEqual(self._request('lookup', imis=7)['dates_selected'], '20161017')
+
+    def test_merge(self):
+        members_path = self._write_file('members.csv', [HEADER, '1,Last1,First1,1,', '60,Sixty,New,1,'])
+        self.assertEqual(self._request('merge', members=[members_path])['active'], 2)
+        self.assertTrue(ImisFile(self.data_path).members[60].active)
+        self.assertEqual(self._request('lookup', imis=1)['dates_selected'], '20151123')
+
+
+if __name__ == '__main__':
+    unittest.main()
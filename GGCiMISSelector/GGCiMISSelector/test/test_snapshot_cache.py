@@ -0,0 +1,71 @@
+__author__ = "Shannon Jaeger"
+
+import unittest
+from ImisFile import ImisFile
+from SnapshotCache import SnapshotCache
+import os
+from test import TempDirTestCase
+
+DATA_LINES = ['iMIS,Last Name,First Name,Active,Dates Selected',
+              '100,Doe,Jane,1,20151123',
+              '200,Smith,John,1,',
+              '300,Brown,Anne,0,']
+
+class NoParseImisFile(ImisFile):
+    """
+    An ImisFile that fails if it has to parse the CSV.
+    """
+    def iter_rows(self, file_path=None):
+        raise AssertionError('The CSV file was parsed.')
+
+class TestSnapshotCache(TempDirTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.data_path = self._write_file('data.csv', DATA_LINES)
+        self.cache = SnapshotCache(self.data_path)
+
+    def test_no_cache(self):
+        ImisFile(self.data_path)
+        self.assertFalse(os.path.exists(self.cache.file_path))
+
+    def test_warm_read(self):
+        cold = ImisFile(self.data_path, use_cache=True)
+        self.assertTrue(os.path.exists(self.cache.file_path))
+
+        warm = NoParseImisFile(self.data_path, use_cache=True)
+        self.assertEqual([m.as_list() for m in warm.active_member_list + warm.inactive_member_list],
+                         [m.as_list() for m in cold.active_member_list + cold.inactive_member_list])
+
+    def test_hand_edit(self):
+        ImisFile(self.data_path, use_cache=True)
+
+        # Same size and modification time, only the digest tells them apart
+        st = os.stat(self.data_path)
+        with open(self.data_path, 'r+') as fp:
+            fp.seek(len(DATA_LINES[0]) + 1 + len('100,'))
+            fp.write('Roe')
+        os.utime(self.data_path, ns=(st.st_atime_ns, st.st_mtime_ns))
+
+        with self.assertRaises(AssertionError):
+            NoParseImisFile(self.data_path, use_cache=True)
+        self.assertEqual(ImisFile(self.data_path, use_cache=True).members[100].last_name, 'Roe')
+        self.assertEqual(NoParseImisFile(self.data_path, use_cache=True).members[100].last_name, 'Roe')
+
+    def test_write_refreshes_snapshot(self):
+        imis_file = ImisFile(self.data_path, use_cache=True)
+        imis_file.members[200].add_selection('20161017')
+        imis_file.write()
+
+        warm = NoParseImisFile(self.data_path, use_cache=True)
+        self.assertEqual(warm.members[200].dates_selected, '20161017')
+
+    def test_damaged_snapshot(self):
+        with open(self.cache.file_path, 'wb') as fp:
+            fp.write(b'not a snapshot')
+        self.assertEqual(len(ImisFile(self.data_path, use_cache=True).members), 3)
+        self.assertIsNotNone(SnapshotCache(self.data_path).load())
+
+
+if __name__ == '__main__':
+    unittest.main()
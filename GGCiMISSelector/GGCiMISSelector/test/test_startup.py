@@ -0,0 +1,28 @@
+__author__ = "Shannon Jaeger"
+
+import unittest
+from test.benchmark import DATA_MODULES, import_time
+
+class TestStartup(unittest.TestCase):
+
+    # Only which modules are imported is checked, the time they take depends on
+    # the machine and is measured by the importtime benchmark
+    def _check(self, cli_args):
+        _, modules = import_time(cli_args, runs=1)
+        self.assertIn('imisSelector', modules)
+        self.assertEqual([module for module in DATA_MODULES if module in modules], [],
+                         '"{0}" loaded data modules.'.format(' '.join(cli_args)))
+
+    def test_version(self):
+        self._check(['--version'])
+
+    def test_help(self):
+        self._check(['--help'])
+        self._check(['select', '--help'])
+
+    def test_argument_error(self):
+        self._check(['select', '-n', '3'])
+
+
+if __name__ == '__main__':
+    unittest.main()
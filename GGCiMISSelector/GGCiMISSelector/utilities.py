@@ -1,5 +1,9 @@
 __author__ = 'Shannon Jaeger'
 
+import contextlib
+import os
+import tempfile
+
 class SingletonMetaClass(type):
     def __init__(cls, name, bases, dict):
         super(SingletonMetaClass, cls).__init__(name, bases, dict)
@@ -10,4 +14,65 @@ class SingletonMetaClass(type):
                 cls.instance = original_new(cls, *args, **kwds)
                 return cls.instance
         cls.instance = None
-        cls.__new__ = staticmethod(my_new)
\ No newline at end of file
+        cls.__new__ = staticmethod(my_new)
+
+
+def fsync_dir(dir_path):
+    """
+    Flush a directory entry to disk so a file created, renamed or removed in
+    it survives a crash.  Not every platform can open a directory, those that
+    can't are skipped.
+    :param dir_path: The directory
+    :return: None
+    """
+    try:
+        fd = os.open(dir_path or '.', os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+@contextlib.contextmanager
+def atomic_write(file_path, mode='w', newline='', before_replace=None):
+    """
+    Open a file for writing so that it is either completely written or not
+    changed at all.  The data goes to a temporary file in the same directory
+    which is flushed to disk and then renamed over file_path, if an exception
+    is raised the temporary file is removed and file_path is left untouched.
+    :param file_path: The file to write
+    :param mode: 'w' to write text or 'wb' to write bytes
+    :param newline: Passed on to open() for text files
+    :param before_replace: Function called with the os.stat of the written file
+                           just before it replaces file_path, which the rename
+                           leaves unchanged
+    :return: the open temporary file
+    """
+    dir_path = os.path.dirname(os.path.abspath(file_path))
+    fd, tmp_path = tempfile.mkstemp(dir=dir_path, prefix='.' + os.path.basename(file_path) + '.')
+    try:
+        with (os.fdopen(fd, mode) if 'b' in mode else os.fdopen(fd, mode, newline=newline)) as fp:
+            yield fp
+            fp.flush()
+            os.fsync(fp.fileno())
+        if os.path.exists(file_path):
+            # Keep the permissions of the file being replaced
+            os.chmod(tmp_path, os.stat(file_path).st_mode & 0o7777)
+        else:
+            # mkstemp creates the file readable by the owner only, give it
+            # the permissions open() would have
+            umask = os.umask(0)
+            os.umask(umask)
+            os.chmod(tmp_path, 0o666 & ~umask)
+        if before_replace is not None:
+            before_replace(os.stat(tmp_path))
+        os.replace(tmp_path, file_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    fsync_dir(dir_path)